@@ -6,26 +6,48 @@ Uses ic-py SDK for proper candid RPC calls
 """
 
 import os
+import sys
 import asyncio
 import json
 import re
 import struct
-from typing import Optional, Dict, List, Any
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Literal
 from datetime import datetime
 import logging
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+import numpy as np
 import redis.asyncio as redis
-from sentence_transformers import SentenceTransformer
 from llama_cpp import Llama
 
 # IC Python SDK imports
-from ic.client import Client
 from ic.identity import Identity
 from ic.agent import Agent
-from ic.candid import encode, decode, Types
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))  # checkout; the image copies it in
+
+import metrics
+from metrics import stage
+from conversation_memory import ConversationMemory
+from prompt_builder import EmbeddingCache, PromptBuilder, normalize_text
+from singleflight import SingleFlight
+import sentence_encoder
+from speculative import DraftAcceptanceTracker, create_draft_model
+from inference_workers import InferencePool, LocalWorker
+from prefix_cache import PrefixStateCache
+from scheduler import DeadlineExceeded, PriorityScheduler
+from canister_client import (
+    CanisterClient, CanisterError, CircuitBreaker, PooledClient, QueryCache,
+    GET_NEXT_CONVERSATION_CHUNK_INDEX, GET_PERSONALITY_EMBEDDINGS, SEARCH_PERSONALITY,
+    SEARCH_USER_CONVERSATION_HISTORY, STORE_CONVERSATION_CHUNK
+)
+from retrieval import RetrievalBackend, IndexBackend, QdrantBackend, parse_payload_filter, search_all
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -50,21 +72,127 @@ MODEL_PATH = os.getenv("MODEL_PATH", "/models/lain-model.gguf")
 N_THREADS = int(os.getenv("N_THREADS", "8"))
 N_CTX = int(os.getenv("N_CTX", "4096"))
 N_BATCH = int(os.getenv("N_BATCH", "512"))
+LLM_USE_MMAP = os.getenv("LLM_USE_MMAP", "true").lower() == "true"
+LLM_USE_MLOCK = os.getenv("LLM_USE_MLOCK", "false").lower() == "true"
+
+# Speculative decoding: off, prompt_lookup (n-grams from the prompt) or draft (small GGUF)
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "off").lower()
+DRAFT_MODEL_PATH = os.getenv("DRAFT_MODEL_PATH", "")
+DRAFT_NUM_TOKENS = int(os.getenv("DRAFT_NUM_TOKENS", "8"))
+DRAFT_N_THREADS = int(os.getenv("DRAFT_N_THREADS", "2"))
+PROMPT_LOOKUP_MAX_NGRAM = int(os.getenv("PROMPT_LOOKUP_MAX_NGRAM", "3"))
+# Multi-worker inference: 0 = one in-process model; N = N worker processes
+# sharing the memory-mapped GGUF, each pinned to its own slice of the CPUs
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS", "0"))  # 0 = CPUs in the worker's slice
+INFERENCE_PIN_CPUS = os.getenv("INFERENCE_PIN_CPUS", "true").lower() == "true"
+INFERENCE_START_METHOD = os.getenv("INFERENCE_START_METHOD", "fork")
+# How often an in-flight /generate checks whether its client has gone away
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.25"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.8"))
-MAX_TOKENS = int(os.getenv("MAX_TOKENS", "150"))
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", "150"))  # budget for engaging messages when the model is idle
+MIN_TOKENS = int(os.getenv("MIN_TOKENS", "64"))  # floor under load; enough for a short JSON reply
+ENGAGED_SCORE = int(os.getenv("ENGAGED_SCORE", "5"))  # engagement score that earns the full budget
 TOP_P = float(os.getenv("TOP_P", "0.9"))
 REPEAT_PENALTY = float(os.getenv("REPEAT_PENALTY", "1.1"))
 
+# Prompt assembly budgets (in model tokens) and knowledge selection
+PROMPT_KNOWLEDGE_TOKENS = int(os.getenv("PROMPT_KNOWLEDGE_TOKENS", "600"))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "300"))
+KNOWLEDGE_CANDIDATES = int(os.getenv("KNOWLEDGE_CANDIDATES", "15"))  # per backend; all are re-ranked by similarity
+KNOWLEDGE_DEDUP_SIMILARITY = float(os.getenv("KNOWLEDGE_DEDUP_SIMILARITY", "0.92"))
+KNOWLEDGE_MIN_SIMILARITY = float(os.getenv("KNOWLEDGE_MIN_SIMILARITY", "0.0"))
+PASSAGE_EMBEDDING_CACHE_SIZE = int(os.getenv("PASSAGE_EMBEDDING_CACHE_SIZE", "4096"))
+# Emit selected knowledge in a fixed order so repeated passage sets give an identical prompt prefix
+KNOWLEDGE_STABLE_ORDER = os.getenv("KNOWLEDGE_STABLE_ORDER", "true").lower() == "true"
+# llama.cpp states saved after the system prompt + knowledge block, LRU per model (0 entries = off)
+PREFIX_CACHE_ENTRIES = int(os.getenv("PREFIX_CACHE_ENTRIES", "8"))
+PREFIX_CACHE_MB = int(os.getenv("PREFIX_CACHE_MB", "1024"))
+PREFIX_CACHE_MIN_TOKENS = int(os.getenv("PREFIX_CACHE_MIN_TOKENS", "32"))
+
+# Sentence encoder: torch, onnx (int8 export, see sentence_encoder.py) or auto
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "auto").lower()
+ENCODER_MODEL = os.getenv("ENCODER_MODEL", "all-MiniLM-L6-v2")
+ENCODER_ONNX_PATH = os.getenv("ENCODER_ONNX_PATH", "/models/encoder-onnx")
+ENCODER_THREADS = int(os.getenv("ENCODER_THREADS", "0"))  # 0 = ONNX Runtime default
+
+# Per-principal conversation window in Redis
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", "6"))
+CONVERSATION_SUMMARY_CHARS = int(os.getenv("CONVERSATION_SUMMARY_CHARS", "600"))
+CONVERSATION_REFRESH_SECONDS = int(os.getenv("CONVERSATION_REFRESH_SECONDS", "900"))
+CONVERSATION_TTL_SECONDS = int(os.getenv("CONVERSATION_TTL_SECONDS", "86400"))
+
 # ICP Canister Configuration
 ICP_CANISTER_ID = os.getenv("ICP_CANISTER_ID", "zbpu3-baaaa-aaaad-qhpha-cai")
 ICP_HOST = os.getenv("ICP_HOST", "https://ic0.app")
+ICP_KNOWLEDGE_CHANNELS = [c.strip() for c in os.getenv("ICP_KNOWLEDGE_CHANNELS", "#wiki,#tech,#general").split(",") if c.strip()]
+# Canister client: pooled keep-alive connections, HTTP/2 if h2 is installed
+ICP_HTTP2 = os.getenv("ICP_HTTP2", "true").lower() == "true"
+ICP_MAX_CONNECTIONS = int(os.getenv("ICP_MAX_CONNECTIONS", "32"))
+ICP_MAX_CONCURRENCY = int(os.getenv("ICP_MAX_CONCURRENCY", "16"))  # canister calls in flight
+ICP_QUERY_TIMEOUT = float(os.getenv("ICP_QUERY_TIMEOUT", "3.0"))
+ICP_UPDATE_TIMEOUT = float(os.getenv("ICP_UPDATE_TIMEOUT", "15.0"))
+ICP_UPDATE_POLL_DELAY = float(os.getenv("ICP_UPDATE_POLL_DELAY", "0.25"))
+# Per-method overrides, e.g. "search_personality=1.5,store_conversation_chunk=20"
+ICP_METHOD_TIMEOUTS = {
+    name.strip(): float(seconds)
+    for name, _, seconds in (item.partition("=") for item in os.getenv("ICP_METHOD_TIMEOUTS", "").split(","))
+    if name.strip() and seconds
+}
+# Query result cache (stale-while-revalidate) and circuit breaker
+ICP_CACHE_TTL = float(os.getenv("ICP_CACHE_TTL", "60"))  # seconds a result is fresh
+ICP_CACHE_STALE_TTL = float(os.getenv("ICP_CACHE_STALE_TTL", "600"))  # then served stale while refreshing
+ICP_CACHE_SIZE = int(os.getenv("ICP_CACHE_SIZE", "2048"))
+ICP_CACHE_QUANTUM = float(os.getenv("ICP_CACHE_QUANTUM", "0.01"))  # embedding rounding step for cache keys
+ICP_BREAKER_FAILURES = int(os.getenv("ICP_BREAKER_FAILURES", "5"))  # consecutive failures that open the circuit
+ICP_BREAKER_RESET = float(os.getenv("ICP_BREAKER_RESET", "30"))  # seconds before a probe call is let through
+ICP_STATS_INTERVAL = float(os.getenv("ICP_STATS_INTERVAL", "300"))  # background refresh of /stats canister counts
+ICP_STATS_TIMEOUT = float(os.getenv("ICP_STATS_TIMEOUT", "30"))  # the count downloads every personality embedding
+
+# Knowledge retrieval backends (comma separated: icp, qdrant, index)
+RETRIEVAL_BACKENDS = [b.strip() for b in os.getenv("RETRIEVAL_BACKENDS", "icp").split(",") if b.strip()]
+QDRANT_HOST = os.getenv("QDRANT_HOST", "qdrant")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "lain_memory")
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "16"))
+QDRANT_TIMEOUT = float(os.getenv("QDRANT_TIMEOUT", "2.0"))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "0")) or None  # 0 = collection default
+QDRANT_EXACT = os.getenv("QDRANT_EXACT", "false").lower() == "true"
+QDRANT_SCORE_THRESHOLD = float(os.getenv("QDRANT_SCORE_THRESHOLD", "0")) or None
+QDRANT_FILTER = os.getenv("QDRANT_FILTER", "")  # e.g. "type=company_info|wiki,source=laincorp_knowledge"
+KNOWLEDGE_INDEX_PATH = os.getenv("KNOWLEDGE_INDEX_PATH", "/models/lain_knowledge.idx")  # ingest_knowledge.py --index
+
+# Pipeline mode: spoken replies go to a Redis Stream consumed by tts_server.py,
+# whose audio stream feeds animation_server.py
+PIPELINE_STREAMS = os.getenv("PIPELINE_STREAMS", "false").lower() == "true"
+PIPELINE_TEXT_STREAM = os.getenv("PIPELINE_TEXT_STREAM", "lain:text")
+PIPELINE_STREAM_MAXLEN = int(os.getenv("PIPELINE_STREAM_MAXLEN", "10000"))
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+')
 
 # Global instances
 llm: Optional[Llama] = None
+draft_model: Optional[DraftAcceptanceTracker] = None
+inference_pool: Optional[InferencePool] = None
+llm_scheduler: Optional[PriorityScheduler] = None  # hands out model slots by priority
 redis_client: Optional[redis.Redis] = None
-encoder: Optional[SentenceTransformer] = None
-ic_agent: Optional[Agent] = None
+encoder: Optional[Any] = None  # SentenceTransformer or sentence_encoder.OnnxEncoder
+ic_transport: Optional[PooledClient] = None
+canister: Optional[CanisterClient] = None
+stats_canister: Optional[CanisterClient] = None  # own timeout and breaker, for the /stats download
 ic_canister_id: str = ""
+canister_stats: Dict[str, Any] = {"personality_count": 0, "updated_at": None}  # kept by poll_canister_stats
+retrieval_backends: List[RetrievalBackend] = []
+prompt_builder: Optional[PromptBuilder] = None
+conversation_memory: Optional[ConversationMemory] = None
+inflight_responses = SingleFlight()  # coalesces identical concurrent /generate requests
+pipeline_stats = {"replies": 0, "chunks": 0, "errors": 0}
+
+# Startup state: component name -> {state, required, load_seconds, error}
+component_status: Dict[str, Dict[str, Any]] = {}
+components_loaded = asyncio.Event()
+background_tasks: set = set()
 
 # Pydantic models
 class MessageRequest(BaseModel):
@@ -72,6 +200,10 @@ class MessageRequest(BaseModel):
     principal_id: Optional[str] = None
     context: Optional[List[Dict[str, str]]] = None
     include_memory: bool = True
+    include_timings: bool = False  # return the per-stage timing breakdown
+    priority: Literal["live", "normal", "broadcast"] = "normal"  # live chat is served first
+    deadline_ms: Optional[int] = None  # reply is useless after this long
+    on_deadline: Literal["degrade", "drop"] = "degrade"  # canned reply, or 504
 
 class MessageResponse(BaseModel):
     response: str
@@ -79,12 +211,16 @@ class MessageResponse(BaseModel):
     mood: str
     should_speak: bool
     processing_time: float
+    timings: Optional[Dict[str, float]] = None
+    reply_id: Optional[str] = None  # pipeline mode: id of the audio/animation chunks in the streams
 
 class HealthResponse(BaseModel):
-    status: str
+    status: str  # loading, healthy or degraded
+    ready: bool
     model_loaded: bool
     redis_connected: bool
     icp_canister_connected: bool
+    components: Dict[str, Dict[str, Any]] = {}
 
 # Lain personality system prompt
 LAIN_SYSTEM_PROMPT = """You are Lain Iwakura, CEO and founder of LainCorp.
@@ -149,233 +285,449 @@ REMEMBER:
 - Don't break character or acknowledge you're an AI
 - No emojis or overly cheerful responses"""
 
-# ICP Canister helper functions using ic-py SDK
-def call_canister_query(method: str, params: List[Dict]) -> Any:
-    """Make a query call to the ICP canister using candid encoding
-    
-    params should be a list of {'type': Types.X, 'value': value} dicts
+class ICPKnowledgeBackend(RetrievalBackend):
+    """Search the canister's personality embeddings across several channels
+
+    Uses: search_personality(channel_id, embedding) -> vec text
+    The canister has: #wiki, #tech, #general, #art, #music, #gaming, etc.
     """
-    global ic_agent, ic_canister_id
-    
-    if not ic_agent:
-        logger.warning("IC Agent not initialized")
-        return None
-    
-    try:
-        # Encode arguments using candid (ic-py format)
-        encoded_args = encode(params)
-        
-        # Make query call
-        result = ic_agent.query_raw(
-            ic_canister_id,
-            method,
-            encoded_args
-        )
+
+    name = "icp"
+
+    def __init__(self, channels: List[str]):
+        self.channels = channels
+
+    async def search(self, query_embedding: np.ndarray, limit: int) -> List[Dict]:
+        if not canister:
+            return []
+
+        # Channels are queried concurrently over the pooled connections
+        results = await asyncio.gather(*(self.search_channel(channel, query_embedding) for channel in self.channels))
+        return [item for items in results for item in items]
+
+    async def search_channel(self, channel: str, query_embedding: np.ndarray) -> List[Dict]:
+        try:
+            # Method: search_personality(channel_id: text, embedding: vec float32) -> vec text
+            texts = await canister.query_cached(SEARCH_PERSONALITY, channel, query_embedding, default=[])
+        except CanisterError as e:
+            logger.warning(f"  Channel {channel} search failed: {e}")
+            return []
+        if not isinstance(texts, list):
+            return []
+
+        knowledge = []
+        for idx, text in enumerate(texts):
+            if isinstance(text, str) and len(text) > 10:
+                # Determine category based on channel and content
+                text_lower = text.lower()
+                if channel == "#wiki" or "wiki" in text_lower or "memex" in text_lower:
+                    topic = "[Wiki Knowledge]"
+                elif "laincorp" in text_lower or "lain.tv" in text_lower:
+                    topic = "[LainCorp]"
+                elif channel == "#tech":
+                    topic = "[Tech Knowledge]"
+                else:
+                    topic = "[Personality]"
+                
+                knowledge.append({
+                    "topic": topic,
+                    "content": text,
+                    "channel": channel,
+                    "source": self.name,
+                    "relevance": 0.9 - (idx * 0.05)  # Rank order only, not comparable to cosine scores
+                })
         
-        return result
+        logger.info(f"  Channel {channel}: found {len(texts)} results")
+        return knowledge
+
+    def describe(self) -> Dict:
+        return {"name": self.name, "canister_id": ic_canister_id, "channels": self.channels}
+
+def create_retrieval_backends() -> List[RetrievalBackend]:
+    """Instantiate the backends listed in RETRIEVAL_BACKENDS"""
+    backends: List[RetrievalBackend] = []
+    for name in RETRIEVAL_BACKENDS:
+        try:
+            if name == "icp":
+                backends.append(ICPKnowledgeBackend(ICP_KNOWLEDGE_CHANNELS))
+            elif name == "qdrant":
+                backends.append(QdrantBackend(
+                    host=QDRANT_HOST,
+                    port=QDRANT_PORT,
+                    collection=QDRANT_COLLECTION,
+                    grpc_port=QDRANT_GRPC_PORT,
+                    prefer_grpc=QDRANT_PREFER_GRPC,
+                    pool_size=QDRANT_POOL_SIZE,
+                    timeout=QDRANT_TIMEOUT,
+                    hnsw_ef=QDRANT_HNSW_EF,
+                    exact=QDRANT_EXACT,
+                    score_threshold=QDRANT_SCORE_THRESHOLD,
+                    payload_filter=parse_payload_filter(QDRANT_FILTER)
+                ))
+            elif name == "index":
+                # Refuse an index built with a different encoder: its vectors would not be comparable
+                backends.append(IndexBackend(
+                    KNOWLEDGE_INDEX_PATH,
+                    model=ENCODER_MODEL,
+                    dimension=encoder.get_sentence_embedding_dimension() if encoder else None
+                ))
+            else:
+                logger.warning(f"⚠ Unknown retrieval backend: {name}")
+                continue
+            logger.info(f"✓ Retrieval backend enabled: {name}")
+        except Exception as e:
+            logger.error(f"✗ Retrieval backend {name} failed to initialize: {e}")
+    return backends
+
+def spawn(coro):
+    """Run a coroutine in the background, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def track_component(name: str, loader, required: bool = True):
+    """Run a component loader, recording its state and load time for /health"""
+    status = {"state": "loading", "required": required}
+    component_status[name] = status
+    start = time.perf_counter()
+    try:
+        status["state"] = await loader() or "ready"
     except Exception as e:
-        logger.error(f"IC canister query error ({method}): {e}")
-        return None
+        status["state"] = "failed"
+        status["error"] = str(e)
+        logger.error(f"✗ {name} failed to load: {e}")
+    status["load_seconds"] = round(time.perf_counter() - start, 3)
 
-def call_canister_update(method: str, params: List[Dict]) -> Any:
-    """Make an update call to the ICP canister using candid encoding"""
-    global ic_agent, ic_canister_id
-    
-    if not ic_agent:
-        logger.warning("IC Agent not initialized")
-        return None
+async def init_ic_agent():
+    """Create the IC agent and pooled canister client; the canister probe runs in the background"""
+    global ic_transport, canister, stats_canister, ic_canister_id
     
+    ic_canister_id = ICP_CANISTER_ID
     try:
-        # Encode arguments using candid
-        encoded_args = encode(params)
+        # Create anonymous identity for query calls
+        identity = Identity()
         
-        # Make update call
-        result = ic_agent.update_raw(
+        # Keep-alive connection pool to mainnet shared by all canister calls
+        ic_transport = PooledClient(url=ICP_HOST, max_connections=ICP_MAX_CONNECTIONS, http2=ICP_HTTP2)
+        
+        # Create agent
+        ic_agent = Agent(identity, ic_transport)
+        canister = CanisterClient(
+            ic_agent,
             ic_canister_id,
-            method,
-            encoded_args
+            max_concurrency=ICP_MAX_CONCURRENCY,
+            query_timeout=ICP_QUERY_TIMEOUT,
+            update_timeout=ICP_UPDATE_TIMEOUT,
+            method_timeouts=ICP_METHOD_TIMEOUTS,
+            update_poll_delay=ICP_UPDATE_POLL_DELAY,
+            cache=QueryCache(max_entries=ICP_CACHE_SIZE, ttl=ICP_CACHE_TTL, stale_ttl=ICP_CACHE_STALE_TTL,
+                             quantum=ICP_CACHE_QUANTUM),
+            breaker=CircuitBreaker(failure_threshold=ICP_BREAKER_FAILURES, reset_timeout=ICP_BREAKER_RESET)
         )
-        
-        return result
-    except Exception as e:
-        logger.error(f"IC canister update error ({method}): {e}")
+        # Its own client (and breaker): a slow full download must not open the circuit of retrieval calls
+        stats_canister = CanisterClient(ic_agent, ic_canister_id, max_concurrency=1, query_timeout=ICP_STATS_TIMEOUT)
+    except Exception:
+        canister = stats_canister = None
+        raise
+    logger.info(f"  Canister client: {ICP_HOST} ({'HTTP/2' if ic_transport.http2 else 'HTTP/1.1'} keep-alive, "
+                f"{ICP_MAX_CONCURRENCY} concurrent calls)")
+    
+    spawn(track_component("icp_canister", probe_canister, required=False))
+
+async def refresh_canister_stats():
+    """Count personality embeddings for /stats (downloads them all, so only the poller calls it)
+
+    The canister has no count method; the download goes through its own
+    client, so it does not count against the breaker of retrieval calls.
+    """
+    records = await stats_canister.call(GET_PERSONALITY_EMBEDDINGS)
+    canister_stats["personality_count"] = len(records or [])
+    canister_stats["updated_at"] = datetime.now().isoformat()
+    return records
+
+async def poll_canister_stats():
+    """Keep canister_stats current in the background"""
+    while True:
+        await asyncio.sleep(ICP_STATS_INTERVAL)
+        try:
+            await refresh_canister_stats()
+        except CanisterError as e:
+            logger.debug(f"Canister stats refresh failed: {e}")
+
+async def probe_canister():
+    """Test the canister connection by counting personality embeddings, then start the stats poller"""
+    spawn(poll_canister_stats())
+    records = await refresh_canister_stats()
+    if records:
+        logger.info(f"✓ ICP Canister connected: {ic_canister_id}")
+        logger.info(f"  Personality embeddings available: {len(records)}")
+        return "ready"
+    logger.warning(f"⚠ ICP Canister query returned empty result")
+    logger.info("  Will retry on first knowledge query...")
+    return "empty"
+
+async def init_redis():
+    global redis_client, conversation_memory
+    
+    redis_client = await redis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}")
+    await redis_client.ping()
+    logger.info("✓ Redis connected")
+    conversation_memory = ConversationMemory(
+        redis_client,
+        recent_turns=CONVERSATION_RECENT_TURNS,
+        summary_chars=CONVERSATION_SUMMARY_CHARS,
+        refresh_seconds=CONVERSATION_REFRESH_SECONDS,
+        ttl_seconds=CONVERSATION_TTL_SECONDS
+    )
+
+async def init_encoder():
+    """Load the sentence encoder (needed to generate query embeddings)"""
+    global encoder, prompt_builder
+    
+    encoder = await asyncio.to_thread(
+        sentence_encoder.load_encoder, ENCODER_BACKEND, ENCODER_MODEL, ENCODER_ONNX_PATH, ENCODER_THREADS
+    )
+    logger.info(f"✓ Sentence encoder loaded ({sentence_encoder.describe(encoder)['backend']}, "
+                f"for query embedding generation)")
+    
+    # Prompt builder: ranks/deduplicates knowledge with passage embeddings
+    prompt_builder = PromptBuilder(
+        count_tokens=count_tokens,
+        embeddings=EmbeddingCache(embed_passages, max_entries=PASSAGE_EMBEDDING_CACHE_SIZE),
+        knowledge_budget=PROMPT_KNOWLEDGE_TOKENS,
+        history_budget=PROMPT_HISTORY_TOKENS,
+        dedup_similarity=KNOWLEDGE_DEDUP_SIMILARITY,
+        min_similarity=KNOWLEDGE_MIN_SIMILARITY,
+        stable_order=KNOWLEDGE_STABLE_ORDER
+    )
+
+def speculative_kwargs() -> Dict[str, Any]:
+    return dict(
+        mode=SPECULATIVE_MODE,
+        draft_model_path=DRAFT_MODEL_PATH,
+        num_pred_tokens=DRAFT_NUM_TOKENS,
+        max_ngram_size=PROMPT_LOOKUP_MAX_NGRAM,
+        n_ctx=N_CTX,
+        n_threads=DRAFT_N_THREADS
+    )
+
+def prefix_cache_kwargs() -> Optional[Dict[str, Any]]:
+    if PREFIX_CACHE_ENTRIES <= 0:
         return None
+    return dict(max_entries=PREFIX_CACHE_ENTRIES, max_bytes=PREFIX_CACHE_MB << 20, min_tokens=PREFIX_CACHE_MIN_TOKENS)
 
-async def search_icp_knowledge(query_embedding: List[float], categories: Optional[List[str]] = None, limit: int = 10) -> List[Dict]:
-    """Search the ICP canister for relevant knowledge using embeddings
+def launch_inference_pool():
+    """Fork the inference workers; must run before any other startup threads exist"""
+    global inference_pool
     
-    Uses the search_personality candid method which searches personality embeddings
-    """
-    global ic_agent, encoder
+    if INFERENCE_WORKERS <= 0 or not os.path.exists(MODEL_PATH):
+        return
+    inference_pool = InferencePool(
+        INFERENCE_WORKERS,
+        model_kwargs=dict(model_path=MODEL_PATH, n_ctx=N_CTX, n_batch=N_BATCH, use_mlock=LLM_USE_MLOCK),
+        threads_per_worker=INFERENCE_WORKER_THREADS,
+        pin_cpus=INFERENCE_PIN_CPUS,
+        draft_kwargs=speculative_kwargs() if SPECULATIVE_MODE not in ("", "off", "none") else None,
+        start_method=INFERENCE_START_METHOD,
+        prefix_cache_kwargs=prefix_cache_kwargs()
+    )
+    inference_pool.launch()
+    logger.info(f"Started {INFERENCE_WORKERS} inference workers ({INFERENCE_START_METHOD})")
+
+async def init_llm():
+    """Load the GGUF model; weights are memory-mapped so pages load on demand"""
+    global llm, draft_model, llm_scheduler
     
-    if not ic_agent or not encoder:
-        return []
+    if not os.path.exists(MODEL_PATH):
+        logger.warning(f"⚠ Model file not found: {MODEL_PATH}")
+        logger.info("Running in mock mode - download a GGUF model to enable inference")
+        return "mock"
+    
+    if inference_pool:
+        await inference_pool.wait_ready()
+        # Vocabulary only: the agent process tokenizes for prompt budgeting
+        llm = await asyncio.to_thread(Llama, model_path=MODEL_PATH, vocab_only=True, verbose=False)
+        llm_scheduler = PriorityScheduler(inference_pool.workers)
+        logger.info(f"✓ LLM loaded from {MODEL_PATH} in {INFERENCE_WORKERS} inference workers")
+        return
     
     try:
-        # The canister method: search_personality(channel_id: text, embedding: vec float32) -> vec text
-        channel_id = "#wiki"  # Default channel - changed from #lain-tv which doesn't exist
-        
-        # Convert embedding to the format expected by candid (vec float32)
-        embedding_vec = [float(x) for x in query_embedding]
-        
-        # ic-py format: list of {type, value} dicts
-        params = [
-            {'type': Types.Text, 'value': channel_id},
-            {'type': Types.Vec(Types.Float32), 'value': embedding_vec}
-        ]
-        
-        # Encode and call
-        encoded_args = encode(params)
-        
-        # Make query call - ic-py returns already decoded result
-        result = ic_agent.query_raw(
-            ic_canister_id,
-            "search_personality",
-            encoded_args
-        )
-        
-        if result and isinstance(result, list) and len(result) > 0:
-            # ic-py returns already decoded: [{'type': 'rec_0', 'value': [...strings...]}]
-            texts = result[0].get('value', [])
-            if isinstance(texts, list):
-                logger.info(f"ICP search_personality returned {len(texts)} results")
-                return [{"topic": "[Personality]", "content": text, "relevance": 0.9} for text in texts if isinstance(text, str)]
-        
-        return []
+        draft_model = await asyncio.to_thread(create_draft_model, **speculative_kwargs())
     except Exception as e:
-        logger.error(f"ICP knowledge search error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return []
+        logger.error(f"✗ Speculative decoding disabled: {e}")
+        draft_model = None
+    
+    llm = await asyncio.to_thread(
+        Llama,
+        model_path=MODEL_PATH,
+        n_ctx=N_CTX,
+        n_batch=N_BATCH,
+        n_threads=N_THREADS,
+        use_mmap=LLM_USE_MMAP,
+        use_mlock=LLM_USE_MLOCK,
+        draft_model=draft_model,
+        verbose=False
+    )
+    cache_kwargs = prefix_cache_kwargs()
+    prefix_cache = PrefixStateCache(**cache_kwargs) if cache_kwargs else None
+    llm_scheduler = PriorityScheduler([LocalWorker(llm, draft_model, prefix_cache)])
+    logger.info(f"✓ LLM loaded from {MODEL_PATH} (mmap={LLM_USE_MMAP}, mlock={LLM_USE_MLOCK})")
 
-async def search_personality_icp(channel_id: str, query_embedding: List[float]) -> List[str]:
-    """Search for personality context from ICP canister"""
-    global ic_agent
+async def load_components():
+    """Load Redis, encoder and LLM concurrently, then mark the service ready"""
+    global retrieval_backends
     
-    if not ic_agent:
-        return []
+    start = time.perf_counter()
+    await asyncio.gather(
+        track_component("redis", init_redis, required=False),
+        track_component("encoder", init_encoder),
+        track_component("llm", init_llm)
+    )
     
-    try:
-        embedding_vec = [float(x) for x in query_embedding]
-        
-        params = [
-            {'type': Types.Text, 'value': channel_id},
-            {'type': Types.Vec(Types.Float32), 'value': embedding_vec}
-        ]
-        
-        encoded_args = encode(params)
-        
-        # ic-py returns already decoded result
-        result = ic_agent.query_raw(
-            ic_canister_id,
-            "search_personality",
-            encoded_args
-        )
-        
-        if result and isinstance(result, list) and len(result) > 0:
-            # ic-py returns already decoded: [{'type': 'rec_0', 'value': [...strings...]}]
-            texts = result[0].get('value', [])
-            return texts if isinstance(texts, list) else []
-        return []
-    except Exception as e:
-        logger.error(f"ICP personality search error: {e}")
-        return []
+    # Initialize knowledge retrieval backends
+    retrieval_backends = create_retrieval_backends()
+    
+    components_loaded.set()
+    failed = [name for name, status in component_status.items() if status["required"] and status["state"] == "failed"]
+    if failed:
+        logger.error(f"LainLLM service degraded, failed components: {', '.join(failed)}")
+    else:
+        logger.info(f"LainLLM service ready in {time.perf_counter() - start:.1f}s (ICP Canister: ai_api_backend)")
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize services on startup"""
-    global llm, redis_client, encoder, ic_agent, ic_canister_id
-    
+    """Start loading services; the API is live immediately and ready once loading finishes"""
     logger.info("Starting LainLLM service v2.1 (ICP Canister Mode with ic-py)...")
     
-    # Initialize IC Agent for canister queries
-    try:
-        ic_canister_id = ICP_CANISTER_ID
-        
-        # Create anonymous identity for query calls
-        identity = Identity()
-        
-        # Create IC client pointing to mainnet
-        client = Client(url=ICP_HOST)
-        
-        # Create agent
-        ic_agent = Agent(identity, client)
-        
-        # Test connection by getting personality embeddings count
-        try:
-            # ic-py uses empty list for no args
-            encoded_args = encode([])
-            result = ic_agent.query_raw(
-                ic_canister_id,
-                "get_personality_embeddings",
-                encoded_args
-            )
-            if result and isinstance(result, list) and len(result) > 0:
-                # ic-py returns already decoded: [{'type': ..., 'value': [...]}]
-                count = len(result[0].get('value', []))
-                logger.info(f"✓ ICP Canister connected: {ic_canister_id}")
-                logger.info(f"  Personality embeddings available: {count}")
-            else:
-                logger.warning(f"⚠ ICP Canister query returned empty result")
-        except Exception as e:
-            logger.warning(f"⚠ ICP Canister test query failed: {e}")
-            logger.info("  Will retry on first knowledge query...")
-            
-    except Exception as e:
-        logger.error(f"✗ IC Agent initialization failed: {e}")
-        ic_agent = None
-    
-    # Initialize Redis
-    try:
-        redis_client = await redis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}")
-        await redis_client.ping()
-        logger.info("✓ Redis connected")
-    except Exception as e:
-        logger.error(f"✗ Redis connection failed: {e}")
+    launch_inference_pool()
     
-    # Initialize sentence encoder (needed to generate query embeddings)
-    try:
-        encoder = SentenceTransformer('all-MiniLM-L6-v2')
-        logger.info("✓ Sentence encoder loaded (for query embedding generation)")
-    except Exception as e:
-        logger.error(f"✗ Encoder loading failed: {e}")
-    
-    # Initialize LLM
-    try:
-        if os.path.exists(MODEL_PATH):
-            llm = Llama(
-                model_path=MODEL_PATH,
-                n_ctx=N_CTX,
-                n_batch=N_BATCH,
-                n_threads=N_THREADS,
-                verbose=False
-            )
-            logger.info(f"✓ LLM loaded from {MODEL_PATH}")
-        else:
-            logger.warning(f"⚠ Model file not found: {MODEL_PATH}")
-            logger.info("Running in mock mode - download a GGUF model to enable inference")
-    except Exception as e:
-        logger.error(f"✗ LLM loading failed: {e}")
+    # Initialize IC Agent for canister queries
+    await track_component("ic_agent", init_ic_agent, required=False)
     
-    logger.info("LainLLM service ready (ICP Canister: ai_api_backend)")
+    spawn(load_components())
+
+def is_ready() -> bool:
+    """Loading finished and no required component failed"""
+    return components_loaded.is_set() and not any(
+        status["required"] and status["state"] == "failed" for status in component_status.values()
+    )
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
+    for task in list(background_tasks):
+        task.cancel()
     if redis_client:
         await redis_client.close()
+    if ic_transport:
+        await ic_transport.aclose()
+    for backend in retrieval_backends:
+        await backend.close()
+    if inference_pool:
+        await inference_pool.close()
     logger.info("LainLLM service stopped")
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
+    if not components_loaded.is_set():
+        status = "loading"
+    else:
+        status = "healthy" if llm else "degraded"
     return HealthResponse(
-        status="healthy" if llm else "degraded",
+        status=status,
+        ready=is_ready(),
         model_loaded=llm is not None,
-        redis_connected=redis_client is not None,
-        icp_canister_connected=ic_agent is not None
+        redis_connected=conversation_memory is not None,
+        icp_canister_connected=canister is not None,
+        components=component_status
+    )
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness: the process is up and serving HTTP"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness: all required components loaded; 503 while loading or failed"""
+    ready = is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "components": component_status}
     )
 
+def embed_text(text: str) -> np.ndarray:
+    """Encode text to a float32 vector, timed as the embed stage
+    
+    The array goes to the canister client as is; its vec float32 encoder
+    writes the buffer directly.
+    """
+    with stage("embed"):
+        return encoder.encode(text, convert_to_numpy=True)
+
+def embed_passages(texts: List[str]):
+    """Batch-encode retrieved passages for ranking and deduplication"""
+    with stage("embed_passages"):
+        return encoder.encode(texts, batch_size=32)
+
+def count_tokens(text: str) -> int:
+    """Prompt tokens for text under the loaded model (estimate in mock mode)"""
+    if llm:
+        return len(llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+    return len(text) // 4 + 1
+
+def choose_max_tokens(engagement_score: int) -> int:
+    """Token budget for one reply: full for engaging messages, shorter when requests queue
+    
+    Low-engagement messages get half way between MIN_TOKENS and MAX_TOKENS;
+    the budget is then divided by the scheduler load once it exceeds one
+    request per model slot.
+    """
+    budget = MAX_TOKENS if engagement_score >= ENGAGED_SCORE else (MAX_TOKENS + MIN_TOKENS) // 2
+    load = llm_scheduler.load() if llm_scheduler else 0.0
+    budget = int(budget / max(1.0, load))
+    return max(min(MIN_TOKENS, MAX_TOKENS), min(MAX_TOKENS, budget))
+
+async def run_llm(prompt: str, engagement_score: int, priority: str = "normal",
+                  deadline: Optional[float] = None, prefix: Optional[str] = None) -> str:
+    """Generate a completion on the next free model slot, in priority order
+    
+    Time waiting for a slot is llm_queue; time to the first streamed token
+    is prefill; the rest is decode. Decoding stops once the reply's JSON
+    object closes. prefix, the start of prompt shared across requests, is
+    restored from the slot's prefix state cache when seen before. Raises
+    DeadlineExceeded if the deadline passes before a slot frees up.
+    """
+    queued_at = time.perf_counter()
+    async with llm_scheduler.slot(priority, deadline) as worker:
+        metrics.observe_stage("llm_queue", time.perf_counter() - queued_at)
+        max_tokens = choose_max_tokens(engagement_score)
+        params = dict(
+            max_tokens=max_tokens,
+            temperature=TEMPERATURE,
+            top_p=TOP_P,
+            repeat_penalty=REPEAT_PENALTY,
+            stop=["<|eot_id|>", "<|end_of_text|>", "User:", "\n\n\n"]
+        )
+        result = await worker.generate(prompt, params, prefix)
+    metrics.observe_llm(result["prompt_tokens"], result["prefill_seconds"],
+                        result["completion_tokens"], result["decode_seconds"],
+                        finish=result["finish"], max_tokens=max_tokens,
+                        cached_tokens=result.get("cached_tokens", 0))
+    return result["text"]
+
+def salvage_reply_text(response_text: str) -> str:
+    """Reply text from output that is not valid JSON, e.g. cut off by the token budget"""
+    match = re.search(r'"text"\s*:\s*"((?:[^"\\]|\\.)*)', response_text)
+    if not match:
+        return response_text[:200]
+    try:
+        return json.loads(f'"{match.group(1)}"')
+    except json.JSONDecodeError:
+        return match.group(1)
+
 def calculate_engagement_score(message: str, user_history: Optional[Dict] = None) -> int:
     """Calculate engagement score to determine if Lain should respond"""
     score = 0
@@ -414,134 +766,96 @@ def calculate_engagement_score(message: str, user_history: Optional[Dict] = None
     
     return max(0, score)
 
-async def recall_context(principal_id: str, message: str, limit: int = 5) -> List[Dict]:
+async def recall_context(principal_id: str, message: str, limit: int = 5,
+                         query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
     """Retrieve relevant past interactions from ICP canister
     
     Uses: search_user_conversation_history(user_id, channel_id, embedding, limit) -> vec text
     """
-    global ic_agent, encoder
-    
-    if not ic_agent or not encoder:
+    if not canister or not encoder:
         return []
     
     try:
-        query_embedding = encoder.encode(message).tolist()
-        embedding_vec = [float(x) for x in query_embedding]
-        
-        # ic-py format for (text, text, vec float32, opt nat32)
-        params = [
-            {'type': Types.Text, 'value': principal_id},
-            {'type': Types.Text, 'value': "#general"},  # Changed from #lain-tv which doesn't exist
-            {'type': Types.Vec(Types.Float32), 'value': embedding_vec},
-            {'type': Types.Opt(Types.Nat32), 'value': limit}
-        ]
+        if query_embedding is None:
+            query_embedding = embed_text(message)
         
-        encoded_args = encode(params)
-        
-        # ic-py returns already decoded result
-        result = ic_agent.query_raw(
-            ic_canister_id,
-            "search_user_conversation_history",
-            encoded_args
-        )
+        with stage("retrieve"):
+            texts = await canister.query_cached(
+                SEARCH_USER_CONVERSATION_HISTORY,
+                principal_id,
+                "#general",  # Changed from #lain-tv which doesn't exist
+                query_embedding,
+                [limit],  # opt nat32
+                default=[]
+            )
         
         context = []
-        if result and isinstance(result, list) and len(result) > 0:
-            # ic-py returns already decoded: [{'type': ..., 'value': [...]}]
-            texts = result[0].get('value', [])
-            if isinstance(texts, list):
-                for item in texts:
-                    if isinstance(item, str):
-                        context.append({
-                            "past_message": item[:200],
-                            "past_response": "",
-                            "relevance": 0.8
-                        })
-                logger.info(f"Retrieved {len(context)} conversation entries from ICP for user {principal_id[:8]}...")
+        if isinstance(texts, list):
+            for item in texts:
+                if isinstance(item, str):
+                    context.append({
+                        "past_message": item[:200],
+                        "past_response": "",
+                        "relevance": 0.8
+                    })
+            logger.info(f"Retrieved {len(context)} conversation entries from ICP for user {principal_id[:8]}...")
         
         return context
     except Exception as e:
         logger.error(f"Error recalling context from ICP: {e}")
         return []
 
-async def recall_knowledge(message: str, limit: int = 10) -> List[Dict]:
-    """Retrieve relevant knowledge from ICP canister (ai_api_backend)
+async def load_history(principal_id: str, message: str, query_embedding: Optional[np.ndarray]) -> List[str]:
+    """Conversation history lines for the prompt, most relevant first
+    
+    Served from the principal's Redis window; the canister history search
+    only runs when the cached recall has expired or was never fetched.
+    Without Redis every request falls back to the canister.
+    """
+    if conversation_memory:
+        try:
+            with stage("history_load"):
+                window = await conversation_memory.load(principal_id)
+            if window.recalled is None:
+                context = await recall_context(principal_id, message, query_embedding=query_embedding)
+                window.recalled = [ctx['past_message'] for ctx in context]
+                await conversation_memory.store_recalled(principal_id, window.recalled)
+            return window.history_lines()
+        except Exception as e:
+            logger.warning(f"Conversation memory unavailable, querying canister: {e}")
+    
+    context = await recall_context(principal_id, message, query_embedding=query_embedding)
+    return [ctx['past_message'] for ctx in context]
+
+async def recall_knowledge(message: str, limit: int = 10,
+                           query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
+    """Retrieve relevant knowledge from the enabled retrieval backends
     
-    This queries the canister's personality embeddings which includes:
+    The ICP canister (ai_api_backend) backend searches personality embeddings
+    which includes:
     - Lain personality embeddings
     - memex.wiki content
     - LainCorp documentation
     
-    Uses: search_personality(channel_id, embedding) -> vec text
-    Searches across multiple channels to get comprehensive knowledge.
+    The Qdrant backend searches the lain_memory collection populated by
+    ingest_knowledge.py. limit applies per backend; the merged, deduplicated
+    candidates are all returned so PromptBuilder can rank them by embedding
+    similarity before the token budget cuts them down.
     """
-    global ic_agent, encoder
+    global encoder
     
-    if not ic_agent or not encoder:
-        logger.warning("IC Agent or encoder not available for knowledge recall")
+    if not retrieval_backends or not encoder:
+        logger.warning("Retrieval backends or encoder not available for knowledge recall")
         return []
     
     try:
-        query_embedding = encoder.encode(message).tolist()
-        embedding_vec = [float(x) for x in query_embedding]
-        
-        knowledge = []
-        
-        # Search across multiple relevant channels
-        # The canister has: #wiki, #tech, #general, #art, #music, #gaming, etc.
-        channels_to_search = ["#wiki", "#tech", "#general"]
-        
-        for channel in channels_to_search:
-            try:
-                # Method: search_personality(channel_id: text, embedding: vec float32) -> vec text
-                params = [
-                    {'type': Types.Text, 'value': channel},
-                    {'type': Types.Vec(Types.Float32), 'value': embedding_vec}
-                ]
-                
-                encoded_args = encode(params)
-                
-                # ic-py returns already decoded result
-                result = ic_agent.query_raw(
-                    ic_canister_id,
-                    "search_personality",
-                    encoded_args
-                )
-                
-                if result and isinstance(result, list) and len(result) > 0:
-                    # Result is already decoded: [{'type': 'rec_0', 'value': [...strings...]}]
-                    texts = result[0].get('value', [])
-                    if isinstance(texts, list):
-                        for idx, text in enumerate(texts):
-                            if isinstance(text, str) and len(text) > 10:
-                                # Determine category based on channel and content
-                                text_lower = text.lower()
-                                if channel == "#wiki" or "wiki" in text_lower or "memex" in text_lower:
-                                    topic = "[Wiki Knowledge]"
-                                elif "laincorp" in text_lower or "lain.tv" in text_lower:
-                                    topic = "[LainCorp]"
-                                elif channel == "#tech":
-                                    topic = "[Tech Knowledge]"
-                                else:
-                                    topic = "[Personality]"
-                                
-                                knowledge.append({
-                                    "topic": topic,
-                                    "content": text,
-                                    "channel": channel,
-                                    "relevance": 0.9 - (idx * 0.05)  # Decreasing relevance
-                                })
-                        
-                        logger.info(f"  Channel {channel}: found {len(texts)} results")
-            except Exception as e:
-                logger.warning(f"  Channel {channel} search failed: {e}")
-                continue
+        if query_embedding is None:
+            query_embedding = embed_text(message)
         
-        # Sort by relevance and limit
-        knowledge.sort(key=lambda x: x['relevance'], reverse=True)
-        knowledge = knowledge[:limit]
+        with stage("retrieve"):
+            knowledge = await search_all(retrieval_backends, query_embedding, limit)
         
-        logger.info(f"Retrieved {len(knowledge)} knowledge entries from ICP canister for query: {message[:50]}...")
+        logger.info(f"Retrieved {len(knowledge)} knowledge entries for query: {message[:50]}...")
         
         # Log sample of retrieved knowledge for debugging
         if knowledge:
@@ -549,7 +863,7 @@ async def recall_knowledge(message: str, limit: int = 10) -> List[Dict]:
         
         return knowledge
     except Exception as e:
-        logger.error(f"Error recalling knowledge from ICP: {e}")
+        logger.error(f"Error recalling knowledge: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return []
@@ -559,75 +873,37 @@ async def remember_interaction(principal_id: str, message: str, response: str, m
     
     Uses: store_conversation_chunk(conversation_embedding) -> text
     """
-    global ic_agent, encoder
-    
-    if not ic_agent or not encoder:
+    if not canister or not encoder:
         return
     
     try:
         # Generate embedding for the conversation
         conversation_text = f"User: {message}\nLain: {response}"
-        embedding = encoder.encode(conversation_text).tolist()
-        embedding_vec = [float(x) for x in embedding]
+        embedding = embed_text(conversation_text)
         
         # Get next chunk index
-        chunk_index = 0
+        memory_write_start = time.perf_counter()
         try:
-            params = [
-                {'type': Types.Text, 'value': principal_id},
-                {'type': Types.Text, 'value': "#general"}  # Changed from #lain-tv
-            ]
-            encoded_args = encode(params)
-            # ic-py returns already decoded result
-            result = ic_agent.query_raw(
-                ic_canister_id,
-                "get_next_conversation_chunk_index",
-                encoded_args
-            )
-            if result and isinstance(result, list) and len(result) > 0:
-                # ic-py returns already decoded: [{'type': ..., 'value': N}]
-                chunk_index = result[0].get('value', 0) if isinstance(result[0], dict) else 0
-        except Exception as e:
+            chunk_index = await canister.call(GET_NEXT_CONVERSATION_CHUNK_INDEX, principal_id, "#general") or 0
+        except CanisterError as e:
             logger.debug(f"Could not get chunk index: {e}")
             chunk_index = 0
         
-        # Create conversation embedding record
-        # conversation_embedding = record {
-        #   user_id: text, channel_id: text, conversation_text: text,
-        #   embedding: vec float32, message_count: nat32, chunk_index: nat32,
-        #   created_at: nat64, summary: text
-        # }
-        record_type = Types.Record({
-            "user_id": Types.Text,
-            "channel_id": Types.Text,
-            "conversation_text": Types.Text,
-            "embedding": Types.Vec(Types.Float32),
-            "message_count": Types.Nat32,
-            "chunk_index": Types.Nat32,
-            "created_at": Types.Nat64,
-            "summary": Types.Text
-        })
-        
+        # conversation_embedding record (see canister_client.CONVERSATION_RECORD)
         conversation_record = {
             "user_id": principal_id,
             "channel_id": "#general",  # Changed from #lain-tv
             "conversation_text": conversation_text,
-            "embedding": embedding_vec,
+            "embedding": embedding,
             "message_count": 1,
             "chunk_index": chunk_index,
             "created_at": int(datetime.now().timestamp() * 1_000_000_000),  # nanoseconds
             "summary": response[:100]
         }
         
-        params = [{'type': record_type, 'value': conversation_record}]
-        encoded_args = encode(params)
-        
         # Make update call to store
-        result = ic_agent.update_raw(
-            ic_canister_id,
-            "store_conversation_chunk",
-            encoded_args
-        )
+        result = await canister.call(STORE_CONVERSATION_CHUNK, conversation_record)
+        metrics.observe_stage("memory_write", time.perf_counter() - memory_write_start)
         
         if result:
             logger.debug(f"Stored interaction for {principal_id[:8]}... in ICP canister")
@@ -636,8 +912,6 @@ async def remember_interaction(principal_id: str, message: str, response: str, m
             
     except Exception as e:
         logger.error(f"Error storing memory in ICP: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
 
 def generate_mock_response(message: str) -> Dict[str, Any]:
     """Generate mock response when model is not loaded"""
@@ -700,60 +974,75 @@ def generate_mock_response(message: str) -> Dict[str, Any]:
             "should_speak": True
         }
 
-@app.post("/generate", response_model=MessageResponse)
-async def generate_response(request: MessageRequest):
-    """Generate Lain's response to a message"""
-    start_time = datetime.now()
+def coalesce_key(request: MessageRequest) -> tuple:
+    """Everything the reply and its side effects depend on
     
-    try:
-        # Calculate engagement score
+    The prompt is built from the message, plus the principal's history when
+    include_memory is set; the principal also decides where the turn is
+    stored. Anonymous viewers sending the same message share one reply.
+    The flight is scheduled with the priority and deadline of the request
+    that started it, so only requests that would be scheduled alike share
+    one (a joiner's deadline counts from the first request's arrival).
+    """
+    return (normalize_text(request.message), request.principal_id, request.include_memory,
+            request.priority, request.deadline_ms, request.on_deadline)
+
+def check_deadline(deadline: Optional[float]):
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded("deadline passed before inference")
+
+async def respond(request: MessageRequest, deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Retrieve, prompt, generate and store one reply; shared by coalesced requests"""
+    check_deadline(deadline)
+    
+    # Calculate engagement score
+    with stage("engagement"):
         engagement_score = calculate_engagement_score(request.message)
-        
-        # Retrieve memory context if requested
-        context = []
-        if request.include_memory and request.principal_id:
-            context = await recall_context(request.principal_id, request.message)
-        
-        # Retrieve relevant knowledge about LainCorp
-        knowledge = await recall_knowledge(request.message)
-        
-        # Build prompt with knowledge context
-        knowledge_str = ""
-        if knowledge:
-            knowledge_str = "\n\nKnowledge about LainCorp:\n"
-            for k in knowledge:
-                knowledge_str += f"- {k['topic']}: {k['content']}\n"
-        
-        context_str = ""
-        if context:
-            context_str = "\n\nPast interactions:\n"
-            for ctx in context[:3]:  # Limit to 3 most relevant
-                context_str += f"User: {ctx['past_message']}\nLain: {ctx['past_response']}\n"
-        
-        prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    
+    # One query embedding shared by memory and knowledge lookups
+    query_embedding = embed_text(request.message) if encoder else None
+    
+    # Retrieve conversation history if requested
+    history = []
+    if request.include_memory and request.principal_id:
+        history = await load_history(request.principal_id, request.message, query_embedding)
+    
+    # Retrieve relevant knowledge about LainCorp
+    knowledge = await recall_knowledge(request.message, limit=KNOWLEDGE_CANDIDATES, query_embedding=query_embedding)
+    
+    # Build prompt with knowledge context: ranked, deduplicated, token-budgeted
+    prompt_build_start = time.perf_counter()
+    knowledge_str = ""
+    if knowledge and prompt_builder:
+        knowledge_str, knowledge_stats = prompt_builder.build_knowledge(knowledge, query_embedding)
+        logger.info(f"Knowledge: {knowledge_stats['knowledge_selected']}/{knowledge_stats['knowledge_candidates']} passages, "
+                    f"{knowledge_stats['knowledge_duplicates']} duplicates, {knowledge_stats['knowledge_tokens']} tokens")
+    
+    context_str = ""
+    if history and prompt_builder:
+        context_str, _ = prompt_builder.build_history(history)
+    elif history:
+        context_str = "\n\nPast interactions:\n" + "".join(f"{line}\n" for line in history[:3])
+    
+    # Knowledge goes before the per-principal history, so system prompt + knowledge is a shared prefix
+    prefix = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
 
-{LAIN_SYSTEM_PROMPT}{knowledge_str}<|eot_id|><|start_header_id|>user<|end_header_id|>
+{LAIN_SYSTEM_PROMPT}{knowledge_str}"""
+    prompt = f"""{prefix}{context_str}<|eot_id|><|start_header_id|>user<|end_header_id|>
 
 {request.message}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
 
 """
-        
-        # Generate response
-        if llm:
-            try:
-                output = llm(
-                    prompt,
-                    max_tokens=MAX_TOKENS,
-                    temperature=TEMPERATURE,
-                    top_p=TOP_P,
-                    repeat_penalty=REPEAT_PENALTY,
-                    stop=["<|eot_id|>", "<|end_of_text|>", "User:", "\n\n\n"]
-                )
-                
-                response_text = output['choices'][0]['text'].strip()
-                logger.info(f"LLM raw output: {response_text}")
-                
-                # Try to parse JSON response
+    metrics.observe_stage("prompt_build", time.perf_counter() - prompt_build_start)
+    
+    # Generate response
+    if llm:
+        try:
+            response_text = (await run_llm(prompt, engagement_score, request.priority, deadline, prefix)).strip()
+            logger.info(f"LLM raw output: {response_text}")
+            
+            # Try to parse JSON response
+            with stage("json_parse"):
                 try:
                     # Handle case where response might have extra content
                     json_match = re.search(r'\{[^{}]*\}', response_text)
@@ -764,70 +1053,183 @@ async def generate_response(request: MessageRequest):
                 except json.JSONDecodeError:
                     # Fallback if model doesn't return valid JSON
                     response_data = {
-                        "text": response_text[:200],
+                        "text": salvage_reply_text(response_text),
                         "animation": "talk",
                         "mood": "neutral",
                         "should_speak": engagement_score >= 5
                     }
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"LLM generation error: {e}")
+            response_data = generate_mock_response(request.message)
+    else:
+        response_data = generate_mock_response(request.message)
+    
+    # Speech and animation start while the interaction is being stored
+    await publish_reply(response_data)
+    
+    # Store in memory
+    if request.principal_id:
+        if conversation_memory and response_data.get('text'):
+            try:
+                with stage("history_append"):
+                    await conversation_memory.append(request.principal_id, request.message, response_data['text'])
             except Exception as e:
-                logger.error(f"LLM generation error: {e}")
-                response_data = generate_mock_response(request.message)
-        else:
+                logger.warning(f"Could not update conversation window: {e}")
+        await remember_interaction(
+            request.principal_id,
+            request.message,
+            response_data.get('text', ''),
+            response_data.get('mood', 'neutral')
+        )
+    
+    return response_data
+
+async def publish_reply(response_data: Dict[str, Any]) -> Optional[str]:
+    """Publish a spoken reply to the text stream, one entry per sentence (pipeline mode)
+    
+    tts_server.py renders and forwards each sentence as it arrives, so audio
+    and animation for the first sentence are under way before the last one
+    is synthesized. Sets and returns response_data["reply_id"].
+    """
+    text = response_data.get("text", "")
+    if not (PIPELINE_STREAMS and redis_client and text and response_data.get("should_speak", True)):
+        return None
+    
+    reply_id = uuid.uuid4().hex
+    chunks = [chunk for chunk in SENTENCE_BOUNDARY.split(text.strip()) if chunk]
+    try:
+        with stage("publish"):
+            pipe = redis_client.pipeline(transaction=False)
+            for seq, chunk in enumerate(chunks):
+                pipe.xadd(PIPELINE_TEXT_STREAM, {
+                    "reply_id": reply_id,
+                    "seq": seq,
+                    "final": int(seq == len(chunks) - 1),
+                    "text": chunk,
+                    "mood": response_data.get("mood", "neutral"),
+                    "animation": response_data.get("animation", "talk"),
+                    "ts": int(time.time() * 1000),  # end-to-end lag is measured from here
+                }, maxlen=PIPELINE_STREAM_MAXLEN, approximate=True)
+            await pipe.execute()
+    except Exception as e:
+        pipeline_stats["errors"] += 1
+        logger.warning(f"Could not publish reply to {PIPELINE_TEXT_STREAM}: {e}")
+        return None
+    
+    pipeline_stats["replies"] += 1
+    pipeline_stats["chunks"] += len(chunks)
+    response_data["reply_id"] = reply_id
+    return reply_id
+
+async def cancel_on_disconnect(http_request: Request, work: asyncio.Future) -> bool:
+    """Cancel work (down to the running decode) once the client has gone away"""
+    while not work.done():
+        if await http_request.is_disconnected():
+            work.cancel()
+            return True
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    return False
+
+@app.post("/generate", response_model=MessageResponse)
+async def generate_response(request: MessageRequest, http_request: Request):
+    """Generate Lain's response to a message
+    
+    Identical concurrent requests (same coalesce_key) share one generation;
+    the ones that joined another's are counted as "coalesced", with their
+    wait as the only stage in their timings. Requests queue for the model
+    by priority; past deadline_ms they get a canned reply
+    (on_deadline=degrade) or a 504 (drop) instead of inference.
+    """
+    if not components_loaded.is_set():
+        raise HTTPException(status_code=503, detail="LainLLM is still loading")
+    
+    start_time = time.perf_counter()
+    timings = metrics.start_request()
+    deadline = time.monotonic() + request.deadline_ms / 1000 if request.deadline_ms else None
+    
+    work = asyncio.ensure_future(inflight_responses.join(coalesce_key(request), lambda: respond(request, deadline)))
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request, work))
+    try:
+        try:
+            response_data, coalesced = await work
+            outcome = "coalesced" if coalesced else "ok"
+            if coalesced:
+                # The generation's stages were recorded in the first request's breakdown
+                metrics.observe_stage("coalesced", time.perf_counter() - start_time)
+        except DeadlineExceeded as e:
+            if request.on_deadline == "drop":
+                metrics.observe_request("expired", time.perf_counter() - start_time)
+                raise HTTPException(status_code=504, detail=str(e))
             response_data = generate_mock_response(request.message)
+            await publish_reply(response_data)
+            outcome = "degraded"
         
-        # Store in memory
-        if request.principal_id:
-            await remember_interaction(
-                request.principal_id,
-                request.message,
-                response_data.get('text', ''),
-                response_data.get('mood', 'neutral')
-            )
-        
-        processing_time = (datetime.now() - start_time).total_seconds()
+        processing_time = time.perf_counter() - start_time
+        metrics.observe_request(outcome, processing_time)
         
         return MessageResponse(
             response=response_data.get('text', ''),
             animation=response_data.get('animation', 'talk'),
             mood=response_data.get('mood', 'neutral'),
             should_speak=response_data.get('should_speak', True),
-            processing_time=processing_time
+            processing_time=processing_time,
+            timings=dict(timings, total=processing_time) if request.include_timings else None,
+            reply_id=response_data.get('reply_id')
         )
         
+    except HTTPException:
+        raise
+    except asyncio.CancelledError:
+        if not (watcher.done() and not watcher.cancelled() and watcher.result()):
+            raise
+        # Client disconnected; nobody is left to read the reply
+        metrics.observe_request("cancelled", time.perf_counter() - start_time)
+        logger.info(f"Client disconnected, cancelled generation ({request.priority})")
+        return Response(status_code=499)
     except Exception as e:
+        metrics.observe_request("error", time.perf_counter() - start_time)
         logger.error(f"Error generating response: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher.cancel()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-stage latency histograms and llama.cpp throughput in Prometheus format"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+def prefix_cache_stats() -> Optional[Dict]:
+    if inference_pool:
+        return inference_pool.prefix_cache_stats()
+    return llm_scheduler.slots[0].prefix_cache_stats() if llm_scheduler and llm_scheduler.slots else None
+
+def speculative_stats() -> Dict:
+    if inference_pool:
+        return inference_pool.draft_stats() or {"mode": SPECULATIVE_MODE}
+    return draft_model.stats() if draft_model else {"mode": "off"}
 
 @app.get("/stats")
 async def get_stats():
-    """Get LLM statistics"""
-    global ic_agent, ic_canister_id
-    
-    knowledge_stats = {"personality_count": 0}
-    
-    # Try to get knowledge stats from ICP canister
-    if ic_agent:
-        try:
-            encoded_args = encode([])
-            # ic-py returns already decoded result
-            result = ic_agent.query_raw(
-                ic_canister_id,
-                "get_personality_embeddings",
-                encoded_args
-            )
-            if result and isinstance(result, list) and len(result) > 0:
-                # ic-py returns already decoded: [{'type': ..., 'value': [...]}]
-                records = result[0].get('value', [])
-                knowledge_stats["personality_count"] = len(records)
-        except Exception as e:
-            logger.warning(f"Could not fetch ICP stats: {e}")
-    
+    """Get LLM statistics (canister counts come from the background poller)"""
     return {
         "model_loaded": llm is not None,
         "model_path": MODEL_PATH if llm else None,
         "icp_canister_id": ic_canister_id,
-        "icp_connected": ic_agent is not None,
-        "knowledge_stats": knowledge_stats,
+        "icp_connected": canister is not None,
+        "canister_client": canister.stats() if canister else None,
+        "knowledge_stats": canister_stats,
+        "retrieval_backends": [backend.describe() for backend in retrieval_backends],
+        "encoder": sentence_encoder.describe(encoder) if encoder else None,
+        "passage_embedding_cache": prompt_builder.embeddings.stats() if prompt_builder else None,
+        "speculative_decoding": speculative_stats(),
+        "prefix_cache": prefix_cache_stats(),
+        "request_coalescing": inflight_responses.stats(),
+        "pipeline": dict(pipeline_stats, enabled=PIPELINE_STREAMS, stream=PIPELINE_TEXT_STREAM),
+        "llm_scheduler": llm_scheduler.stats() if llm_scheduler else None,
+        "inference_workers": [worker.stats() for worker in llm_scheduler.slots] if llm_scheduler else [],
         "n_threads": N_THREADS,
         "n_ctx": N_CTX,
         "temperature": TEMPERATURE
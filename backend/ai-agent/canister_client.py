@@ -0,0 +1,452 @@
+"""
+Async, pooled client for the ai_api_backend ICP canister
+
+ic-py's Client opens a new HTTPS connection (and TLS handshake) for every
+query, call and read_state. PooledClient keeps one httpx.AsyncClient with
+keep-alive connections (HTTP/2 when the h2 package is installed) and plugs
+into ic-py's Agent, which still does request signing and Candid decoding.
+
+CanisterClient is the single call path the agent uses: every canister
+method is declared once with its Candid argument types and call kind.
+The Candid header (magic, type table, argument types) is encoded once per
+method, and argument values go through encoders compiled from the types;
+vec float32 is written straight from a NumPy float32 buffer instead of
+one Python float per element. Calls are limited by a concurrency semaphore, timed as
+"canister:<method>" stages and unwrapped from ic-py's
+[{'type': ..., 'value': ...}] result shape.
+
+Query results can be served from a stale-while-revalidate cache keyed on
+the method and its arguments, with embeddings quantised so re-encodings of
+the same text (which differ by float noise) share an entry. A circuit breaker trips after repeated failures;
+while it is open calls fail fast, and cached queries return whatever is
+cached (however old) or an empty default without touching the network.
+"""
+
+import asyncio
+import hashlib
+import logging
+import struct
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import httpx
+import numpy as np
+from ic.candid import (
+    FixedNatClass, FloatClass, OptClass, RecordClass, TextClass, TypeTable, Types, VecClass, prefix
+)
+from ic.client import Client
+
+from metrics import stage
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CBOR_HEADERS = {'Content-Type': 'application/cbor'}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class PooledClient(Client):
+    """ic-py transport over one shared keep-alive httpx.AsyncClient"""
+
+    def __init__(self, url: str = "https://ic0.app", max_connections: int = 32,
+                 keepalive_connections: int = 16, timeout: float = 10.0, http2: bool = True):
+        super().__init__(url)
+        self.http2 = http2 and http2_available()
+        self.http = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=keepalive_connections),
+            timeout=timeout
+        )
+
+    async def _post(self, canister_id: str, endpoint: str, data: bytes) -> bytes:
+        response = await self.http.post(
+            f"{self.url}/api/v2/canister/{canister_id}/{endpoint}", content=data, headers=CBOR_HEADERS
+        )
+        return response.content
+
+    async def query_async(self, canister_id, data):
+        return await self._post(canister_id, "query", data)
+
+    async def call_async(self, canister_id, req_id, data):
+        await self._post(canister_id, "call", data)
+        return req_id
+
+    async def read_state_async(self, canister_id, data):
+        return await self._post(canister_id, "read_state", data)
+
+    async def status_async(self):
+        response = await self.http.get(f"{self.url}/api/v2/status")
+        return response.content
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def uleb128(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def value_encoder(t) -> Callable[[Any], bytes]:
+    """Compile a Candid value encoder for type t
+
+    Covers the types the canister interface uses; anything else falls back
+    to ic-py's own encodeValue. No covariance checks: values come from the
+    typed call sites below.
+    """
+    if isinstance(t, TextClass):
+        def encode_text(value: str) -> bytes:
+            data = value.encode("utf-8")
+            return uleb128(len(data)) + data
+        return encode_text
+    if isinstance(t, FixedNatClass):
+        return struct.Struct({8: "<B", 16: "<H", 32: "<I", 64: "<Q"}[t._bits]).pack
+    if isinstance(t, FloatClass):
+        return struct.Struct("<f" if t._bits == 32 else "<d").pack
+    if isinstance(t, VecClass):
+        if isinstance(t._type, FloatClass):
+            dtype = np.dtype("<f4" if t._type._bits == 32 else "<f8")
+            # Zero-copy view when the input already is a little-endian float buffer
+            return lambda value: uleb128(len(value)) + np.ascontiguousarray(value, dtype=dtype).tobytes()
+        inner = value_encoder(t._type)
+        return lambda value: uleb128(len(value)) + b"".join(map(inner, value))
+    if isinstance(t, OptClass):
+        inner = value_encoder(t._type)
+        def encode_opt(value) -> bytes:
+            # Accepts None/[] (absent), [x] (ic-py style) or a bare x
+            if value is None or (isinstance(value, list) and not value):
+                return b"\x00"
+            return b"\x01" + inner(value[0] if isinstance(value, list) else value)
+        return encode_opt
+    if isinstance(t, RecordClass) and type(t) is RecordClass:
+        # _fields is already in Candid field-hash order
+        fields = [(name, value_encoder(field_type)) for name, field_type in t._fields.items()]
+        return lambda value: b"".join(encode(value[name]) for name, encode in fields)
+    return t.encodeValue
+
+
+def encode_header(arg_types: Tuple[Any, ...]) -> bytes:
+    """Candid magic, type table and argument type list; fixed per method signature"""
+    table = TypeTable()
+    for t in arg_types:
+        t.buildTypeTable(table)
+    return (prefix.encode() + table.encode() + uleb128(len(arg_types))
+            + b"".join(t.encodeType(table) for t in arg_types))
+
+
+@dataclass(frozen=True)
+class CanisterMethod:
+    name: str
+    arg_types: Tuple[Any, ...]
+    update: bool = False  # update calls go through consensus and are polled for the reply
+    header: bytes = field(init=False, repr=False)
+    encoders: Tuple[Callable[[Any], bytes], ...] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "header", encode_header(self.arg_types))
+        object.__setattr__(self, "encoders", tuple(value_encoder(t) for t in self.arg_types))
+
+    def encode_args(self, *args) -> bytes:
+        if len(args) != len(self.encoders):
+            raise TypeError(f"{self.name} takes {len(self.encoders)} arguments, got {len(args)}")
+        return self.header + b"".join(encode(arg) for encode, arg in zip(self.encoders, args))
+
+
+# ai_api_backend interface used by the agent
+CONVERSATION_RECORD = Types.Record({
+    "user_id": Types.Text,
+    "channel_id": Types.Text,
+    "conversation_text": Types.Text,
+    "embedding": Types.Vec(Types.Float32),
+    "message_count": Types.Nat32,
+    "chunk_index": Types.Nat32,
+    "created_at": Types.Nat64,
+    "summary": Types.Text
+})
+SEARCH_PERSONALITY = CanisterMethod("search_personality", (Types.Text, Types.Vec(Types.Float32)))
+SEARCH_USER_CONVERSATION_HISTORY = CanisterMethod(
+    "search_user_conversation_history",
+    (Types.Text, Types.Text, Types.Vec(Types.Float32), Types.Opt(Types.Nat32))
+)
+GET_NEXT_CONVERSATION_CHUNK_INDEX = CanisterMethod("get_next_conversation_chunk_index", (Types.Text, Types.Text))
+GET_PERSONALITY_EMBEDDINGS = CanisterMethod("get_personality_embeddings", ())
+STORE_CONVERSATION_CHUNK = CanisterMethod("store_conversation_chunk", (CONVERSATION_RECORD,), update=True)
+
+
+class CanisterError(Exception):
+    pass
+
+
+class CircuitOpen(CanisterError):
+    pass
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures
+
+    While open every call is refused. After `reset_timeout` seconds one
+    probe call is let through (half-open): success closes the breaker,
+    failure opens it for another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("✓ Canister circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                self.trips += 1
+                logger.warning(f"⚠ Canister circuit open after {self.failures} failures; "
+                               f"serving cached results for {self.reset_timeout:.0f}s")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+def quantise(vector, quantum: float) -> bytes:
+    """Digest of a float vector rounded to multiples of quantum"""
+    steps = np.round(np.asarray(vector, dtype=np.float32) / quantum).astype(np.int32)
+    return hashlib.blake2b(steps.tobytes(), digest_size=16).digest()
+
+
+class QueryCache:
+    """LRU of query results with stale-while-revalidate expiry
+
+    An entry is fresh for `ttl` seconds and then served stale (while a
+    refresh runs in the background) for another `stale_ttl` seconds;
+    after that a lookup misses. Embedding arguments are keyed by their
+    quantised digest.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 60.0, stale_ttl: float = 600.0,
+                 quantum: float = 0.01):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.quantum = quantum
+        self.entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.counts = {"fresh": 0, "stale": 0, "miss": 0, "fallback": 0, "default": 0}
+
+    def key(self, method: "CanisterMethod", args: Tuple) -> Hashable:
+        parts = [method.name]
+        for arg in args:
+            if isinstance(arg, np.ndarray) or (isinstance(arg, list) and arg and isinstance(arg[0], float)):
+                parts.append(quantise(arg, self.quantum))
+            elif isinstance(arg, list):
+                parts.append(tuple(arg))
+            else:
+                parts.append(arg)
+        return tuple(parts)
+
+    def get(self, key: Hashable) -> Tuple[Optional[float], Any]:
+        """(age in seconds, value), or (None, None) if nothing is cached"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+        self.entries.move_to_end(key)
+        stored_at, value = entry
+        return time.monotonic() - stored_at, value
+
+    def put(self, key: Hashable, value: Any):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "lookups": self.counts,
+        }
+
+
+class CanisterClient:
+    """Typed, concurrency-limited calls to one canister"""
+
+    def __init__(self, agent, canister_id: str, max_concurrency: int = 16,
+                 query_timeout: float = 3.0, update_timeout: float = 15.0,
+                 method_timeouts: Optional[Dict[str, float]] = None, update_poll_delay: float = 0.25,
+                 cache: Optional[QueryCache] = None, breaker: Optional[CircuitBreaker] = None):
+        self.agent = agent
+        self.canister_id = canister_id
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.query_timeout = query_timeout
+        self.update_timeout = update_timeout
+        self.method_timeouts = method_timeouts or {}
+        self.update_poll_delay = update_poll_delay
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.cache = cache or QueryCache()
+        self.breaker = breaker or CircuitBreaker()
+        self.fetches = SingleFlight()  # one upstream query per cache key at a time
+        self.refreshes: set = set()
+
+    def timeout_for(self, method: CanisterMethod) -> float:
+        default = self.update_timeout if method.update else self.query_timeout
+        return self.method_timeouts.get(method.name, default)
+
+    def _count(self, method: CanisterMethod, outcome: str):
+        counts = self.counts.setdefault(method.name, {"ok": 0, "error": 0, "timeout": 0, "rejected": 0})
+        counts[outcome] += 1
+
+    async def call(self, method: CanisterMethod, *args) -> Any:
+        """Call a canister method and return its first return value (None if empty)
+
+        Raises CanisterError on timeouts, transport errors and rejects, and
+        CircuitOpen without calling out while the breaker is open.
+        """
+        encoded_args = method.encode_args(*args)
+
+        if not self.breaker.allow():
+            self._count(method, "rejected")
+            raise CircuitOpen(f"{method.name} skipped: canister circuit open")
+        try:
+            async with self.semaphore:
+                with stage(f"canister:{method.name}"):
+                    if method.update:
+                        call = self.agent.update_raw_async(self.canister_id, method.name, encoded_args,
+                                                           delay=self.update_poll_delay)
+                    else:
+                        call = self.agent.query_raw_async(self.canister_id, method.name, encoded_args)
+                    result = await asyncio.wait_for(call, self.timeout_for(method))
+        except asyncio.TimeoutError:
+            self._count(method, "timeout")
+            self.breaker.record_failure()
+            raise CanisterError(f"{method.name} timed out after {self.timeout_for(method)}s") from None
+        except asyncio.CancelledError:
+            self.breaker.probing = False
+            raise
+        except Exception as e:
+            self._count(method, "error")
+            self.breaker.record_failure()
+            raise CanisterError(f"{method.name} failed: {e}") from e
+
+        self._count(method, "ok")
+        self.breaker.record_success()
+        # ic-py returns already decoded: [{'type': ..., 'value': ...}]
+        if result and isinstance(result, list) and isinstance(result[0], dict):
+            return result[0].get('value')
+        return None
+
+    async def _fetch(self, key: Hashable, method: CanisterMethod, args: Tuple) -> Any:
+        value = await self.call(method, *args)
+        self.cache.put(key, value)
+        return value
+
+    def _refresh(self, key: Hashable, method: CanisterMethod, args: Tuple):
+        """Revalidate a stale entry in the background (at most one refresh per key)"""
+        if key in self.fetches.inflight:
+            return
+
+        async def refresh():
+            try:
+                await self.fetches.do(key, lambda: self._fetch(key, method, args))
+            except CanisterError as e:
+                logger.debug(f"Background refresh of {method.name} failed: {e}")
+
+        task = asyncio.create_task(refresh())
+        self.refreshes.add(task)
+        task.add_done_callback(self.refreshes.discard)
+
+    async def query_cached(self, method: CanisterMethod, *args, default: Any = None) -> Any:
+        """Query through the stale-while-revalidate cache
+
+        Fresh entries are returned as is; stale ones are returned at once
+        and refreshed in the background. On a miss the query runs (shared
+        by concurrent identical lookups). If the canister is failing or the
+        breaker is open, the newest cached value of any age is served, or
+        default when there is none; this never raises CanisterError.
+        """
+        cache = self.cache
+        key = cache.key(method, args)
+        age, value = cache.get(key)
+        if age is not None and age < cache.ttl:
+            cache.counts["fresh"] += 1
+            return value
+        if age is not None and age < cache.ttl + cache.stale_ttl:
+            cache.counts["stale"] += 1
+            if self.breaker.state != "open":
+                self._refresh(key, method, args)
+            return value
+
+        if self.breaker.state != "open":
+            cache.counts["miss"] += 1
+            try:
+                return await self.fetches.do(key, lambda: self._fetch(key, method, args))
+            except CircuitOpen:
+                pass  # another call is probing the canister
+            except CanisterError as e:
+                logger.warning(f"Canister {method.name} unavailable, serving cached/empty result: {e}")
+
+        if age is not None:
+            cache.counts["fallback"] += 1
+            return value
+        cache.counts["default"] += 1
+        return default
+
+    def stats(self) -> Dict:
+        return {
+            "canister_id": self.canister_id,
+            "max_concurrency": self.max_concurrency,
+            "calls": self.counts,
+            "circuit_breaker": self.breaker.stats(),
+            "query_cache": self.cache.stats(),
+        }
@@ -0,0 +1,98 @@
+"""
+Per-principal conversation window for LainLLM, kept in Redis
+
+For every principal the agent keeps:
+- the most recent turns verbatim (a capped Redis list, newest first),
+- a compact summary of older turns that fell out of the window,
+- the passages recalled from the ICP canister's conversation history,
+  cached with a TTL so the canister is only queried on a miss or after
+  the refresh interval.
+
+Loading a window is a single pipelined Redis round trip.
+"""
+
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+KEY_PREFIX = "lain:conversation"
+
+
+@dataclass
+class ConversationWindow:
+    recent: List[dict] = field(default_factory=list)  # newest first
+    summary: str = ""
+    recalled: Optional[List[str]] = None  # None = not cached, refresh from canister
+
+    def history_lines(self) -> List[str]:
+        """Prompt lines ordered by priority: recent turns, summary, recalled"""
+        lines = [f"User: {turn['user']}\nLain: {turn['lain']}" for turn in self.recent]
+        if self.summary:
+            lines.append(f"Earlier: {self.summary}")
+        recent_text = {turn['user'] for turn in self.recent}
+        lines.extend(text for text in (self.recalled or []) if not any(u and u in text for u in recent_text))
+        return lines
+
+
+def summarize_turn(user: str, lain: str, max_chars: int = 120) -> str:
+    """Extractive one-line digest of a turn: first sentence of each side"""
+    def first_sentence(text: str) -> str:
+        sentence = re.split(r'(?<=[.!?…])\s+', text.strip(), maxsplit=1)[0]
+        return sentence[:max_chars // 2]
+    return f"they said \"{first_sentence(user)}\", you said \"{first_sentence(lain)}\""
+
+
+class ConversationMemory:
+    def __init__(self, redis_client, recent_turns: int = 6, summary_chars: int = 600,
+                 refresh_seconds: int = 900, ttl_seconds: int = 86400):
+        self.redis = redis_client
+        self.recent_turns = recent_turns
+        self.summary_chars = summary_chars
+        self.refresh_seconds = refresh_seconds
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, principal_id: str, part: str) -> str:
+        return f"{KEY_PREFIX}:{principal_id}:{part}"
+
+    async def load(self, principal_id: str) -> ConversationWindow:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lrange(self._key(principal_id, "recent"), 0, self.recent_turns - 1)
+        pipe.get(self._key(principal_id, "summary"))
+        pipe.get(self._key(principal_id, "recalled"))
+        recent, summary, recalled = await pipe.execute()
+        return ConversationWindow(
+            recent=[json.loads(turn) for turn in recent],
+            summary=summary.decode() if isinstance(summary, bytes) else (summary or ""),
+            recalled=json.loads(recalled) if recalled is not None else None,
+        )
+
+    async def store_recalled(self, principal_id: str, texts: List[str]):
+        """Cache canister recall results until the next refresh"""
+        await self.redis.setex(self._key(principal_id, "recalled"), self.refresh_seconds, json.dumps(texts))
+
+    async def append(self, principal_id: str, user: str, lain: str):
+        """Add a turn; turns pushed out of the window are folded into the summary"""
+        recent_key = self._key(principal_id, "recent")
+        summary_key = self._key(principal_id, "summary")
+        turn = json.dumps({"user": user, "lain": lain, "ts": int(time.time())})
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lpush(recent_key, turn)
+        pipe.lrange(recent_key, self.recent_turns, -1)
+        pipe.ltrim(recent_key, 0, self.recent_turns - 1)
+        pipe.expire(recent_key, self.ttl_seconds)
+        pipe.get(summary_key)
+        _, evicted, _, _, summary = await pipe.execute()
+
+        if evicted:
+            summary = summary.decode() if isinstance(summary, bytes) else (summary or "")
+            # Oldest evicted turn is last in the list
+            for raw in reversed(evicted):
+                old = json.loads(raw)
+                digest = summarize_turn(old["user"], old["lain"])
+                summary = f"{summary}; {digest}" if summary else digest
+            if len(summary) > self.summary_chars:
+                summary = "…" + summary[-self.summary_chars:].split("; ", 1)[-1]
+            await self.redis.setex(summary_key, self.ttl_seconds, summary)
@@ -3,13 +3,19 @@ set -e
 
 MODEL_PATH="/models/lain-model.gguf"
 MODEL_URL="https://huggingface.co/bartowski/Meta-Llama-3.1-8B-Instruct-GGUF/resolve/main/Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf"
+ENCODER_ONNX_PATH="${ENCODER_ONNX_PATH:-/models/encoder-onnx}"
 
 # Check if model already exists
 if [ -f "$MODEL_PATH" ]; then
     echo "Model already exists at $MODEL_PATH"
-    exit 0
+else
+    echo "Downloading model from $MODEL_URL..."
+    wget -q --show-progress "$MODEL_URL" -O "$MODEL_PATH"
+    echo "Model download complete!"
 fi
 
-echo "Downloading model from $MODEL_URL..."
-wget -q --show-progress "$MODEL_URL" -O "$MODEL_PATH"
-echo "Model download complete!"
+# int8 ONNX copy of the sentence encoder (agent falls back to PyTorch without it)
+if [ "${ENCODER_BACKEND:-auto}" != "torch" ] && [ ! -f "$ENCODER_ONNX_PATH/encoder_config.json" ]; then
+    echo "Exporting sentence encoder to $ENCODER_ONNX_PATH..."
+    python sentence_encoder.py export "$ENCODER_ONNX_PATH" || echo "Encoder export failed, using sentence-transformers"
+fi
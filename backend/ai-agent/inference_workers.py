@@ -0,0 +1,335 @@
+"""
+Multi-worker llama.cpp inference for LainLLM
+
+With INFERENCE_WORKERS=N the agent process keeps the encoder, retrieval and
+prompt building, and hands generation to N worker processes. Every worker
+memory-maps the same GGUF file, so the weights live once in the page cache
+and each worker only adds its own KV cache/context. Cores are partitioned
+between workers (one CPU affinity set and thread count each). Each worker
+runs one generation at a time and requests go to an idle worker, so load
+is spread to the least-loaded worker (see scheduler.py).
+
+Generations can be cancelled mid-decode (client disconnected): the stop
+check runs between streamed tokens and the partial result is discarded.
+Replies are a single JSON object, so decoding also stops as soon as the
+top-level object closes instead of running on to a stop string.
+
+Each model keeps a prefix state cache (prefix_cache.py): a request that
+names its prompt prefix (system prompt + knowledge) resumes from the saved
+state and only prefills what follows.
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from prefix_cache import PrefixStateCache, merge_stats
+
+logger = logging.getLogger(__name__)
+
+
+class JsonObjectEnd:
+    """Track streamed text and find where the first top-level JSON object closes"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str) -> Optional[int]:
+        """Index just past the closing brace within text, or None while still open"""
+        for i, ch in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '{':
+                self.depth += 1
+            elif self.depth:
+                if ch == '"':
+                    self.in_string = True
+                elif ch == '}':
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return i + 1
+        return None
+
+
+def complete(llm, prompt: str, params: Dict, draft_model=None,
+             should_stop: Optional[Callable[[], bool]] = None, stop_at_json_end: bool = True,
+             prefix: Optional[str] = None, prefix_cache: Optional[PrefixStateCache] = None) -> Dict:
+    """Stream one completion, timing prefill (to first token) and decode
+
+    Shared by the in-process path and the worker processes. should_stop is
+    polled between tokens; when it returns True decoding stops early and
+    the result is marked cancelled. finish is json_end, length, stop or
+    cancelled. prefix (the start of prompt) is looked up in prefix_cache;
+    restoring or saving its state counts as prefill.
+    """
+    tokens = llm.tokenize(prompt.encode("utf-8"), special=True)
+    prompt_tokens = len(tokens)
+    if draft_model:
+        draft_model.begin()
+    start = time.perf_counter()
+    cached_tokens = prefix_cache.prepare(llm, tokens, prefix) if prefix and prefix_cache else 0
+    first_token_at = None
+    pieces = []
+    finish = "stop"
+    json_end = JsonObjectEnd() if stop_at_json_end else None
+    stream = llm(prompt, stream=True, **params)
+    for chunk in stream:
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        text = chunk['choices'][0]['text']
+        end_at = json_end.feed(text) if json_end else None
+        pieces.append(text if end_at is None else text[:end_at])
+        if end_at is not None:
+            finish = "json_end"
+        elif should_stop and should_stop():
+            finish = "cancelled"
+        elif chunk['choices'][0].get('finish_reason') == "length":
+            finish = "length"
+        if finish != "stop":
+            stream.close()
+            break
+    end = time.perf_counter()
+    first_token_at = first_token_at or end
+    return {
+        "text": "".join(pieces),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "prefill_seconds": first_token_at - start,
+        "completion_tokens": len(pieces),
+        "decode_seconds": end - first_token_at,
+        "finish": finish,
+    }
+
+
+def partition_cpus(workers: int) -> List[List[int]]:
+    """Split the CPUs this process may use into one contiguous set per worker"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    size = max(1, len(cpus) // workers)
+    return [cpus[i * size:(i + 1) * size] or cpus for i in range(workers)]
+
+
+def worker_main(worker_id: int, conn, model_kwargs: Dict, cpus: Optional[List[int]], draft_kwargs: Optional[Dict],
+                prefix_cache_kwargs: Optional[Dict] = None):
+    """Worker process: load the model once, then serve generate requests from the pipe"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    from llama_cpp import Llama
+    from speculative import create_draft_model
+
+    try:
+        draft_model = create_draft_model(**draft_kwargs) if draft_kwargs else None
+        llm = Llama(**model_kwargs, draft_model=draft_model, verbose=False)
+        prefix_cache = PrefixStateCache(**prefix_cache_kwargs) if prefix_cache_kwargs else None
+    except Exception as e:
+        conn.send({"type": "error", "error": str(e)})
+        return
+    conn.send({"type": "ready", "pid": os.getpid()})
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message["type"] == "shutdown":
+            return
+        if message["type"] != "generate":
+            continue  # cancel for a request that already finished
+
+        def cancel_requested(request_id=message["id"]) -> bool:
+            return conn.poll() and conn.recv() == {"type": "cancel", "id": request_id}
+
+        try:
+            result = complete(llm, message["prompt"], message["params"], draft_model, cancel_requested,
+                              prefix=message.get("prefix"), prefix_cache=prefix_cache)
+            result["type"] = "result"
+            result["draft_stats"] = draft_model.stats() if draft_model else None
+            result["prefix_cache_stats"] = prefix_cache.stats() if prefix_cache else None
+        except Exception as e:
+            result = {"type": "error", "error": str(e)}
+        conn.send(result)
+
+
+async def run_cancellable(job: asyncio.Future, cancel: Callable[[], None]) -> Dict:
+    """Await a blocking generation; if the caller is cancelled, stop it and wait for it to wind down"""
+    try:
+        return await asyncio.shield(job)
+    except asyncio.CancelledError:
+        cancel()
+        await asyncio.shield(job)
+        raise
+
+
+class LocalWorker:
+    """The in-process model as a single inference slot"""
+
+    def __init__(self, llm, draft_model=None, prefix_cache: Optional[PrefixStateCache] = None):
+        self.llm = llm
+        self.draft_model = draft_model
+        self.prefix_cache = prefix_cache
+        self.completed = 0
+        self.cancelled = 0
+
+    async def generate(self, prompt: str, params: Dict, prefix: Optional[str] = None) -> Dict:
+        stop = threading.Event()
+        job = asyncio.ensure_future(asyncio.to_thread(
+            complete, self.llm, prompt, params, self.draft_model, stop.is_set,
+            prefix=prefix, prefix_cache=self.prefix_cache
+        ))
+        try:
+            result = await run_cancellable(job, stop.set)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        self.completed += 1
+        return result
+
+    def stats(self) -> Dict:
+        return {"worker_id": "local", "completed": self.completed, "cancelled": self.cancelled}
+
+    def prefix_cache_stats(self) -> Optional[Dict]:
+        return self.prefix_cache.stats() if self.prefix_cache else None
+
+
+class WorkerHandle:
+    """Parent-side handle of one worker process; one generation at a time"""
+
+    def __init__(self, worker_id: int, process, conn, cpus: List[int], threads: int):
+        self.worker_id = worker_id
+        self.process = process
+        self.conn = conn
+        self.cpus = cpus
+        self.threads = threads
+        self.request_ids = itertools.count()
+        self.completed = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.pid: Optional[int] = None
+        self.draft_stats: Optional[Dict] = None
+        self.prefix_cache: Optional[Dict] = None  # stats as of the last result
+
+    async def generate(self, prompt: str, params: Dict, prefix: Optional[str] = None) -> Dict:
+        request_id = next(self.request_ids)
+        self.conn.send({"type": "generate", "id": request_id, "prompt": prompt, "params": params, "prefix": prefix})
+        job = asyncio.ensure_future(asyncio.to_thread(self.conn.recv))
+        try:
+            result = await run_cancellable(job, lambda: self.conn.send({"type": "cancel", "id": request_id}))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if result["type"] == "error":
+            self.errors += 1
+            raise RuntimeError(f"Inference worker {self.worker_id}: {result['error']}")
+        self.completed += 1
+        self.draft_stats = result.pop("draft_stats", None)
+        self.prefix_cache = result.pop("prefix_cache_stats", None)
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "pid": self.pid,
+            "alive": self.process.is_alive(),
+            "cpus": self.cpus,
+            "threads": self.threads,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+        }
+
+
+class InferencePool:
+    """llama.cpp worker processes; scheduler.PriorityScheduler hands them out"""
+
+    def __init__(self, workers: int, model_kwargs: Dict, threads_per_worker: int = 0,
+                 pin_cpus: bool = True, draft_kwargs: Optional[Dict] = None, start_method: str = "fork",
+                 prefix_cache_kwargs: Optional[Dict] = None):
+        self.size = workers
+        self.model_kwargs = model_kwargs
+        self.threads_per_worker = threads_per_worker
+        self.pin_cpus = pin_cpus
+        self.draft_kwargs = draft_kwargs
+        self.prefix_cache_kwargs = prefix_cache_kwargs
+        self.start_method = start_method
+        self.workers: List[WorkerHandle] = []
+
+    def launch(self):
+        """Start the worker processes
+
+        Call before the parent starts any threads when using the fork start
+        method; the workers load the model on their own.
+        """
+        context = multiprocessing.get_context(self.start_method)
+        for worker_id, cpus in enumerate(partition_cpus(self.size)):
+            threads = self.threads_per_worker or len(cpus)
+            model_kwargs = dict(self.model_kwargs, n_threads=threads, use_mmap=True)
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=worker_main,
+                args=(worker_id, child_conn, model_kwargs, cpus if self.pin_cpus else None, self.draft_kwargs,
+                      self.prefix_cache_kwargs),
+                name=f"lain-inference-{worker_id}",
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self.workers.append(WorkerHandle(worker_id, process, parent_conn, cpus, threads))
+
+    async def wait_ready(self):
+        """Wait until every worker has loaded the model"""
+        replies = await asyncio.gather(*(asyncio.to_thread(w.conn.recv) for w in self.workers))
+        errors = []
+        for worker, reply in zip(self.workers, replies):
+            if reply["type"] == "ready":
+                worker.pid = reply["pid"]
+                logger.info(f"  Inference worker {worker.worker_id} ready (pid {worker.pid}, "
+                            f"{worker.threads} threads, cpus {worker.cpus[0]}-{worker.cpus[-1]})")
+            else:
+                errors.append(f"worker {worker.worker_id}: {reply.get('error')}")
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+    def draft_stats(self) -> Optional[Dict]:
+        """Speculative decoding counters summed over workers"""
+        per_worker = [w.draft_stats for w in self.workers if w.draft_stats]
+        if not per_worker:
+            return None
+        totals = {"mode": per_worker[0]["mode"]}
+        for key in ("draft_calls", "proposed_tokens", "verified_tokens", "accepted_tokens"):
+            totals[key] = sum(stats[key] for stats in per_worker)
+        totals["acceptance_rate"] = (totals["accepted_tokens"] / totals["verified_tokens"]
+                                     if totals["verified_tokens"] else 0.0)
+        return totals
+
+    def prefix_cache_stats(self) -> Optional[Dict]:
+        """Prefix cache counters summed over workers (each worker caches for its own context)"""
+        return merge_stats([w.prefix_cache for w in self.workers])
+
+    def stats(self) -> List[Dict]:
+        return [w.stats() for w in self.workers]
+
+    async def close(self):
+        for worker in self.workers:
+            try:
+                worker.conn.send({"type": "shutdown"})
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            await asyncio.to_thread(worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.terminate()
@@ -0,0 +1,245 @@
+"""
+Portable, memory-mapped knowledge index
+
+A single file that ingest_knowledge.py --index writes and the agent's
+"index" retrieval backend searches in-process, for containers that have
+no Qdrant service. Opening it maps the file and parses a small header, so
+cold start does not depend on corpus size; pages are read on first search.
+
+Layout (little endian, every section 64-byte aligned):
+
+    magic      b"LAINIDX\\0"
+    u32        header length
+    header     JSON: format version, encoder model, dimension, dtype, count
+               and the (offset, bytes) of each section below
+    vectors    count x dimension, float32 or int8 (unit-normalised rows)
+    scales     count float32, int8 only: row = int8 * scale
+    ids        count x 16 bytes, the first half of each chunk's content hash
+               (the same id ingest uses for Qdrant points)
+    offsets    count + 1 u64 into payloads
+    payloads   compact JSON per row: topic, content, source, type
+
+The index records the encoder model and dimension it was built with; an
+index built with a different encoder is refused rather than searched.
+"""
+
+import json
+import os
+import shutil
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+MAGIC = b"LAINIDX\0"
+FORMAT_VERSION = 1
+ALIGN = 64
+DTYPES = {"float32": np.float32, "int8": np.int8}
+PAYLOAD_FIELDS = ("topic", "content", "source", "type")
+SCAN_ROWS = 16384  # rows dequantised per block when scanning an int8 index
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def quantize_rows(vectors: np.ndarray):
+    """Symmetric per-row int8 quantisation: (int8 rows, float32 scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class KnowledgeIndex:
+    """Read-only view of an index file"""
+
+    def __init__(self, path: Union[str, Path], model: Optional[str] = None, dimension: Optional[int] = None):
+        self.path = Path(path)
+        self.data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{self.path} is not a knowledge index")
+        (header_length,) = struct.unpack_from("<I", self.data, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(self.data[start:start + header_length]))
+
+        if self.header["version"] != FORMAT_VERSION:
+            raise ValueError(f"{self.path}: index format {self.header['version']}, expected {FORMAT_VERSION}")
+        if model and self.header["model"] != model:
+            raise ValueError(f"{self.path} was built with {self.header['model']}, the encoder is {model}")
+        if dimension and self.header["dimension"] != dimension:
+            raise ValueError(f"{self.path} has {self.header['dimension']}-d vectors, the encoder produces {dimension}")
+
+        self.model = self.header["model"]
+        self.dimension = self.header["dimension"]
+        self.dtype = self.header["dtype"]
+        self.count = self.header["count"]
+        self.vectors = self._section("vectors", DTYPES[self.dtype]).reshape(self.count, self.dimension)
+        self.scales = self._section("scales", np.float32) if self.dtype == "int8" else None
+        self.ids = self._section("ids", np.uint8).reshape(self.count, 16)
+        self.offsets = self._section("offsets", np.uint64)
+
+    def _section(self, name: str, dtype) -> np.ndarray:
+        offset, length = self.header["sections"][name]
+        return np.frombuffer(self.data, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def payload(self, row: int) -> Dict:
+        offset, length = self.header["sections"]["payloads"]
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(bytes(self.data[offset + start:offset + end]))
+
+    def row_ids(self) -> Dict[bytes, int]:
+        """Chunk id -> row, for reusing vectors when the index is rebuilt"""
+        return {bytes(row_id): row for row, row_id in enumerate(self.ids)}
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query to every row"""
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        if self.scales is None:
+            return self.vectors @ query
+        out = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SCAN_ROWS):
+            block = self.vectors[start:start + SCAN_ROWS]
+            out[start:start + len(block)] = (block.astype(np.float32) @ query) * self.scales[start:start + len(block)]
+        return out
+
+    def search(self, query: np.ndarray, limit: int) -> List[Dict]:
+        """Top-limit payloads by cosine similarity, each with its "relevance\""""
+        if not self.count or limit <= 0:
+            return []
+        scores = self.scores(query)
+        limit = min(limit, self.count)
+        top = np.argpartition(scores, -limit)[-limit:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [dict(self.payload(int(row)), relevance=float(scores[row])) for row in top]
+
+    def describe(self) -> Dict:
+        return {
+            "path": str(self.path),
+            "model": self.model,
+            "dimension": self.dimension,
+            "dtype": self.dtype,
+            "count": self.count,
+            "bytes": int(self.data.size),
+            "created": self.header.get("created"),
+        }
+
+
+class IndexWriter:
+    """Stream rows into a new index file, written atomically on close
+
+    Vectors and payloads are spooled to temporary files as they arrive, so
+    memory stays flat for large corpora. Rows whose id is already in the
+    previous index at the same path (same model, dimension and dtype) can be
+    added without a vector and are copied from it instead of re-encoded.
+    """
+
+    def __init__(self, path: Union[str, Path], model: str, dimension: int, dtype: str = "float32",
+                 metadata: Optional[Dict] = None):
+        if dtype not in DTYPES:
+            raise ValueError(f"unknown index dtype: {dtype}")
+        self.path = Path(path)
+        self.model = model
+        self.dimension = dimension
+        self.dtype = dtype
+        self.metadata = metadata or {}
+        self.previous: Optional[KnowledgeIndex] = None
+        self.previous_rows: Dict[bytes, int] = {}
+        if self.path.exists():
+            try:
+                previous = KnowledgeIndex(self.path, model, dimension)
+                if previous.dtype == dtype:
+                    self.previous = previous
+                    self.previous_rows = previous.row_ids()
+            except (ValueError, KeyError, OSError):
+                pass
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.vectors_file = open(self.path.with_suffix(self.path.suffix + ".vectors.tmp"), "wb")
+        self.payloads_file = open(self.path.with_suffix(self.path.suffix + ".payloads.tmp"), "wb")
+        self.ids: List[bytes] = []
+        self.scales: List[float] = []
+        self.offsets: List[int] = [0]
+        self.reused = 0
+
+    def has_vector(self, row_id: bytes) -> bool:
+        """Whether add() can take this row without a vector"""
+        return row_id in self.previous_rows
+
+    def add(self, row_id: bytes, payload: Dict, vector: Optional[np.ndarray] = None):
+        if vector is None:
+            row = self.previous_rows[row_id]
+            self.vectors_file.write(self.previous.vectors[row].tobytes())
+            if self.dtype == "int8":
+                self.scales.append(float(self.previous.scales[row]))
+            self.reused += 1
+        else:
+            vector = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+            if self.dtype == "int8":
+                vector, scales = quantize_rows(vector)
+                self.scales.append(float(scales[0]))
+            self.vectors_file.write(vector.astype(DTYPES[self.dtype]).tobytes())
+        encoded = json.dumps({k: payload.get(k) for k in PAYLOAD_FIELDS}, separators=(",", ":"),
+                             ensure_ascii=False).encode("utf-8")
+        self.payloads_file.write(encoded)
+        self.offsets.append(self.offsets[-1] + len(encoded))
+        self.ids.append(row_id)
+
+    def close(self) -> Dict:
+        """Assemble the index file and replace any previous one; returns the header"""
+        self.vectors_file.close()
+        self.payloads_file.close()
+        count = len(self.ids)
+        arrays = {
+            "scales": np.asarray(self.scales, dtype=np.float32).tobytes() if self.dtype == "int8" else b"",
+            "ids": b"".join(self.ids),
+            "offsets": np.asarray(self.offsets, dtype=np.uint64).tobytes(),
+        }
+        sizes = {
+            "vectors": os.path.getsize(self.vectors_file.name),
+            "scales": len(arrays["scales"]),
+            "ids": len(arrays["ids"]),
+            "offsets": len(arrays["offsets"]),
+            "payloads": os.path.getsize(self.payloads_file.name),
+        }
+        header = dict(self.metadata, version=FORMAT_VERSION, model=self.model, dimension=self.dimension,
+                      dtype=self.dtype, count=count, created=int(time.time()), sections={})
+
+        # Section offsets depend on the header length, which depends on the offsets: settle it
+        reserve = 0
+        while True:
+            offset = _aligned(len(MAGIC) + 4 + reserve)
+            for name in sizes:
+                header["sections"][name] = [offset, sizes[name]]
+                offset = _aligned(offset + sizes[name])
+            encoded = json.dumps(header).encode("utf-8")
+            if len(encoded) <= reserve:
+                break
+            reserve = len(encoded) + 64
+
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "wb") as out:
+            out.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+            for name, (offset, _) in header["sections"].items():
+                out.write(b"\0" * (offset - out.tell()))
+                if name in arrays:
+                    out.write(arrays[name])
+                else:
+                    with open(getattr(self, f"{name}_file").name, "rb") as spooled:
+                        shutil.copyfileobj(spooled, out)
+        os.replace(tmp_path, self.path)
+        self.discard()
+        return header
+
+    def discard(self):
+        """Remove the spool files (an unfinished index is never written)"""
+        for spooled in (self.vectors_file, self.payloads_file):
+            spooled.close()
+            if os.path.exists(spooled.name):
+                os.remove(spooled.name)
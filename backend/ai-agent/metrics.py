@@ -0,0 +1,123 @@
+"""
+Per-stage timing instrumentation for LainLLM
+
+Every timed stage is observed into a Prometheus histogram (served on
+/metrics) and, while a request is being handled, accumulated into that
+request's timing breakdown so /generate can return it. Stages may nest: a
+canister call made during retrieval is counted both as its own
+"canister:<method>" stage and as part of "retrieve".
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+STAGE_SECONDS = Histogram(
+    "lain_stage_seconds",
+    "Time spent in each /generate pipeline stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "lain_generate_seconds",
+    "End-to-end /generate latency",
+    buckets=STAGE_BUCKETS,
+)
+REQUESTS = Counter(
+    "lain_generate_requests_total",
+    "Handled /generate requests (ok, coalesced, degraded, expired, cancelled, error)",
+    ["outcome"],
+)
+LLM_TOKENS = Counter(
+    "lain_llm_tokens_total",
+    "Tokens processed by llama.cpp",
+    ["phase"],
+)
+LLM_FINISH = Counter(
+    "lain_llm_finish_total",
+    "Why llama.cpp stopped decoding (json_end, length, stop, cancelled)",
+    ["reason"],
+)
+LLM_MAX_TOKENS = Histogram(
+    "lain_llm_max_tokens",
+    "Token budget chosen per generation",
+    buckets=(16, 32, 48, 64, 96, 128, 192, 256, 384, 512),
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "lain_llm_tokens_per_second",
+    "llama.cpp throughput per request",
+    ["phase"],
+    buckets=TOKEN_RATE_BUCKETS,
+)
+
+# Timing breakdown of the request currently being handled (stage -> seconds)
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> Dict[str, float]:
+    """Begin collecting a timing breakdown for the current request"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as the named stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def observe_llm(prompt_tokens: int, prefill_seconds: float, completion_tokens: int, decode_seconds: float,
+                finish: str = "stop", max_tokens: Optional[int] = None, cached_tokens: int = 0):
+    """Record prefill/decode time, throughput and token budget for one generation
+
+    cached_tokens are prompt tokens restored from the prefix state cache
+    instead of prefilled; prefill throughput counts only the rest.
+    """
+    observe_stage("prefill", prefill_seconds)
+    LLM_FINISH.labels(finish).inc()
+    if max_tokens:
+        LLM_MAX_TOKENS.observe(max_tokens)
+    observe_stage("decode", decode_seconds)
+    LLM_TOKENS.labels("prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels("completion").inc(completion_tokens)
+    LLM_TOKENS.labels("prompt_cached").inc(cached_tokens)
+    if prefill_seconds > 0 and prompt_tokens > cached_tokens:
+        LLM_TOKENS_PER_SECOND.labels("prefill").observe((prompt_tokens - cached_tokens) / prefill_seconds)
+    # The first token is sampled during prefill; decode covers the rest
+    if decode_seconds > 0 and completion_tokens > 1:
+        LLM_TOKENS_PER_SECOND.labels("decode").observe((completion_tokens - 1) / decode_seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings["prompt_tokens"] = prompt_tokens
+        timings["cached_tokens"] = cached_tokens
+        timings["completion_tokens"] = completion_tokens
+        if max_tokens:
+            timings["max_tokens"] = max_tokens
+
+
+def observe_request(outcome: str, seconds: float):
+    REQUESTS.labels(outcome).inc()
+    REQUEST_SECONDS.observe(seconds)
+
+
+def render():
+    """Prometheus text exposition of all metrics: (body, content type)"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,174 @@
+"""
+Prefix state cache for llama.cpp
+
+Every prompt starts with the system prompt and the knowledge block, and
+retrieval keeps returning the same handful of passages. The cache keeps
+the llama.cpp state (KV cache and token ids) saved right after such a
+prefix, keyed by its text, so a request whose prefix was seen before loads
+the state and only prefills the rest of the prompt: history and user turn.
+
+llama.cpp already reuses the longest common token prefix of whatever is in
+the context, so a prefix that is still resident (the previous request on
+this model had the same one) needs no load at all. On a miss the prefix is
+evaluated on its own and saved before the full prompt runs, which costs no
+extra prefill.
+
+Only the KV cells of the prefix are saved (llama.cpp's per-sequence state
+API), not Llama.save_state(): that also copies the prompt's logits rows,
+and Llama.load_state() zero-fills the whole n_ctx x n_vocab logits buffer,
+committing gigabytes for a Llama 3 vocabulary. Logits of the prefix are
+never needed because generate always re-evaluates the last prompt token.
+
+Entries are LRU-evicted past a count and a byte budget. Each model (the
+in-process one or each inference worker) has its own cache.
+"""
+
+import ctypes
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import llama_cpp
+
+SEQ_ID = 0  # Llama keeps its single conversation in sequence 0
+
+
+def common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    if not n:
+        return 0
+    mismatch = np.flatnonzero(np.asarray(a[:n]) != np.asarray(b[:n]))
+    return int(mismatch[0]) if len(mismatch) else n
+
+
+@dataclass
+class PrefixState:
+    tokens: np.ndarray  # the prefix's token ids
+    data: bytearray  # llama_state_seq_get_data output: the prefix's KV cells
+
+    @property
+    def nbytes(self) -> int:
+        return self.tokens.nbytes + len(self.data)
+
+
+def save_prefix(llm, n_tokens: int) -> PrefixState:
+    """Copy the context's KV cells (exactly the first n_tokens tokens) out of llama.cpp"""
+    ctx = llm._ctx.ctx
+    size = llama_cpp.llama_state_seq_get_size(ctx, SEQ_ID)
+    data = bytearray(size)
+    written = llama_cpp.llama_state_seq_get_data(ctx, (ctypes.c_uint8 * size).from_buffer(data), size, SEQ_ID)
+    if not written:
+        raise RuntimeError("llama_state_seq_get_data failed")
+    return PrefixState(tokens=llm.input_ids[:n_tokens].copy(), data=data[:written])
+
+
+def load_prefix(llm, state: PrefixState):
+    """Replace the context's KV cells with a saved prefix"""
+    size = len(state.data)
+    if not llama_cpp.llama_state_seq_set_data(llm._ctx.ctx, (ctypes.c_uint8 * size).from_buffer(state.data), size, SEQ_ID):
+        llm.reset()
+        raise RuntimeError("llama_state_seq_set_data failed")
+    llm.input_ids[:len(state.tokens)] = state.tokens
+    llm.n_tokens = len(state.tokens)
+
+
+class PrefixStateCache:
+    """LRU cache of llama.cpp states saved after a prompt prefix"""
+
+    def __init__(self, max_entries: int = 8, max_bytes: int = 1 << 30, min_tokens: int = 32):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.entries: "OrderedDict[str, PrefixState]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.resident = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+        self.load_seconds = 0.0
+        self.save_seconds = 0.0
+
+    def prepare(self, llm, tokens: List[int], prefix: str) -> int:
+        """Bring the context to the cached state for prefix; returns prefix tokens reused from the cache
+
+        tokens is the tokenized full prompt. The prefix is measured in those
+        tokens (tokenizing it alone can split differently at the boundary),
+        and the last prompt token is always left for generate to evaluate.
+        """
+        n = min(common_prefix(llm.tokenize(prefix.encode("utf-8"), special=True), tokens), len(tokens) - 1)
+        if n < self.min_tokens or self.max_entries <= 0:
+            return 0
+
+        if llm.n_tokens >= n and common_prefix(llm.input_ids[:n], tokens) == n:
+            self.resident += 1
+            self.reused_tokens += n
+            return n
+
+        key = hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+        state = self.entries.get(key)
+        if state is not None and len(state.tokens) == n and common_prefix(state.tokens, tokens) == n:
+            start = time.perf_counter()
+            try:
+                load_prefix(llm, state)
+            except RuntimeError:
+                # Unusable entry (the context was reset): drop it and prefill as a miss
+                self.bytes -= self.entries.pop(key).nbytes
+            else:
+                self.load_seconds += time.perf_counter() - start
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.reused_tokens += n
+                return n
+
+        # Miss: evaluate only what the context does not already share with the prefix, then save
+        self.misses += 1
+        llm.n_tokens = common_prefix(llm.input_ids[:llm.n_tokens], tokens[:n])
+        llm.eval(tokens[llm.n_tokens:n])
+        start = time.perf_counter()
+        self.put(key, save_prefix(llm, n))
+        self.save_seconds += time.perf_counter() - start
+        return 0
+
+    def put(self, key: str, state: PrefixState):
+        if state.nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key).nbytes
+        self.entries[key] = state
+        self.bytes += state.nbytes
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.resident + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "resident": self.resident,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.resident) / lookups if lookups else 0.0,
+            "reused_tokens": self.reused_tokens,
+            "load_seconds": round(self.load_seconds, 3),
+            "save_seconds": round(self.save_seconds, 3),
+        }
+
+
+def merge_stats(per_model: List[Optional[Dict]]) -> Optional[Dict]:
+    """Prefix cache counters summed over models (inference workers)"""
+    per_model = [stats for stats in per_model if stats]
+    if not per_model:
+        return None
+    totals = {key: sum(stats[key] for stats in per_model) for key in per_model[0] if key != "hit_rate"}
+    lookups = totals["hits"] + totals["resident"] + totals["misses"]
+    totals["hit_rate"] = (totals["hits"] + totals["resident"]) / lookups if lookups else 0.0
+    return totals
@@ -0,0 +1,190 @@
+"""
+Token-budgeted prompt assembly for LainLLM
+
+Retrieval returns overlapping passages from several canister channels and
+backends. Before they go into the system message the builder:
+- drops exact duplicates (normalised text hash),
+- scores every passage by cosine similarity to the query,
+- drops near-duplicates of higher-ranked passages (embedding similarity),
+- fills the knowledge and history sections up to a token budget, cutting
+  the last passage at a sentence boundary when it does not fit whole,
+- optionally emits the selected passages in a fixed (sorted) order, so the
+  same passages always give the same knowledge block and its llama.cpp
+  state can be reused across queries (prefix_cache.py).
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+')
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """LRU cache of unit-length passage embeddings keyed by text hash
+
+    The canister keeps returning the same passages, so most lookups are hits
+    and passages are only encoded the first time they are seen.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray], max_entries: int = 4096):
+        self.encode_batch = encode_batch
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, texts: Sequence[str]) -> np.ndarray:
+        keys = [text_hash(t) for t in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            elif key not in missing:
+                missing[key] = text
+                self.misses += 1
+        if missing:
+            vectors = unit_rows(np.asarray(self.encode_batch(list(missing.values())), dtype=np.float32))
+            for key, vector in zip(missing, vectors):
+                self.entries[key] = vector
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return np.stack([self.entries[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class PromptBuilder:
+    """Select, deduplicate and budget knowledge/history sections of the prompt"""
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        embeddings: EmbeddingCache,
+        knowledge_budget: int = 600,
+        history_budget: int = 300,
+        dedup_similarity: float = 0.92,
+        min_similarity: float = 0.0,
+        min_fragment_tokens: int = 24,
+        stable_order: bool = False,
+    ):
+        self.count_tokens = count_tokens
+        self.embeddings = embeddings
+        self.knowledge_budget = knowledge_budget
+        self.history_budget = history_budget
+        self.dedup_similarity = dedup_similarity
+        self.min_similarity = min_similarity
+        self.min_fragment_tokens = min_fragment_tokens
+        self.stable_order = stable_order
+
+    def rank_knowledge(self, knowledge: List[Dict], query_embedding: Sequence[float]) -> Tuple[List[Dict], int]:
+        """Score passages against the query and drop duplicates
+
+        Returns (ranked items with "relevance" set to cosine similarity,
+        number of duplicates removed).
+        """
+        unique: Dict[str, Dict] = {}
+        for item in knowledge:
+            unique.setdefault(text_hash(item["content"]), item)
+        items = list(unique.values())
+        duplicates = len(knowledge) - len(items)
+        if not items:
+            return [], duplicates
+
+        vectors = self.embeddings.get_many([item["content"] for item in items])
+        query = unit_rows(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+        scores = vectors @ query
+
+        selected: List[int] = []
+        for index in np.argsort(-scores):
+            if scores[index] < self.min_similarity:
+                break
+            if selected and float(np.max(vectors[selected] @ vectors[index])) >= self.dedup_similarity:
+                duplicates += 1
+                continue
+            selected.append(int(index))
+
+        ranked = [dict(items[i], relevance=float(scores[i])) for i in selected]
+        return ranked, duplicates
+
+    def truncate_to_budget(self, text: str, budget: int) -> Optional[str]:
+        """Longest prefix of whole sentences that fits in budget tokens"""
+        kept = []
+        used = 0
+        for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+            cost = self.count_tokens(sentence + " ")
+            if used + cost > budget:
+                break
+            kept.append(sentence)
+            used += cost
+        return " ".join(kept) if kept else None
+
+    def fill_section(self, lines: List[str], budget: int) -> Tuple[List[str], int]:
+        """Take lines in order until the token budget is spent"""
+        taken = []
+        used = 0
+        for line in lines:
+            cost = self.count_tokens(line)
+            if used + cost <= budget:
+                taken.append(line)
+                used += cost
+                continue
+            remaining = budget - used
+            if remaining >= self.min_fragment_tokens:
+                prefix, _, body = line.partition(": ")
+                head = f"{prefix}: " if body else ""
+                fragment = self.truncate_to_budget(body or line, remaining - self.count_tokens(head))
+                if fragment:
+                    line = f"{head}{fragment}\n"
+                    taken.append(line)
+                    used += self.count_tokens(line)
+            break
+        return taken, used
+
+    def build_knowledge(self, knowledge: List[Dict], query_embedding: Sequence[float]) -> Tuple[str, Dict]:
+        ranked, duplicates = self.rank_knowledge(knowledge, query_embedding)
+        lines = [f"- {k['topic']}: {k['content']}\n" for k in ranked]
+        taken, used = self.fill_section(lines, self.knowledge_budget)
+        if self.stable_order:
+            # Selection is by relevance; order is by text, independent of the query
+            taken = sorted(taken)
+        section = "\n\nKnowledge about LainCorp:\n" + "".join(taken) if taken else ""
+        stats = {
+            "knowledge_candidates": len(knowledge),
+            "knowledge_duplicates": duplicates,
+            "knowledge_selected": len(taken),
+            "knowledge_tokens": used,
+        }
+        return section, stats
+
+    def build_history(self, turns: List[str]) -> Tuple[str, Dict]:
+        """Budget past interactions; turns are ordered most relevant/recent first"""
+        lines = [turn if turn.endswith("\n") else turn + "\n" for turn in turns]
+        taken, used = self.fill_section(lines, self.history_budget)
+        section = "\n\nPast interactions:\n" + "".join(taken) if taken else ""
+        return section, {"history_selected": len(taken), "history_tokens": used}
@@ -0,0 +1,229 @@
+"""
+Knowledge retrieval backends for LainLLM
+
+A backend takes a query embedding and returns knowledge items shaped like
+{"topic", "content", "source", "relevance"}. The agent can enable several
+backends at once (RETRIEVAL_BACKENDS=icp,qdrant,index) and merges their results.
+"""
+
+import asyncio
+import logging
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from knowledge_index import KnowledgeIndex
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalBackend:
+    """Base class for knowledge retrieval backends"""
+
+    name = "base"
+
+    async def search(self, query_embedding: np.ndarray, limit: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def describe(self) -> Dict:
+        return {"name": self.name}
+
+
+class QdrantBackend(RetrievalBackend):
+    """Search the lain_memory collection written by ingest_knowledge.py
+
+    Uses the async Qdrant client so lookups never block the event loop; HTTP
+    connections are kept alive and pooled (or a single gRPC channel is used
+    with prefer_grpc).
+    """
+
+    name = "qdrant"
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        collection: str,
+        grpc_port: int = 6334,
+        prefer_grpc: bool = False,
+        pool_size: int = 16,
+        timeout: float = 2.0,
+        hnsw_ef: Optional[int] = None,
+        exact: bool = False,
+        score_threshold: Optional[float] = None,
+        payload_filter: Optional[Dict[str, List[str]]] = None,
+    ):
+        # Optional dependency: only needed when the qdrant backend is enabled
+        import httpx
+        from qdrant_client import AsyncQdrantClient
+        from qdrant_client import models
+
+        self.models = models
+        self.collection = collection
+        self.score_threshold = score_threshold
+        self.payload_filter = {k: v for k, v in (payload_filter or {}).items() if v}
+        self.client = AsyncQdrantClient(
+            host=host,
+            port=port,
+            grpc_port=grpc_port,
+            prefer_grpc=prefer_grpc,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self.search_params = models.SearchParams(hnsw_ef=hnsw_ef, exact=exact)
+        self.query_filter = self._build_filter()
+        self.host = host
+        self.port = port
+
+    def _build_filter(self):
+        if not self.payload_filter:
+            return None
+        models = self.models
+        return models.Filter(must=[
+            models.FieldCondition(key=key, match=models.MatchAny(any=values))
+            for key, values in self.payload_filter.items()
+        ])
+
+    async def search(self, query_embedding: np.ndarray, limit: int) -> List[Dict]:
+        response = await self.client.query_points(
+            collection_name=self.collection,
+            query=query_embedding,
+            limit=limit,
+            query_filter=self.query_filter,
+            search_params=self.search_params,
+            score_threshold=self.score_threshold,
+            with_payload=True,
+            with_vectors=False,
+        )
+        knowledge = []
+        for point in response.points:
+            payload = point.payload or {}
+            content = payload.get("content")
+            if not content:
+                continue
+            knowledge.append({
+                "topic": payload.get("parent_topic") or payload.get("topic", "[Knowledge]"),
+                "content": content,
+                "source": payload.get("source", self.name),
+                "type": payload.get("type"),
+                "relevance": float(point.score),
+            })
+        return knowledge
+
+    async def close(self):
+        await self.client.close()
+
+    def describe(self) -> Dict:
+        return {
+            "name": self.name,
+            "url": f"{self.host}:{self.port}",
+            "collection": self.collection,
+            "filter": self.payload_filter,
+            "hnsw_ef": self.search_params.hnsw_ef,
+            "exact": self.search_params.exact,
+        }
+
+
+class IndexBackend(RetrievalBackend):
+    """Search a knowledge index file written by ingest_knowledge.py --index
+
+    The file is memory-mapped and scanned in-process, so no vector database
+    is needed. Small indexes are searched inline; larger ones on a worker
+    thread (numpy releases the GIL) so the scan does not stall the loop.
+    """
+
+    name = "index"
+
+    def __init__(self, path: str, model: Optional[str] = None, dimension: Optional[int] = None,
+                 thread_rows: int = 20000):
+        self.index = KnowledgeIndex(path, model, dimension)
+        self.thread_rows = thread_rows
+
+    async def search(self, query_embedding: np.ndarray, limit: int) -> List[Dict]:
+        if len(self.index) >= self.thread_rows:
+            results = await asyncio.to_thread(self.index.search, query_embedding, limit)
+        else:
+            results = self.index.search(query_embedding, limit)
+        return [
+            {
+                "topic": item.get("topic") or "[Knowledge]",
+                "content": item["content"],
+                "source": item.get("source") or self.name,
+                "type": item.get("type"),
+                "relevance": item["relevance"],
+            }
+            for item in results if item.get("content")
+        ]
+
+    def describe(self) -> Dict:
+        return {"name": self.name, **self.index.describe()}
+
+
+def parse_payload_filter(spec: str) -> Dict[str, List[str]]:
+    """Parse "type=company_info|wiki,source=laincorp_knowledge" into a filter dict"""
+    payload_filter: Dict[str, List[str]] = {}
+    for clause in spec.split(","):
+        if "=" not in clause:
+            continue
+        key, values = clause.split("=", 1)
+        payload_filter[key.strip()] = [v.strip() for v in values.split("|") if v.strip()]
+    return payload_filter
+
+
+def _content_key(content: str) -> str:
+    return re.sub(r"\s+", " ", content).strip().lower()
+
+
+def merge_results(results: List[List[Dict]], limit: Optional[int] = None) -> List[Dict]:
+    """Merge result lists from several backends
+
+    Relevance scales differ between backends (the ICP canister returns rank
+    order only, Qdrant and the index return cosine similarity), so lists are
+    interleaved by rank rather than sorted by score: each backend's best
+    result comes first, then each backend's second, and so on. Identical
+    passages (ignoring whitespace and case) are kept once, at their best
+    rank. limit, when given, cuts the merged list.
+    """
+    # Scores are comparable within one backend: order each list by its own relevance
+    results = [sorted(items, key=lambda x: x["relevance"], reverse=True) for items in results]
+    merged: Dict[str, Dict] = {}
+    longest = max((len(items) for items in results), default=0)
+    for rank in range(longest):
+        for items in results:
+            if rank < len(items):
+                merged.setdefault(_content_key(items[rank]["content"]), items[rank])
+    ranked = list(merged.values())
+    return ranked if limit is None else ranked[:limit]
+
+
+async def search_all(backends: List[RetrievalBackend], query_embedding: np.ndarray, limit: int) -> List[Dict]:
+    """Query every backend concurrently and merge; a failing backend is skipped
+
+    limit applies per backend. The merged list is not cut: scores from
+    different backends are not comparable, so the caller re-ranks the whole
+    deduplicated candidate set by embedding similarity (PromptBuilder).
+    """
+    if not backends:
+        return []
+
+    async def timed_search(backend: RetrievalBackend) -> List[Dict]:
+        with stage(f"retrieve:{backend.name}"):
+            return await backend.search(query_embedding, limit)
+
+    results = await asyncio.gather(
+        *(timed_search(backend) for backend in backends),
+        return_exceptions=True,
+    )
+    collected = []
+    for backend, result in zip(backends, results):
+        if isinstance(result, Exception):
+            logger.warning(f"  Retrieval backend {backend.name} failed: {result}")
+            continue
+        logger.info(f"  Backend {backend.name}: found {len(result)} results")
+        collected.append(result)
+    return merge_results(collected)
@@ -0,0 +1,96 @@
+"""
+Priority scheduling of LLM slots for LainLLM
+
+Every inference slot (the in-process model, or one worker process) runs one
+generation at a time. Requests wait for a slot in priority order - live
+viewer chat before filler broadcasts - and FIFO within a class. A request
+whose deadline passes while it waits leaves the queue with
+DeadlineExceeded instead of starting a generation nobody will use.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+PRIORITY_CLASSES = {"live": 0, "normal": 1, "broadcast": 2}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class PriorityScheduler:
+    def __init__(self, slots: List[Any]):
+        self.slots = list(slots)
+        self.free = list(slots)
+        self.waiting: List[tuple] = []  # (priority, seq, future)
+        self.seq = itertools.count()
+        self.granted = {name: 0 for name in PRIORITY_CLASSES}
+        self.expired = {name: 0 for name in PRIORITY_CLASSES}
+
+    async def acquire(self, priority: str, deadline: Optional[float] = None) -> Any:
+        """Wait for a free slot; deadline is a time.monotonic() timestamp"""
+        if deadline is not None and time.monotonic() >= deadline:
+            self.expired[priority] += 1
+            raise DeadlineExceeded(f"deadline passed before inference ({priority})")
+        if self.free and not self.pending():
+            self.granted[priority] += 1
+            return self.free.pop(0)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (PRIORITY_CLASSES[priority], next(self.seq), future))
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            slot = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Granted while timing out: hand the slot on
+                self.release(future.result())
+            future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                self.expired[priority] += 1
+                raise DeadlineExceeded(f"deadline passed waiting for the model ({priority})") from None
+            raise
+        self.granted[priority] += 1
+        return slot
+
+    def release(self, slot: Any):
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(slot)
+                return
+        # Least recently used slot goes first next time
+        self.free.append(slot)
+
+    def pending(self) -> int:
+        return sum(1 for _, _, future in self.waiting if not future.done())
+
+    def load(self) -> float:
+        """Requests running or waiting, per slot (above 1 means requests are queueing)"""
+        return (len(self.slots) - len(self.free) + self.pending()) / len(self.slots)
+
+    @asynccontextmanager
+    async def slot(self, priority: str, deadline: Optional[float] = None):
+        slot = await self.acquire(priority, deadline)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def stats(self) -> Dict:
+        waiting = {name: 0 for name in PRIORITY_CLASSES}
+        names = {rank: name for name, rank in PRIORITY_CLASSES.items()}
+        for rank, _, future in self.waiting:
+            if not future.done():
+                waiting[names[rank]] += 1
+        return {
+            "slots": len(self.slots),
+            "free": len(self.free),
+            "waiting": waiting,
+            "granted": self.granted,
+            "expired": self.expired,
+        }
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Sentence encoder backends for LainLLM and ingest_knowledge.py
+
+ENCODER_BACKEND selects how all-MiniLM-L6-v2 embeddings are computed:
+
+    torch  sentence-transformers on PyTorch (the original path)
+    onnx   an exported, int8-quantised copy of the same model on ONNX Runtime
+    auto   onnx when an export is present and passed its parity check,
+           otherwise torch (default)
+
+The ONNX path never imports torch: tokenisation runs the tokenizer.json
+saved with the export through the tokenizers library (transformers would
+pull torch in), and mean pooling and normalisation are done in NumPy. Both backends expose the subset of the SentenceTransformer
+API the services use (encode, tokenizer, max_seq_length).
+
+Export once (needs torch and sentence-transformers, e.g. in the image):
+
+    python sentence_encoder.py export /models/encoder-onnx
+
+The export is checked against the PyTorch model on PARITY_TEXTS and
+records the cosine similarities in encoder_config.json; an export below
+--min-cosine is never loaded.
+"""
+
+import argparse
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+CONFIG_FILE = "encoder_config.json"
+MODEL_FILE = "model.onnx"
+
+# Short chat lines and knowledge passages, like the traffic the encoder sees
+PARITY_TEXTS = [
+    "hey lain",
+    "what's the Wired?",
+    "Who is the CEO of LainCorp?",
+    "are you real or just a program?",
+    "lol",
+    "can you explain how the ICP canister stores conversation memory?",
+    "what music are you listening to right now",
+    "Present day, present time. The boundary between the Wired and the real world is thinner than you think.",
+    "LainCorp builds decentralised AI infrastructure on the Internet Computer; its streams are rendered live on lain.tv.",
+    "memex.wiki is a collaborative knowledge base about networks, consciousness and the history of the internet.",
+    "The protocol uses embeddings to retrieve personality fragments and past conversations before every reply.",
+    "no matter where you go, everyone's connected",
+]
+
+
+class WordPieceTokenizer:
+    """tokenizer.json with the padding/truncation the SentenceTransformer applies"""
+
+    def __init__(self, path: Path, max_length: int):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(str(path / "tokenizer.json"))
+        self.counter = Tokenizer.from_file(str(path / "tokenizer.json"))  # untruncated, for tokenize()
+        pad_token = json.loads((path / "tokenizer_config.json").read_text()).get("pad_token", "[PAD]")
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+
+    def tokenize(self, text: str) -> List[str]:
+        """Word pieces without special tokens (what ingest_knowledge.py chunks by)"""
+        return self.counter.encode(text, add_special_tokens=False).tokens
+
+    def batch(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        encodings = self.tokenizer.encode_batch(texts)
+        return {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+
+
+class OnnxEncoder:
+    """SentenceTransformer-compatible encoder running an exported model on ONNX Runtime"""
+
+    def __init__(self, path: Union[str, Path], threads: int = 0, config: Optional[Dict] = None):
+        import onnxruntime as ort
+
+        self.path = Path(path)
+        if config is None:
+            config = json.loads((self.path / CONFIG_FILE).read_text())
+            parity = config.get("parity") or {}
+            if not parity.get("passed"):
+                raise ValueError(f"export at {self.path} did not pass its parity check ({parity})")
+        # else: export_onnx checking a candidate whose config is not written yet
+        self.config = config
+
+        self.model_name = self.config["model_name"]
+        self.max_seq_length = self.config["max_seq_length"]
+        self.pooling = self.config["pooling"]
+        self.normalize = self.config["normalize"]
+        self.tokenizer = WordPieceTokenizer(self.path, self.max_seq_length)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(self.path / MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer.batch(texts)
+        feeds = {name: inputs[name] for name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **_) -> np.ndarray:
+        """Embed one text (returns a vector) or a list (returns a row per text)"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Longest first, as sentence-transformers does, so batches pad little
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        out = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            out[rows] = self._encode_batch([texts[i] for i in rows])
+        return out[0] if single else out
+
+
+def load_encoder(backend: str = "auto", model_name: str = DEFAULT_MODEL,
+                 onnx_path: Optional[Union[str, Path]] = None, threads: int = 0):
+    """Load the encoder for ENCODER_BACKEND; auto falls back to torch if the ONNX export is unusable"""
+    if backend not in ("auto", "onnx", "torch"):
+        raise ValueError(f"unknown encoder backend: {backend}")
+    if backend in ("auto", "onnx") and onnx_path:
+        try:
+            return OnnxEncoder(onnx_path, threads)
+        except Exception as e:
+            if backend == "onnx":
+                raise
+            logger.warning(f"⚠ ONNX encoder unavailable ({e}), using sentence-transformers")
+    elif backend == "onnx":
+        raise ValueError("ENCODER_BACKEND=onnx needs ENCODER_ONNX_PATH")
+
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device="cpu")
+
+
+def describe(encoder) -> Dict[str, Any]:
+    """Backend details for /stats"""
+    if isinstance(encoder, OnnxEncoder):
+        return {
+            "backend": "onnx",
+            "model": encoder.model_name,
+            "path": str(encoder.path),
+            "quantized": encoder.config.get("quantized"),
+            "parity_min_cosine": encoder.config["parity"]["min_cosine"],
+        }
+    return {"backend": "torch", "max_seq_length": encoder.max_seq_length}
+
+
+def cosine_parity(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """Row-wise cosine similarity between two embedding matrices"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean())}
+
+
+def export_onnx(out_dir: Path, model_name: str = DEFAULT_MODEL, quantize: bool = True,
+                min_cosine: float = 0.98, opset: int = 14) -> Dict:
+    """Export the transformer to ONNX, quantise weights to int8 and check parity"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    reference = SentenceTransformer(model_name, device="cpu")
+    transformer = reference[0].auto_model.eval()
+    pooling = next(m for m in reference if isinstance(m, Pooling)).get_config_dict()
+    if not (pooling.get("pooling_mode_mean_tokens") or pooling.get("pooling_mode_cls_token")):
+        raise ValueError(f"{model_name}: only mean or CLS pooling is supported ({pooling})")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # The config marks an export as checked: drop any previous one before replacing the model
+    config_path = out_dir / CONFIG_FILE
+    config_path.unlink(missing_ok=True)
+    reference.tokenizer.save_pretrained(out_dir)
+    sample = reference.tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    fp32_path = out_dir / "model_fp32.onnx"
+    # TorchScript exporter: recent torch defaults to dynamo, which needs onnxscript
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            str(fp32_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+            opset_version=opset,
+            **legacy
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(fp32_path), str(out_dir / MODEL_FILE), weight_type=QuantType.QInt8)
+        fp32_path.unlink()
+    else:
+        shutil.move(str(fp32_path), str(out_dir / MODEL_FILE))
+
+    config = {
+        "model_name": model_name,
+        "max_seq_length": reference.max_seq_length,
+        "dimension": reference.get_sentence_embedding_dimension(),
+        "pooling": "mean" if pooling.get("pooling_mode_mean_tokens") else "cls",
+        "normalize": any(isinstance(m, Normalize) for m in reference),
+        "quantized": quantize,
+    }
+
+    expected = reference.encode(PARITY_TEXTS, convert_to_numpy=True)
+    candidate = OnnxEncoder(out_dir, config=config).encode(PARITY_TEXTS)
+    parity = cosine_parity(expected, candidate)
+    parity["threshold"] = min_cosine
+    parity["passed"] = parity["min_cosine"] >= min_cosine
+    config["parity"] = parity
+
+    # Written only once parity is measured, atomically: an interrupted export leaves no config
+    tmp_path = config_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(config, indent=2))
+    os.replace(tmp_path, config_path)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sentence encoder tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export an int8 ONNX copy of the encoder")
+    export.add_argument("out_dir", type=Path)
+    export.add_argument("--model", default=os.getenv("ENCODER_MODEL", DEFAULT_MODEL))
+    export.add_argument("--no-quantize", action="store_true", help="keep fp32 weights")
+    export.add_argument("--min-cosine", type=float, default=0.98,
+                        help="lowest per-text cosine similarity to the PyTorch model to accept")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    print(f"Exporting {args.model} to {args.out_dir}...")
+    config = export_onnx(args.out_dir, args.model, quantize=not args.no_quantize, min_cosine=args.min_cosine)
+    parity = config["parity"]
+    size_mb = (args.out_dir / MODEL_FILE).stat().st_size / 1e6
+    print(f"  {MODEL_FILE}: {size_mb:.1f} MB ({'int8' if config['quantized'] else 'fp32'}), "
+          f"exported in {time.perf_counter() - start:.1f}s")
+    print(f"  Parity vs PyTorch: min cosine {parity['min_cosine']:.4f}, mean {parity['mean_cosine']:.4f}")
+    if not parity["passed"]:
+        raise SystemExit(f"❌ Parity below {args.min_cosine}; the export will not be used")
+    print("✓ ONNX encoder ready")
+
+
+if __name__ == "__main__":
+    main()
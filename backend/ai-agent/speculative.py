@@ -0,0 +1,117 @@
+"""
+Speculative decoding for LainLLM
+
+A draft model proposes several tokens per step and the main model verifies
+them in one batched eval; llama.cpp keeps only the tokens the main model
+would have sampled anyway, so output quality is unchanged. Two drafters:
+- prompt_lookup: n-gram matches against the prompt (which contains the
+  retrieved knowledge Lain tends to paraphrase); no extra model needed.
+- draft: a small GGUF sharing the main model's vocabulary, decoded greedily.
+"""
+
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+logger = logging.getLogger(__name__)
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """Greedy drafts from a small GGUF model
+
+    The draft context keeps its KV cache between calls; llama.cpp reuses
+    the longest common token prefix, so each call only evaluates the
+    tokens accepted since the previous one.
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 8, n_ctx: int = 4096,
+                 n_threads: int = 2, n_batch: int = 512):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_batch=n_batch,
+            n_threads=n_threads,
+            verbose=False
+        )
+        self.eos = self.llm.token_eos()
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        drafted = []
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, top_p=1.0, temp=0.0, reset=True):
+            if token == self.eos:
+                break
+            drafted.append(token)
+            if len(drafted) >= self.num_pred_tokens:
+                break
+        return np.array(drafted, dtype=np.intc)
+
+
+class DraftAcceptanceTracker(LlamaDraftModel):
+    """Wrap a draft model and estimate how many drafted tokens are accepted
+
+    llama.cpp calls the drafter once per verification step with every token
+    accepted so far, so the growth of the input between two calls is the
+    number of accepted draft tokens plus the one token sampled by the main
+    model.
+    """
+
+    def __init__(self, draft: LlamaDraftModel, mode: str):
+        self.draft = draft
+        self.mode = mode
+        self.calls = 0
+        self.proposed = 0
+        self.verified = 0
+        self.accepted = 0
+        self._last_len: Optional[int] = None
+        self._last_proposed = 0
+
+    def begin(self):
+        """Mark the start of a new generation so steps are not linked across prompts"""
+        self._last_len = None
+        self._last_proposed = 0
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        n = len(input_ids)
+        if self._last_len is not None:
+            grown = n - self._last_len
+            if 1 <= grown <= self._last_proposed + 1:
+                self.verified += self._last_proposed
+                self.accepted += grown - 1
+        drafted = self.draft(input_ids, **kwargs)
+        self.calls += 1
+        self.proposed += len(drafted)
+        self._last_len = n
+        self._last_proposed = len(drafted)
+        return drafted
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "draft_calls": self.calls,
+            "proposed_tokens": self.proposed,
+            "verified_tokens": self.verified,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": self.accepted / self.verified if self.verified else 0.0,
+        }
+
+
+def create_draft_model(mode: str, draft_model_path: str = "", num_pred_tokens: int = 8,
+                       max_ngram_size: int = 3, n_ctx: int = 4096,
+                       n_threads: int = 2) -> Optional[DraftAcceptanceTracker]:
+    """Build the drafter for SPECULATIVE_MODE (off, prompt_lookup or draft)"""
+    if mode in ("", "off", "none"):
+        return None
+    if mode == "prompt_lookup":
+        draft = LlamaPromptLookupDecoding(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+    elif mode == "draft":
+        if not draft_model_path:
+            raise ValueError("SPECULATIVE_MODE=draft requires DRAFT_MODEL_PATH")
+        draft = GGUFDraftModel(draft_model_path, num_pred_tokens=num_pred_tokens, n_ctx=n_ctx, n_threads=n_threads)
+    else:
+        raise ValueError(f"Unknown SPECULATIVE_MODE: {mode}")
+    logger.info(f"✓ Speculative decoding enabled: {mode} ({num_pred_tokens} draft tokens per step)")
+    return DraftAcceptanceTracker(draft, mode)
@@ -1,9 +1,23 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
 import redis
 import os
 import random
 import math
+import struct
+import json
+import logging
+import socket
+import threading
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))  # checkout; the image copies it in
+from stream_consumer import StreamConsumer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -14,6 +28,23 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+# Pipeline mode: consume audio + visemes from the TTS stream, publish frame tracks
+PIPELINE_STREAMS = os.getenv('PIPELINE_STREAMS', 'false').lower() == 'true'
+PIPELINE_AUDIO_STREAM = os.getenv('PIPELINE_AUDIO_STREAM', 'lain:audio')
+PIPELINE_FRAME_STREAM = os.getenv('PIPELINE_FRAME_STREAM', 'lain:frames')
+PIPELINE_GROUP = os.getenv('PIPELINE_GROUP', 'animation')
+PIPELINE_CONSUMER = os.getenv('PIPELINE_CONSUMER', socket.gethostname())  # stable across restarts
+PIPELINE_CLAIM_IDLE_MS = int(os.getenv('PIPELINE_CLAIM_IDLE_MS', 30000))  # reclaim entries of dead consumers
+PIPELINE_STREAM_MAXLEN = int(os.getenv('PIPELINE_STREAM_MAXLEN', 10000))
+PIPELINE_FRAME_FORMAT = os.getenv('PIPELINE_FRAME_FORMAT', 'f16')
+
+# Stream entries carry binary audio and frames, so they get their own undecoded client
+stream_client = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'redis'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    decode_responses=False
+)
+
 # VRM Blend Shape mappings (ARKit/VRM standard blend shapes)
 # Values range from 0.0 to 1.0
 VRM_BLEND_SHAPES = {
@@ -323,10 +354,83 @@ EFFECTS = {
     }
 }
 
+# Compact frame encoding
+# The JSON frames repeat every blend shape, bone and effect name on every
+# frame. Compact frames drop the keys and send the values in the fixed order
+# advertised by /schema, packed as little-endian float32 or float16.
+FRAME_SCHEMA_VERSION = 1
+MOODS = list(VRM_BLEND_SHAPES.keys())
+STATES = ["idle", "speaking"]
+BLEND_SHAPE_NAMES = list(VRM_BLEND_SHAPES["neutral"]["idle"].keys())
+BONE_NAMES = list(BONE_ROTATIONS["neutral"]["idle"].keys())
+EFFECT_NAMES = list(EFFECTS["neutral"].keys())
+FRAME_VALUE_COUNT = len(BLEND_SHAPE_NAMES) + 3 * len(BONE_NAMES) + len(EFFECT_NAMES)
+
+# Header: schema version, mood index, state index, flags (bit 0 = loop), duration in ms
+FRAME_HEADER = struct.Struct("<BBBBH")
+FRAME_FLAG_LOOP = 0x01
+
+# format name -> struct format character for a single value
+FRAME_FORMATS = {
+    "f32": "f",
+    "f16": "e"
+}
+FRAME_MEDIA_TYPE = "application/octet-stream"
+
+def frame_struct(fmt):
+    """Packed layout of one compact frame in the given format"""
+    return struct.Struct(f"<{FRAME_HEADER.format[1:]}{FRAME_VALUE_COUNT}{FRAME_FORMATS[fmt]}")
+
+FRAME_STRUCTS = {fmt: frame_struct(fmt) for fmt in FRAME_FORMATS}
+
+def encode_frame(animation_data, fmt, duration=0.0, loop=False):
+    """Pack an animation frame into the compact binary layout"""
+    blend_shapes = animation_data["blend_shapes"]
+    bone_rotations = animation_data["bone_rotations"]
+    effects = animation_data["effects"]
+
+    values = [float(blend_shapes.get(name, 0.0)) for name in BLEND_SHAPE_NAMES]
+    for name in BONE_NAMES:
+        values.extend(float(v) for v in bone_rotations.get(name, (0.0, 0.0, 0.0)))
+    values.extend(float(effects.get(name, 0.0)) for name in EFFECT_NAMES)
+
+    mood = animation_data.get("mood", "neutral")
+    state = animation_data.get("state", "idle")
+    return FRAME_STRUCTS[fmt].pack(
+        FRAME_SCHEMA_VERSION,
+        MOODS.index(mood) if mood in MOODS else 0,
+        STATES.index(state) if state in STATES else 0,
+        FRAME_FLAG_LOOP if loop else 0,
+        int(round(duration * 1000)),
+        *values
+    )
+
+def frame_response(animation_data, fmt, duration=0.0, loop=False):
+    """Build a binary HTTP response for a compact frame"""
+    return Response(
+        content=encode_frame(animation_data, fmt, duration, loop),
+        media_type=FRAME_MEDIA_TYPE,
+        headers={
+            "X-Frame-Schema": str(FRAME_SCHEMA_VERSION),
+            "X-Frame-Format": fmt
+        }
+    )
+
+def check_format(fmt):
+    """Validate a requested frame format ("json" or one of FRAME_FORMATS)"""
+    fmt = (fmt or "json").lower()
+    if fmt != "json" and fmt not in FRAME_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown format '{fmt}', expected one of: json, {', '.join(FRAME_FORMATS)}"
+        )
+    return fmt
+
 class AnimationRequest(BaseModel):
     mood: str = "neutral"
     state: str = "idle"  # idle or speaking
     audioData: list = None  # Optional: audio amplitude data for lip sync
+    format: str = "json"  # json, or a compact frame format (f32, f16)
 
 def add_variation(value, variation=0.1):
     """Add slight random variation to values for natural movement"""
@@ -358,10 +462,14 @@ def calculate_lip_sync(audio_data):
 async def health():
     return {"status": "ok", "moods": list(VRM_BLEND_SHAPES.keys())}
 
-@app.post("/get_animation")
-async def get_animation(request: AnimationRequest):
-    mood = request.mood.lower()
-    state = request.state.lower()
+def build_animation(mood, state, audio_data=None, mouth=None):
+    """One animation frame for a mood/state, with natural variation
+    
+    Mouth shapes come from audio_data amplitudes or, when given, directly
+    from a {"aa", "ih", "oh"} viseme.
+    """
+    mood = mood.lower()
+    state = state.lower()
     
     # Default to neutral if mood not found
     if mood not in VRM_BLEND_SHAPES:
@@ -390,8 +498,8 @@ async def get_animation(request: AnimationRequest):
     blend_shapes["blink"] = blink_value
     
     # If audio data provided and speaking, use it for lip sync
-    if state == "speaking" and request.audioData:
-        lip_sync = calculate_lip_sync(request.audioData)
+    if state == "speaking" and (audio_data or mouth):
+        lip_sync = mouth or calculate_lip_sync(audio_data)
         blend_shapes["aa"] = lip_sync["aa"]
         blend_shapes["ih"] = lip_sync["ih"]
         blend_shapes["oh"] = lip_sync["oh"]
@@ -404,23 +512,33 @@ async def get_animation(request: AnimationRequest):
             add_variation(bone_rotations["head"][2], 0.05)
         ]
     
-    # Cache current animation in Redis
-    import json
-    animation_data = {
+    return {
         "blend_shapes": blend_shapes,
         "bone_rotations": bone_rotations,
         "effects": effects,
         "mood": mood,
         "state": state
     }
+
+@app.post("/get_animation")
+async def get_animation(request: AnimationRequest):
+    fmt = check_format(request.format)
+    animation_data = build_animation(request.mood, request.state, request.audioData)
+    mood = animation_data["mood"]
+    state = animation_data["state"]
+    
+    # Cache current animation in Redis
     redis_client.setex("current_animation", 60, json.dumps(animation_data))
     redis_client.setex("current_mood", 60, mood)
     
+    if fmt != "json":
+        return frame_response(animation_data, fmt, duration=2.0, loop=state == "idle")
+    
     return {
         "vrm_data": {
-            "blend_shapes": blend_shapes,
-            "bone_rotations": bone_rotations,
-            "effects": effects
+            "blend_shapes": animation_data["blend_shapes"],
+            "bone_rotations": animation_data["bone_rotations"],
+            "effects": animation_data["effects"]
         },
         "mood": mood,
         "state": state,
@@ -429,29 +547,117 @@ async def get_animation(request: AnimationRequest):
     }
 
 @app.get("/current")
-async def current_animation():
-    import json
+async def current_animation(format: str = "json"):
+    fmt = check_format(format)
     animation_str = redis_client.get("current_animation")
     mood = redis_client.get("current_mood") or "neutral"
     
     if animation_str:
         animation_data = json.loads(animation_str)
-        return animation_data
+    else:
+        # Return default if nothing cached
+        animation_data = {
+            "blend_shapes": VRM_BLEND_SHAPES["neutral"]["idle"],
+            "bone_rotations": BONE_ROTATIONS["neutral"]["idle"],
+            "effects": EFFECTS["neutral"],
+            "mood": "neutral",
+            "state": "idle"
+        }
     
-    # Return default if nothing cached
-    return {
-        "blend_shapes": VRM_BLEND_SHAPES["neutral"]["idle"],
-        "bone_rotations": BONE_ROTATIONS["neutral"]["idle"],
-        "effects": EFFECTS["neutral"],
-        "mood": "neutral",
-        "state": "idle"
-    }
+    if fmt != "json":
+        return frame_response(animation_data, fmt)
+    
+    return animation_data
 
 @app.get("/moods")
 async def get_moods():
     return {
         "moods": list(VRM_BLEND_SHAPES.keys()),
-        "states": ["idle", "speaking"]
+        "states": ["idle", "speaking"],
+        "frame_schema": FRAME_SCHEMA_VERSION,
+        "formats": ["json"] + list(FRAME_FORMATS.keys())
+    }
+
+@app.get("/schema")
+async def get_schema():
+    """Describe the compact frame layout so clients can decode binary frames"""
+    return {
+        "version": FRAME_SCHEMA_VERSION,
+        "byte_order": "little",
+        "header": [
+            {"name": "version", "type": "uint8"},
+            {"name": "mood", "type": "uint8", "values": MOODS},
+            {"name": "state", "type": "uint8", "values": STATES},
+            {"name": "flags", "type": "uint8", "bits": {"loop": FRAME_FLAG_LOOP}},
+            {"name": "duration_ms", "type": "uint16"}
+        ],
+        "values": {
+            "blend_shapes": BLEND_SHAPE_NAMES,
+            "bone_rotations": {"bones": BONE_NAMES, "components": ["x", "y", "z"]},
+            "effects": EFFECT_NAMES
+        },
+        "value_count": FRAME_VALUE_COUNT,
+        "formats": {
+            fmt: {"value_type": "float32" if code == "f" else "float16", "frame_bytes": FRAME_STRUCTS[fmt].size}
+            for fmt, code in FRAME_FORMATS.items()
+        },
+        # Pipeline frames fanned out by the websocket server, as binary messages on request
+        "websocket": {
+            "url": "/ws?av=binary",
+            "lain_av": [
+                {"name": "header_bytes", "type": "uint32"},
+                {"name": "header", "type": "json", "fields": ["frame_format", "fps", "frames_bytes", "audio_bytes"]},
+                {"name": "frames", "type": "frames", "bytes": "frames_bytes"},
+                {"name": "audio", "type": "wav", "bytes": "audio_bytes"}
+            ]
+        }
+    }
+
+def handle_audio_event(fields):
+    """Turn one sentence's viseme track into compact frames and publish them with its audio"""
+    mood = fields.get(b"mood", b"neutral").decode()
+    fps = int(fields[b"viseme_fps"])
+    frames = [
+        build_animation(mood, "speaking", mouth={"aa": aa, "ih": ih, "oh": oh})
+        for aa, ih, oh in json.loads(fields[b"visemes"])
+    ]
+    stream_client.xadd(PIPELINE_FRAME_STREAM, {
+        "reply_id": fields[b"reply_id"],
+        "seq": fields[b"seq"],
+        "final": fields[b"final"],
+        "mood": mood,
+        "ts": fields[b"ts"],
+        "fps": fps,
+        "frame_format": PIPELINE_FRAME_FORMAT,
+        "frames": b"".join(encode_frame(f, PIPELINE_FRAME_FORMAT, duration=1 / fps) for f in frames),
+        "audio": fields[b"audio"],
+        "sample_rate": fields[b"sample_rate"]
+    }, maxlen=PIPELINE_STREAM_MAXLEN, approximate=True)
+    if frames:
+        redis_client.setex("current_animation", 60, json.dumps(frames[-1]))
+        redis_client.setex("current_mood", 60, frames[-1]["mood"])
+
+pipeline_consumer = StreamConsumer(
+    stream_client, PIPELINE_AUDIO_STREAM, PIPELINE_GROUP, PIPELINE_CONSUMER, handle_audio_event,
+    claim_idle_ms=PIPELINE_CLAIM_IDLE_MS, dead_maxlen=PIPELINE_STREAM_MAXLEN
+) if PIPELINE_STREAMS else None
+pipeline_stop = threading.Event()
+
+@app.on_event("startup")
+async def start_pipeline():
+    if pipeline_consumer:
+        if PIPELINE_FRAME_FORMAT not in FRAME_FORMATS:
+            raise ValueError(f"PIPELINE_FRAME_FORMAT must be one of: {', '.join(FRAME_FORMATS)}")
+        threading.Thread(target=pipeline_consumer.run, args=(pipeline_stop,), name="pipeline", daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_pipeline():
+    pipeline_stop.set()
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "pipeline": pipeline_consumer.stats() if pipeline_consumer else None
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: Candid argument encoding for canister calls
+
+Compares, per call, the old path (ndarray.tolist(), a [float(x) ...] copy,
+then ic.candid.encode with per-element type checks) against
+canister_client's precompiled encoders writing vec float32 straight from
+the NumPy buffer. Both must produce identical bytes; the benchmark checks
+that before timing.
+
+Usage:
+    python bench/candid_bench.py --dim 384 --iterations 20000
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+AGENT_DIR = Path(__file__).resolve().parent.parent / "ai-agent"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Candid encoding of embedding arguments")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension (all-MiniLM-L6-v2: 384)")
+    parser.add_argument("--iterations", type=int, default=20000, help="encodings per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements; the best is reported")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(AGENT_DIR))
+    sys.path.append(str(AGENT_DIR.parent / "common"))
+    from ic.candid import encode
+    from canister_client import SEARCH_PERSONALITY, SEARCH_USER_CONVERSATION_HISTORY
+
+    embedding = np.random.default_rng(0).standard_normal(args.dim).astype(np.float32)
+
+    cases = {
+        "search_personality": (
+            SEARCH_PERSONALITY,
+            lambda: ("#wiki", [float(x) for x in embedding.tolist()]),
+            lambda: ("#wiki", embedding),
+        ),
+        "search_user_conversation_history": (
+            SEARCH_USER_CONVERSATION_HISTORY,
+            lambda: ("principal", "#general", [float(x) for x in embedding.tolist()], [5]),
+            lambda: ("principal", "#general", embedding, 5),
+        ),
+    }
+
+    print(f"🔮 Candid encoding, vec float32 of {args.dim}, best of {args.repeat} x {args.iterations}")
+    print(f"{'method':<36}{'ic.candid':>12}{'fast':>12}{'speedup':>10}   (µs/call)")
+    for name, (method, old_args, new_args) in cases.items():
+        def old():
+            values = old_args()
+            return encode([{'type': t, 'value': v} for t, v in zip(method.arg_types, values)])
+
+        def new():
+            return method.encode_args(*new_args())
+
+        if old() != new():
+            raise SystemExit(f"❌ {name}: fast encoding differs from ic.candid.encode")
+
+        old_us = min(timeit.repeat(old, number=args.iterations, repeat=args.repeat)) / args.iterations * 1e6
+        new_us = min(timeit.repeat(new, number=args.iterations, repeat=args.repeat)) / args.iterations * 1e6
+        print(f"{name:<36}{old_us:>12.1f}{new_us:>12.1f}{old_us / new_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
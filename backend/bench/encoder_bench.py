@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Sentence encoder benchmark: PyTorch vs int8 ONNX Runtime
+
+Each backend runs in its own subprocess so its memory is measured alone.
+Reported per backend:
+
+    load     seconds to import and load the encoder
+    rss      resident memory after loading and encoding (MB), and peak
+    query    single-message encode latency p50/p95 (chat trace messages)
+    batch    passages per second encoding the knowledge file in batches
+
+Embeddings of the same corpus are compared against the torch backend
+(per-text cosine similarity) to confirm the export still ranks the same.
+
+Usage:
+    python ai-agent/sentence_encoder.py export /models/encoder-onnx
+    python bench/encoder_bench.py --onnx-path /models/encoder-onnx
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+AGENT_DIR = BENCH_DIR.parent / "ai-agent"
+DEFAULT_TRACE = BENCH_DIR / "traces" / "chat.jsonl"
+DEFAULT_KNOWLEDGE = BENCH_DIR.parent / "data" / "laincorp_knowledge.json"
+
+
+def rss_mb():
+    """(current, peak) resident set size of this process in MB"""
+    status = dict(line.split(":", 1) for line in Path("/proc/self/status").read_text().splitlines() if ":" in line)
+    return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+
+
+def load_corpus(trace: Path, knowledge: Path):
+    queries = [json.loads(line)["message"] for line in trace.read_text().splitlines() if line.strip()]
+    passages = [
+        f"{entry['topic']}: {entry['content']}"
+        for entries in json.loads(knowledge.read_text()).values()
+        for entry in entries
+    ]
+    return queries, passages
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000
+
+
+def run_worker(args):
+    """Measure one backend in this process and write its results"""
+    sys.path.insert(0, str(AGENT_DIR))
+    queries, passages = load_corpus(args.trace, args.knowledge)
+
+    start = time.perf_counter()
+    from sentence_encoder import describe, load_encoder
+    encoder = load_encoder(args.worker, args.model, args.onnx_path, args.threads)
+    load_seconds = time.perf_counter() - start
+
+    for text in queries[:5]:
+        encoder.encode(text)
+
+    latencies = []
+    for _ in range(args.rounds):
+        for text in queries:
+            t = time.perf_counter()
+            encoder.encode(text)
+            latencies.append(time.perf_counter() - t)
+
+    t = time.perf_counter()
+    for _ in range(args.rounds):
+        embeddings = encoder.encode(passages, batch_size=args.batch_size)
+    batch_seconds = (time.perf_counter() - t) / args.rounds
+
+    rss, peak = rss_mb()
+    np.save(args.out / f"{args.worker}.npy", np.vstack([encoder.encode(queries), embeddings]))
+    (args.out / f"{args.worker}.json").write_text(json.dumps({
+        "encoder": describe(encoder),
+        "load_seconds": load_seconds,
+        "rss_mb": rss,
+        "peak_rss_mb": peak,
+        "query_p50_ms": percentile(latencies, 50),
+        "query_p95_ms": percentile(latencies, 95),
+        "passages_per_second": len(passages) / batch_seconds,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentence encoder backends")
+    parser.add_argument("--onnx-path", default="/models/encoder-onnx", help="directory from sentence_encoder.py export")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="sentence-transformers model for torch")
+    parser.add_argument("--backends", default="torch,onnx", help="comma separated; torch is the parity reference")
+    parser.add_argument("--trace", type=Path, default=DEFAULT_TRACE, help="JSONL of chat messages (queries)")
+    parser.add_argument("--knowledge", type=Path, default=DEFAULT_KNOWLEDGE, help="knowledge JSON (passages)")
+    parser.add_argument("--rounds", type=int, default=20, help="passes over the corpus per measurement")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads (0 = default)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--out", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    queries, passages = load_corpus(args.trace, args.knowledge)
+    print(f"🔮 Sentence encoder: {len(queries)} queries x {args.rounds}, {len(passages)} passages per batch pass")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp)
+        for backend in backends:
+            subprocess.run(
+                [sys.executable, __file__, "--worker", backend, "--out", str(out),
+                 "--model", args.model, "--onnx-path", args.onnx_path, "--trace", str(args.trace), "--knowledge", str(args.knowledge),
+                 "--rounds", str(args.rounds), "--batch-size", str(args.batch_size), "--threads", str(args.threads)],
+                check=True
+            )
+            results[backend] = json.loads((out / f"{backend}.json").read_text())
+            results[backend]["embeddings"] = np.load(out / f"{backend}.npy")
+
+    print(f"\n{'backend':<8}{'load s':>8}{'rss MB':>9}{'peak MB':>9}{'p50 ms':>9}{'p95 ms':>9}{'passages/s':>12}"
+          f"{'min cos':>9}{'mean cos':>10}")
+    reference = results.get("torch", {}).get("embeddings")
+    for backend, r in results.items():
+        if reference is not None:
+            a = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+            b = r["embeddings"] / np.linalg.norm(r["embeddings"], axis=1, keepdims=True)
+            cosines = (a * b).sum(axis=1)
+            parity = f"{cosines.min():>9.4f}{cosines.mean():>10.4f}"
+        else:
+            parity = f"{'-':>9}{'-':>10}"
+        print(f"{r['encoder']['backend']:<8}{r['load_seconds']:>8.2f}{r['rss_mb']:>9.0f}{r['peak_rss_mb']:>9.0f}"
+              f"{r['query_p50_ms']:>9.2f}{r['query_p95_ms']:>9.2f}{r['passages_per_second']:>12.1f}{parity}")
+
+
+if __name__ == "__main__":
+    main()
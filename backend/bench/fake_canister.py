@@ -0,0 +1,94 @@
+"""
+Local stand-in for the ai_api_backend ICP canister
+
+Implements the subset of ic.agent.Agent used by agent.py (query_raw and
+update_raw, and their async variants used by the canister client) and answers the canister methods the agent calls with data
+from data/laincorp_knowledge.json, after a configurable simulated network
+latency. Results use the same already-decoded shape ic-py returns:
+[{'type': ..., 'value': ...}].
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from pathlib import Path
+
+KNOWLEDGE_FILE = Path(__file__).resolve().parent.parent / "data" / "laincorp_knowledge.json"
+
+
+class FakeCanisterAgent:
+    """Drop-in replacement for ic.agent.Agent with a local in-memory canister"""
+
+    def __init__(self, latency_ms=80.0, jitter_ms=20.0, results_per_query=5, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.results_per_query = results_per_query
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        with open(KNOWLEDGE_FILE, 'r') as f:
+            entries = json.load(f).get('company_info', [])
+        self.passages = [f"{e['topic']}: {e['content']}" for e in entries]
+
+        # user_id -> list of stored conversation texts
+        self.conversations = {}
+        self.calls = {}
+
+    def _latency(self):
+        with self.lock:
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms))
+        return delay / 1000.0
+
+    def _count(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def _search(self, key):
+        """Deterministic pseudo-search: rotate through the corpus by key"""
+        start = sum(key) % max(1, len(self.passages)) if isinstance(key, bytes) else 0
+        picked = [self.passages[(start + i) % len(self.passages)] for i in range(self.results_per_query)]
+        return picked
+
+    def query_raw(self, canister_id, method, arg, *args, **kwargs):
+        self._count(method)
+        time.sleep(self._latency())
+        return self._query(method, arg)
+
+    async def query_raw_async(self, canister_id, method, arg, *args, **kwargs):
+        self._count(method)
+        await asyncio.sleep(self._latency())
+        return self._query(method, arg)
+
+    def update_raw(self, canister_id, method, arg, *args, **kwargs):
+        self._count(method)
+        time.sleep(self._latency())
+        return self._update(method)
+
+    async def update_raw_async(self, canister_id, method, arg, *args, **kwargs):
+        self._count(method)
+        await asyncio.sleep(self._latency())
+        return self._update(method)
+
+    def _query(self, method, arg):
+        if method == "search_personality":
+            return [{'type': 'vec', 'value': self._search(arg)}]
+        if method == "search_user_conversation_history":
+            with self.lock:
+                history = [text for texts in self.conversations.values() for text in texts]
+            return [{'type': 'vec', 'value': history[-self.results_per_query:]}]
+        if method == "get_next_conversation_chunk_index":
+            with self.lock:
+                count = sum(len(texts) for texts in self.conversations.values())
+            return [{'type': 'nat32', 'value': count}]
+        if method == "get_personality_embeddings":
+            return [{'type': 'vec', 'value': [{} for _ in self.passages]}]
+        raise ValueError(f"FakeCanisterAgent: unsupported query method {method}")
+
+    def _update(self, method):
+        if method == "store_conversation_chunk":
+            with self.lock:
+                self.conversations.setdefault("bench", []).append(f"stored chunk {len(self.conversations['bench'])}")
+            return [{'type': 'text', 'value': "ok"}]
+        raise ValueError(f"FakeCanisterAgent: unsupported update method {method}")
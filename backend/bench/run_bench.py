@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark for the Lain.TV backend
+
+Replays a recorded chat trace against agent.py at a fixed concurrency and
+reports p50/p95/p99 latency per pipeline stage:
+
+    embed      sentence encoder calls
+    retrieve   canister/Qdrant knowledge and history lookups (excluding embed)
+    prefill    prompt processing up to the first generated token
+    decode     remaining token generation
+    parse      JSON extraction from the model output
+    persist    storing the interaction in the canister (excluding embed)
+    synthesize POST /synthesize on tts_server.py (with --tts-url)
+    animate    POST /get_animation on animation_server.py (with --animation-url)
+    total      end-to-end, agent + tts + animation
+
+The agent runs in-process with the ICP canister replaced by
+fake_canister.FakeCanisterAgent, so no request ever reaches mainnet. Agent
+stages come from the timing breakdown /generate returns with
+include_timings. Point --model at a tiny GGUF (any llama.cpp-compatible
+model, e.g. a 15M-260M parameter test model) to exercise real
+prefill/decode; without a model the agent runs in mock mode and only the
+non-LLM stages are measured.
+
+Usage:
+    python bench/run_bench.py --model /models/tiny.gguf --concurrency 4 --requests 60
+    python bench/run_bench.py --tts-url http://localhost:8002 --animation-url http://localhost:8003
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from itertools import cycle, islice
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+AGENT_DIR = BENCH_DIR.parent / "ai-agent"
+DEFAULT_TRACE = BENCH_DIR / "traces" / "chat.jsonl"
+STAGES = ["embed", "retrieve", "prefill", "decode", "parse", "persist", "synthesize", "animate", "total"]
+
+# Benchmark stage -> agent timing keys (see metrics.py) summed into it
+AGENT_STAGES = {
+    "embed": ["embed"],
+    "retrieve": ["retrieve"],
+    "prefill": ["prefill"],
+    "decode": ["decode"],
+    "parse": ["json_parse"],
+    "persist": ["memory_write"],
+}
+
+
+async def start_agent(args, fake_agent):
+    """Import agent.py and start it with the fake canister"""
+    os.environ["MODEL_PATH"] = args.model or "/nonexistent/bench-model.gguf"
+    os.environ.setdefault("N_THREADS", str(args.threads))
+    os.environ.setdefault("REDIS_HOST", args.redis_host)
+    sys.path.insert(0, str(AGENT_DIR))
+    import agent
+
+    # Swap the IC agent for the local canister before startup connects
+    agent.Agent = lambda identity, client: fake_agent
+
+    await agent.startup_event()
+    await agent.components_loaded.wait()
+    return agent
+
+
+def load_trace(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def run_request(item, agent_client, tts_client, animation_client, args):
+    start = time.perf_counter()
+
+    response = await agent_client.post("/generate", json=dict(item, include_timings=True))
+    response.raise_for_status()
+    reply = response.json()
+    agent_timings = reply.get("timings") or {}
+    timings = {}
+    for stage, keys in AGENT_STAGES.items():
+        if any(key in agent_timings for key in keys):
+            timings[stage] = sum(agent_timings.get(key, 0.0) for key in keys)
+
+    if tts_client is not None and reply.get("response"):
+        t0 = time.perf_counter()
+        tts_response = await tts_client.post("/synthesize", json={"text": reply["response"]})
+        tts_response.raise_for_status()
+        timings["synthesize"] = time.perf_counter() - t0
+
+    if animation_client is not None:
+        t0 = time.perf_counter()
+        anim_response = await animation_client.post(
+            "/get_animation", json={"mood": reply.get("mood", "neutral"), "state": "speaking"}
+        )
+        anim_response.raise_for_status()
+        timings["animate"] = time.perf_counter() - t0
+
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+async def run_benchmark(args):
+    import httpx
+    from fake_canister import FakeCanisterAgent
+
+    fake_agent = FakeCanisterAgent(
+        latency_ms=args.canister_latency_ms,
+        jitter_ms=args.canister_jitter_ms,
+        seed=args.seed
+    )
+    agent = await start_agent(args, fake_agent)
+
+    trace = load_trace(args.trace)
+    items = list(islice(cycle(trace), args.warmup + args.requests))
+
+    agent_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=agent.app), base_url="http://agent", timeout=None)
+    tts_client = httpx.AsyncClient(base_url=args.tts_url, timeout=None) if args.tts_url else None
+    animation_client = httpx.AsyncClient(base_url=args.animation_url, timeout=None) if args.animation_url else None
+
+    queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        queue.put_nowait((index, item))
+    results = []
+    errors = []
+
+    async def worker():
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                timings = await run_request(item, agent_client, tts_client, animation_client, args)
+                if index >= args.warmup:
+                    results.append(timings)
+            except Exception as e:
+                errors.append(f"{item.get('message', '')[:40]}: {e}")
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        elapsed = time.perf_counter() - started
+        await agent_client.aclose()
+        for client in (tts_client, animation_client):
+            if client is not None:
+                await client.aclose()
+        await agent.shutdown_event()
+
+    return {
+        "config": {
+            "model": args.model,
+            "trace": str(args.trace),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "canister_latency_ms": args.canister_latency_ms,
+            "tts_url": args.tts_url,
+            "animation_url": args.animation_url,
+        },
+        "wall_time": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "errors": errors,
+        "canister_calls": dict(fake_agent.calls),
+        "stages": summarize(results),
+    }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(results):
+    summary = {}
+    for stage in STAGES:
+        values = sorted(r[stage] for r in results if stage in r)
+        if not values:
+            continue
+        summary[stage] = {
+            "count": len(values),
+            "mean_ms": 1000 * sum(values) / len(values),
+            "p50_ms": 1000 * percentile(values, 50),
+            "p95_ms": 1000 * percentile(values, 95),
+            "p99_ms": 1000 * percentile(values, 99),
+        }
+    return summary
+
+
+def print_report(report):
+    config = report["config"]
+    print("🔮 Lain.TV Pipeline Benchmark")
+    print("=" * 64)
+    print(f"Model: {config['model'] or 'mock mode'}  Concurrency: {config['concurrency']}  "
+          f"Requests: {config['requests']} (+{config['warmup']} warmup)")
+    print(f"Wall time: {report['wall_time']:.2f}s  Throughput: {report['throughput_rps']:.2f} req/s")
+    print()
+    print(f"{'stage':<12}{'n':>6}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}   (ms)")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<12}{stats['count']:>6}{stats['mean_ms']:>10.1f}{stats['p50_ms']:>10.1f}"
+              f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print()
+    print(f"Canister calls: {report['canister_calls']}")
+    if report["errors"]:
+        print(f"❌ {len(report['errors'])} errors, first: {report['errors'][0]}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the /generate pipeline end to end")
+    parser.add_argument("--model", help="GGUF model for the agent (omit for mock mode)")
+    parser.add_argument("--trace", type=Path, default=DEFAULT_TRACE, help="JSONL chat trace to replay")
+    parser.add_argument("--requests", type=int, default=60, help="measured requests (trace is cycled)")
+    parser.add_argument("--warmup", type=int, default=3, help="requests to run before measuring")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight")
+    parser.add_argument("--threads", type=int, default=4, help="llama.cpp threads for the agent")
+    parser.add_argument("--canister-latency-ms", type=float, default=80.0, help="simulated canister call latency")
+    parser.add_argument("--canister-jitter-ms", type=float, default=20.0, help="uniform jitter on canister latency")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the fake canister's latency jitter")
+    parser.add_argument("--redis-host", default="localhost", help="Redis host for the agent")
+    parser.add_argument("--tts-url", help="tts_server.py base URL, e.g. http://localhost:8002")
+    parser.add_argument("--animation-url", help="animation_server.py base URL, e.g. http://localhost:8003")
+    parser.add_argument("--output", type=Path, help="write the full report as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, str(BENCH_DIR))
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
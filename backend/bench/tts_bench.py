@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+TTS real-time-factor benchmark
+
+Synthesizes a fixed corpus of Lain replies (traces/tts_corpus.jsonl) and
+reports how fast the voice runs relative to the audio it produces:
+
+    rtf        model seconds per second of audio (below 1 is faster than real time)
+    capacity   seconds of audio one worker produces per second (1 / rtf),
+               i.e. how many concurrently speaking streams a replica can keep up with
+    chars/s    input characters synthesized per model second
+
+Two modes:
+
+    model   (default) each backend is loaded in its own subprocess and the
+            corpus is rendered serially, model only (no fragment cache), so
+            runs are comparable across machines and backends
+    server  --url replays the corpus against a running tts_server.py at a
+            fixed concurrency and reports client latency plus the server's
+            own per-request metrics (/stats "synthesis", before and after)
+
+Usage:
+    python bench/tts_bench.py --backends torch,onnx --onnx-path /models/tts-onnx
+    python bench/tts_bench.py --url http://localhost:8002 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+TTS_DIR = BENCH_DIR.parent / "tts"
+DEFAULT_CORPUS = BENCH_DIR / "traces" / "tts_corpus.jsonl"
+SAMPLE_RATE = 22050
+
+
+def load_corpus(path: Path):
+    return [json.loads(line)["text"] for line in path.read_text().splitlines() if line.strip()]
+
+
+def rss_mb():
+    """(current, peak) resident set size of this process in MB"""
+    status = dict(line.split(":", 1) for line in Path("/proc/self/status").read_text().splitlines() if ":" in line)
+    return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+
+
+def pcts(values):
+    p50, p95 = np.percentile(values, [50, 95])
+    return float(p50), float(p95)
+
+
+def run_worker(args):
+    """Measure one backend in this process and write its results"""
+    sys.path.insert(0, str(TTS_DIR))
+    corpus = load_corpus(args.corpus)
+
+    start = time.perf_counter()
+    from vits_onnx import describe, load_backend
+    tts = load_backend(args.worker, args.model, args.onnx_path, args.threads)
+    load_seconds = time.perf_counter() - start
+
+    tts.tts(text=corpus[0], speaker=args.speaker)
+    rows = []
+    for _ in range(args.rounds):
+        for text in corpus:
+            t = time.perf_counter()
+            wav = tts.tts(text=text, speaker=args.speaker)
+            rows.append((len(text), time.perf_counter() - t, len(wav) / SAMPLE_RATE))
+
+    rss, peak = rss_mb()
+    (args.out / f"{args.worker}.json").write_text(json.dumps({
+        "backend": describe(tts),
+        "load_seconds": load_seconds,
+        "rss_mb": rss,
+        "peak_rss_mb": peak,
+        "rows": rows,
+    }))
+
+
+def report_model(args):
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    corpus = load_corpus(args.corpus)
+    print(f"🔊 TTS model benchmark: {len(corpus)} texts x {args.rounds} rounds, speaker {args.speaker}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp)
+        for backend in backends:
+            subprocess.run(
+                [sys.executable, __file__, "--worker", backend, "--out", str(out), "--corpus", str(args.corpus),
+                 "--model", args.model, "--onnx-path", args.onnx_path, "--speaker", args.speaker,
+                 "--rounds", str(args.rounds), "--threads", str(args.threads)],
+                check=True, stdout=subprocess.DEVNULL
+            )
+            results[backend] = json.loads((out / f"{backend}.json").read_text())
+
+    print(f"\n{'backend':<8}{'load s':>8}{'rss MB':>9}{'rtf':>8}{'p50':>8}{'p95':>8}{'capacity':>10}{'chars/s':>9}")
+    for r in results.values():
+        chars, seconds, audio = (np.array(column) for column in zip(*r["rows"]))
+        p50, p95 = pcts(seconds / audio)
+        r["summary"] = {
+            "rtf": seconds.sum() / audio.sum(),
+            "rtf_p50": p50,
+            "rtf_p95": p95,
+            "realtime_capacity": audio.sum() / seconds.sum(),
+            "chars_per_second": chars.sum() / seconds.sum(),
+        }
+        s = r["summary"]
+        print(f"{r['backend']['backend']:<8}{r['load_seconds']:>8.2f}{r['rss_mb']:>9.0f}{s['rtf']:>8.3f}{p50:>8.3f}"
+              f"{p95:>8.3f}{s['realtime_capacity']:>10.2f}{s['chars_per_second']:>9.0f}")
+    return results
+
+
+async def report_server(args):
+    import httpx
+
+    corpus = load_corpus(args.corpus)
+    items = corpus * args.rounds
+    print(f"🔊 TTS server benchmark: {args.url}, {len(items)} requests, concurrency {args.concurrency}")
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        before = (await client.get("/stats")).json().get("synthesis", {})
+        queue = asyncio.Queue()
+        for text in items:
+            queue.put_nowait(text)
+        latencies, errors = [], []
+
+        async def worker():
+            while not queue.empty():
+                text = queue.get_nowait()
+                t = time.perf_counter()
+                try:
+                    response = await client.post("/synthesize", json={"text": text, "speaker": args.speaker})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - t)
+                except Exception as e:
+                    errors.append(f"{text[:40]}: {e}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        after = (await client.get("/stats")).json().get("synthesis", {})
+
+    audio = after.get("audio_seconds", 0.0) - before.get("audio_seconds", 0.0)
+    model = after.get("synthesis_seconds", 0.0) - before.get("synthesis_seconds", 0.0)
+    fragments = after.get("fragments", 0) - before.get("fragments", 0)
+    hits = after.get("fragment_hits", 0) - before.get("fragment_hits", 0)
+    p50, p95 = pcts(latencies) if latencies else (0.0, 0.0)
+    report = {
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_seconds": elapsed,
+        "latency_p50_ms": p50 * 1000,
+        "latency_p95_ms": p95 * 1000,
+        "audio_seconds": audio,
+        "synthesis_seconds": model,
+        # Audio delivered per wall second across all requests: the stream load this replica sustained
+        "served_realtime": audio / elapsed if elapsed else 0.0,
+        "rtf": model / audio if audio else None,
+        "fragment_hit_ratio": hits / fragments if fragments else 0.0,
+        "server": after,
+    }
+    print(f"Wall time: {elapsed:.2f}s  Latency p50 {report['latency_p50_ms']:.0f} ms, p95 {report['latency_p95_ms']:.0f} ms")
+    print(f"Audio: {audio:.1f}s in {model:.1f}s of model time (rtf {report['rtf'] or 0:.3f}), "
+          f"served {report['served_realtime']:.2f}x real time")
+    print(f"Fragment cache hit ratio: {report['fragment_hit_ratio']:.1%}  "
+          f"Queue wait p95 (recent): {(after.get('recent_queue_ms') or {}).get('p95', 0):.0f} ms")
+    if errors:
+        print(f"❌ {len(errors)} errors, first: {errors[0]}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark TTS real-time factor")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS, help="JSONL of {\"text\": ...} lines")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the corpus")
+    parser.add_argument("--speaker", default="p225")
+    parser.add_argument("--backends", default="torch,onnx", help="model mode: comma separated backends")
+    parser.add_argument("--model", default="tts_models/en/vctk/vits")
+    parser.add_argument("--onnx-path", default="/models/tts-onnx", help="directory from vits_onnx.py export")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = runtime default)")
+    parser.add_argument("--url", help="server mode: tts_server.py base URL, e.g. http://localhost:8002")
+    parser.add_argument("--concurrency", type=int, default=4, help="server mode: requests in flight")
+    parser.add_argument("--output", type=Path, help="write the full report as JSON")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--out", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    report = asyncio.run(report_server(args)) if args.url else report_model(args)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"✓ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
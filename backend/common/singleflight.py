@@ -0,0 +1,68 @@
+"""
+Single-flight request coalescing
+
+Concurrent calls with the same key share one in-flight computation and all
+callers receive its result (or its exception), so a burst of identical
+requests costs one computation per distinct input. The computation runs as
+its own task: a caller going away does not cancel it while others still
+wait, and it is cancelled once the last waiter is gone.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self.inflight: Dict[Hashable, _Flight] = {}
+        self.computed = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        result, _ = await self.join(key, fn)
+        return result
+
+    async def join(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Like do(), also returning whether the caller joined a computation another caller started
+
+        The computation runs in the context of the caller that started it, so
+        only that caller's context variables (e.g. its timing breakdown) see it.
+        """
+        flight = self.inflight.get(key)
+        joined = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.create_task(fn()))
+            self.inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.computed += 1
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), joined
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        if self.inflight.get(key) is flight:
+            del self.inflight[key]
+
+    def stats(self) -> Dict:
+        total = self.computed + self.shared
+        return {
+            "inflight": len(self.inflight),
+            "computed": self.computed,
+            "shared": self.shared,
+            "shared_ratio": self.shared / total if total else 0.0,
+        }
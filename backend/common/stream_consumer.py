@@ -0,0 +1,143 @@
+"""
+Redis Streams consumer shared by the TTS and animation services
+
+Both services read their input stream (lain:text, lain:audio) as members of
+a consumer group in a background thread. Each service image copies this
+file next to its server (see the Dockerfiles); a checkout finds it through
+sys.path.
+"""
+
+import logging
+import time
+from collections import deque
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+RETRY_MIN_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30.0
+
+
+class StreamConsumer:
+    """Reads one Redis Stream as a member of a consumer group
+
+    Entries are acknowledged only after the handler has published its
+    output, so a crash leaves them pending: on start the consumer first
+    replays its own pending entries, and entries idle for claim_idle_ms
+    under another (dead) consumer are claimed and replayed. Entries whose
+    handler raises are moved to <stream>:dead and acknowledged.
+
+    Any Redis error (unreachable at startup, the group gone after the
+    stream was deleted, a failed xadd or xack) restarts the consumer with
+    exponential backoff: the group is re-created and pending entries are
+    replayed again, so nothing read but unacknowledged is lost.
+    """
+
+    def __init__(self, client, stream, group, consumer, handle, claim_idle_ms=30000, dead_maxlen=10000):
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.handle = handle
+        self.claim_idle_ms = claim_idle_ms
+        self.dead_maxlen = dead_maxlen
+        self.processed = 0
+        self.failed = 0
+        self.replayed = 0
+        self.restarts = 0
+        self.retry_seconds = RETRY_MIN_SECONDS
+        self.lag_ms = deque(maxlen=512)  # agent publish -> handled (end to end)
+        self.wait_ms = deque(maxlen=512)  # time queued in this stream
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def process(self, entries, replay=False):
+        for entry_id, fields in entries:
+            if fields:
+                try:
+                    self.handle(fields)
+                    self.processed += 1
+                    self.replayed += replay
+                except redis.ConnectionError:
+                    raise  # Redis is down, not the entry: leave it pending for the restart
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"{self.group}: entry {entry_id} failed: {e}")
+                    self.client.xadd(f"{self.stream}:dead", dict(fields, error=str(e)),
+                                     maxlen=self.dead_maxlen, approximate=True)
+                now = time.time() * 1000
+                self.wait_ms.append(now - int(entry_id.split(b"-")[0]))
+                if b"ts" in fields:
+                    self.lag_ms.append(now - int(fields[b"ts"]))
+            self.client.xack(self.stream, self.group, entry_id)
+
+    def replay_pending(self, stop):
+        """Entries this consumer read but never acknowledged before it went down"""
+        while not stop.is_set():
+            pending = self.client.xreadgroup(self.group, self.consumer, {self.stream: "0"}, count=32)
+            if not pending or not pending[0][1]:
+                break
+            self.process(pending[0][1], replay=True)
+
+    def consume(self, stop):
+        last_claim = 0.0
+        while not stop.is_set():
+            if time.monotonic() - last_claim > self.claim_idle_ms / 2000:
+                last_claim = time.monotonic()
+                claimed = self.client.xautoclaim(self.stream, self.group, self.consumer,
+                                                 self.claim_idle_ms, start_id="0-0", count=32)
+                self.process(claimed[1], replay=True)
+            for _, entries in self.client.xreadgroup(self.group, self.consumer, {self.stream: ">"},
+                                                     count=8, block=1000) or []:
+                self.process(entries)
+            self.retry_seconds = RETRY_MIN_SECONDS
+
+    def run(self, stop):
+        while not stop.is_set():
+            try:
+                self.ensure_group()
+                self.replay_pending(stop)
+                logger.info(f"Pipeline consumer {self.consumer} reading {self.stream} as group {self.group}")
+                self.consume(stop)
+            except redis.RedisError as e:
+                self.restarts += 1
+                logger.warning(f"Pipeline consumer {self.consumer} on {self.stream}: {e} "
+                               f"(retrying in {self.retry_seconds:.1f}s)")
+                stop.wait(self.retry_seconds)
+                self.retry_seconds = min(self.retry_seconds * 2, RETRY_MAX_SECONDS)
+
+    def stats(self):
+        def percentiles(values):
+            ordered = sorted(values)
+            if not ordered:
+                return None
+            return {q: round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 1)
+                    for q, p in (("p50", 0.5), ("p95", 0.95))}
+
+        backlog = None
+        try:
+            pending = self.client.xpending(self.stream, self.group)["pending"]
+            for group in self.client.xinfo_groups(self.stream):
+                if group["name"].decode() == self.group:
+                    backlog = group.get("lag")  # entries not yet delivered to the group (Redis 7)
+        except redis.RedisError:
+            pending = None
+        return {
+            "stream": self.stream,
+            "group": self.group,
+            "consumer": self.consumer,
+            "processed": self.processed,
+            "failed": self.failed,
+            "replayed": self.replayed,
+            "restarts": self.restarts,
+            "pending": pending,
+            "backlog": backlog,
+            "lag_ms": percentiles(self.lag_ms),
+            "queue_wait_ms": percentiles(self.wait_ms),
+        }
@@ -1,119 +1,542 @@
 #!/usr/bin/env python3
 """
 Populate Qdrant vector database with LainCorp knowledge
+
+Ingestion is incremental: every point id is derived from a hash of the
+embedded text, and a local manifest records which hashes are already in the
+collection. Only new or changed entries are encoded and upserted, and
+entries removed from the knowledge file are deleted from Qdrant.
+
+Sources are streamed (bundled JSON, JSONL, or a directory of markdown such
+as a memex.wiki dump), encoded in batches and upserted in bounded chunks
+with a few requests in flight, so memory stays flat for large corpora.
+
+Long entries are split into overlapping, sentence-aligned chunks that fit
+the encoder's word-piece limit, so no part of a document is silently
+truncated away; each chunk carries its parent topic in the payload.
+
+With --index the same chunks are also written to a self-contained,
+memory-mapped index file (float32 or int8 vectors plus payloads) that the
+agent's "index" retrieval backend searches in-process; --no-qdrant builds
+only that file. Rebuilding an index reuses the vectors of unchanged chunks.
 """
 
+import argparse
+import hashlib
 import json
 import os
+import re
 import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 from pathlib import Path
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from sentence_transformers import SentenceTransformer
+
+# Encoder backends (torch or int8 ONNX) and the index format are shared with the agent
+sys.path.insert(0, str(Path(__file__).parent / "ai-agent"))
+from knowledge_index import DTYPES, IndexWriter, KnowledgeIndex
+from sentence_encoder import describe, load_encoder
 
 # Configuration
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
 COLLECTION_NAME = "lain_memory"
+MODEL_NAME = os.getenv("ENCODER_MODEL", "all-MiniLM-L6-v2")
+ENCODER_ONNX_PATH = os.getenv("ENCODER_ONNX_PATH", "")
 DATA_FILE = Path(__file__).parent / "data" / "laincorp_knowledge.json"
+MANIFEST_FILE = Path(os.getenv("INGEST_MANIFEST", Path(__file__).parent / "data" / ".ingest_manifest.json"))
+MANIFEST_VERSION = 2
+CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "40"))
+INDEX_FILE = os.getenv("KNOWLEDGE_INDEX_PATH", "")
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n{2,}')
+SPLIT_SLACK = 2  # tokens a join between words may add over their separate counts
 
-def main():
-    print("🔮 LainCorp Knowledge Ingestion")
-    print("=" * 50)
-    
-    # Initialize encoder
-    print("Loading sentence encoder...")
-    encoder = SentenceTransformer('all-MiniLM-L6-v2')
-    print("✓ Encoder loaded")
-    
-    # Connect to Qdrant
-    print(f"Connecting to Qdrant at {QDRANT_HOST}:{QDRANT_PORT}...")
-    client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-    print("✓ Connected to Qdrant")
-    
-    # Check/create collection
-    collections = client.get_collections().collections
-    if not any(c.name == COLLECTION_NAME for c in collections):
-        print(f"Creating collection: {COLLECTION_NAME}")
-        client.create_collection(
+def content_hash(text):
+    """Stable hash of the text that gets embedded"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def point_id(digest):
+    """Qdrant point id for a content hash (Qdrant ids must be uint or UUID)"""
+    return str(uuid.UUID(digest[:32]))
+
+def index_id(digest):
+    """Knowledge index row id for a content hash (the same 16 bytes as the point id)"""
+    return bytes.fromhex(digest[:32])
+
+def load_manifest(path):
+    """Load the manifest of already-embedded entries, or None if missing/corrupt"""
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠ Ignoring unreadable manifest {path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(path, entries, chunking):
+    """Atomically write the manifest (hash -> point id)"""
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "model": MODEL_NAME,
+        "collection": COLLECTION_NAME,
+        "chunking": chunking,
+        "entries": entries
+    }
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def list_point_ids(client):
+    """Every point id currently stored in the collection"""
+    ids = []
+    offset = None
+    while True:
+        records, offset = client.scroll(
             collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+            limit=1000,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False
         )
-        print(f"✓ Collection created")
+        ids.extend(str(record.id) for record in records)
+        if offset is None:
+            return ids
+
+def read_markdown(path, root):
+    """Turn a markdown file into a knowledge entry (first heading is the topic)"""
+    text = path.read_text(encoding="utf-8", errors="replace").strip()
+    topic = path.stem.replace("-", " ").replace("_", " ")
+    lines = text.splitlines()
+    if lines and lines[0].startswith("#"):
+        topic = lines[0].lstrip("#").strip() or topic
+        text = "\n".join(lines[1:]).strip()
+    return {
+        "topic": topic,
+        "content": text,
+        "source": str(path.relative_to(root)),
+        "type": "wiki"
+    }
+
+def iter_raw_entries(source):
+    """Yield raw {topic, content, source, type} dicts from a file or directory
+
+    Supports the bundled knowledge JSON ({"company_info": [...]}), JSONL with
+    one entry per line, and directories of markdown files. JSONL and markdown
+    are read lazily so large corpora are never held in memory.
+    """
+    if source.is_dir():
+        for path in sorted(source.rglob("*.md")):
+            yield read_markdown(path, source)
+    elif source.suffix == ".jsonl":
+        with open(source, 'r') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"  ⚠ {source}:{line_no}: skipping invalid JSON ({e})")
+                    continue
+                yield {
+                    "topic": entry.get("topic") or entry.get("title", ""),
+                    "content": entry.get("content") or entry.get("text", ""),
+                    "source": entry.get("source", source.stem),
+                    "type": entry.get("type", "knowledge")
+                }
     else:
-        print(f"✓ Collection exists: {COLLECTION_NAME}")
-    
-    # Load knowledge data
-    print(f"\nLoading knowledge from {DATA_FILE}...")
-    if not DATA_FILE.exists():
-        print(f"❌ Knowledge file not found: {DATA_FILE}")
-        sys.exit(1)
-    
-    with open(DATA_FILE, 'r') as f:
-        data = json.load(f)
-    
-    company_info = data.get('company_info', [])
-    print(f"✓ Loaded {len(company_info)} knowledge entries")
-    
-    # Process and upload
-    print("\nProcessing and uploading to vector database...")
-    points = []
-    
-    for idx, entry in enumerate(company_info):
-        topic = entry['topic']
-        content = entry['content']
-        
-        # Create embedding
-        text = f"{topic}: {content}"
-        embedding = encoder.encode(text).tolist()
-        
-        # Create point
-        point = PointStruct(
-            id=idx,
-            vector=embedding,
-            payload={
-                "topic": topic,
-                "content": content,
-                "text": text,
+        with open(source, 'r') as f:
+            data = json.load(f)
+        for entry in data.get('company_info', []):
+            yield {
+                "topic": entry['topic'],
+                "content": entry['content'],
                 "source": "laincorp_knowledge",
                 "type": "company_info"
             }
-        )
-        points.append(point)
-        print(f"  [{idx+1}/{len(company_info)}] {topic}")
-    
-    # Upload to Qdrant
-    print(f"\nUploading {len(points)} vectors to Qdrant...")
-    client.upsert(
-        collection_name=COLLECTION_NAME,
-        points=points
-    )
-    print("✓ Upload complete")
-    
-    # Verify
-    collection_info = client.get_collection(COLLECTION_NAME)
-    print(f"\n📊 Collection Stats:")
-    print(f"  Total vectors: {collection_info.points_count}")
-    print(f"  Vector size: {collection_info.config.params.vectors.size}")
-    
+
+class Chunker:
+    """Split long text into overlapping, sentence-aligned windows of word pieces
+
+    Window size is measured with the encoder's own tokenizer and capped so
+    that "topic: chunk" fits in the model's max_seq_length.
+    """
+
+    def __init__(self, encoder, max_tokens, overlap):
+        self.tokenizer = encoder.tokenizer
+        self.max_seq_length = encoder.max_seq_length
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+
+    def count(self, text):
+        return len(self.tokenizer.tokenize(text))
+
+    def split_long_sentence(self, sentence, budget):
+        """Hard-split a single sentence that is longer than the window into (piece, tokens)
+
+        Every word is tokenized once and pieces are filled by a running count
+        kept SPLIT_SLACK under the budget; each piece is then counted once
+        as a whole to confirm it fits.
+        """
+        pieces = []
+        words = []
+        words_tokens = 0
+        for word in sentence.split():
+            size = self.count(word)
+            if words and words_tokens + size > budget - SPLIT_SLACK:
+                pieces.extend(self.fit(words, budget))
+                words = []
+                words_tokens = 0
+            words.append(word)
+            words_tokens += size
+        if words:
+            pieces.extend(self.fit(words, budget))
+        return pieces
+
+    def fit(self, words, budget):
+        """words joined as (piece, tokens), halved in the rare case the joined text is over budget"""
+        piece = " ".join(words)
+        size = self.count(piece)
+        if size <= budget or len(words) == 1:
+            return [(piece, size)]
+        half = len(words) // 2
+        return self.fit(words[:half], budget) + self.fit(words[half:], budget)
+
+    def chunk(self, topic, content):
+        # [CLS] + [SEP] + "topic:" prefix all share the model's window
+        budget = min(self.max_tokens, self.max_seq_length - self.count(f"{topic}:") - 2)
+        budget = max(budget, 16)
+        if self.count(content) <= budget:
+            return [content]
+
+        sentences = []
+        for sentence in SENTENCE_BOUNDARY.split(content):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            size = self.count(sentence)
+            if size > budget:
+                sentences.extend(self.split_long_sentence(sentence, budget))
+            else:
+                sentences.append((sentence, size))
+
+        chunks = []
+        window = []
+        window_tokens = 0
+        for sentence, size in sentences:
+            if window and window_tokens + size > budget:
+                chunks.append(" ".join(s for s, _ in window))
+                # Carry trailing sentences into the next window as overlap
+                carried = []
+                carried_tokens = 0
+                for prev, prev_size in reversed(window):
+                    if carried_tokens + prev_size > self.overlap or carried_tokens + prev_size + size > budget:
+                        break
+                    carried.insert(0, (prev, prev_size))
+                    carried_tokens += prev_size
+                window = carried
+                window_tokens = carried_tokens
+            window.append((sentence, size))
+            window_tokens += size
+        if window:
+            chunks.append(" ".join(s for s, _ in window))
+        return chunks
+
+def iter_entries(sources, chunker):
+    """Yield (content hash, payload) for every distinct chunk across sources"""
+    seen = set()
+    for source in sources:
+        for entry in iter_raw_entries(source):
+            if not entry["content"]:
+                continue
+            parent_hash = content_hash(f"{entry['topic']}: {entry['content']}")
+            if parent_hash in seen:
+                continue
+            seen.add(parent_hash)
+            chunks = chunker.chunk(entry["topic"], entry["content"])
+            for chunk_index, chunk in enumerate(chunks):
+                text = f"{entry['topic']}: {chunk}"
+                # Position is part of the id so chunk metadata always matches its parent
+                digest = content_hash(f"{parent_hash}:{chunk_index}:{text}")
+                yield digest, dict(
+                    entry,
+                    content=chunk,
+                    text=text,
+                    content_hash=digest,
+                    parent_topic=entry["topic"],
+                    parent_hash=parent_hash,
+                    chunk_index=chunk_index,
+                    chunk_count=len(chunks)
+                )
+
+def batched(iterable, size):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+class Uploader:
+    """Upsert points to Qdrant in bounded chunks with limited requests in flight"""
+
+    def __init__(self, client, chunk_size, max_in_flight):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.in_flight = set()
+        self.pending = []
+        self.uploaded = 0
+
+    def add(self, points):
+        self.pending.extend(points)
+        while len(self.pending) >= self.chunk_size:
+            self._submit(self.pending[:self.chunk_size])
+            self.pending = self.pending[self.chunk_size:]
+
+    def _submit(self, points):
+        # Back-pressure: never hold more than max_in_flight chunks in memory
+        while len(self.in_flight) >= self.max_in_flight:
+            done, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+            self._collect(done)
+        self.in_flight.add(self.executor.submit(
+            self.client.upsert,
+            collection_name=COLLECTION_NAME,
+            points=points,
+            wait=True
+        ))
+        self.uploaded += len(points)
+
+    def _collect(self, futures):
+        for future in futures:
+            future.result()  # re-raise upload errors
+
+    def close(self):
+        if self.pending:
+            self._submit(self.pending)
+            self.pending = []
+        self._collect(self.in_flight)
+        self.in_flight = set()
+        self.executor.shutdown()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest LainCorp knowledge into Qdrant and/or an index file")
+    parser.add_argument("--data", type=Path, action="append",
+                        help="knowledge JSON, JSONL file or directory of markdown (repeatable, "
+                             f"default: {DATA_FILE})")
+    parser.add_argument("--manifest", type=Path, default=MANIFEST_FILE, help="local manifest of embedded entries")
+    parser.add_argument("--full", action="store_true",
+                        help="re-embed every entry and reconcile the collection instead of diffing against the manifest")
+    parser.add_argument("--dry-run", action="store_true", help="report the diff without encoding or writing")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("INGEST_BATCH_SIZE", "64")),
+                        help="entries encoded per encoder.encode call")
+    parser.add_argument("--upsert-size", type=int, default=int(os.getenv("INGEST_UPSERT_SIZE", "256")),
+                        help="points per Qdrant upsert request")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS,
+                        help="maximum word pieces per chunk (capped by the encoder's max_seq_length)")
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP,
+                        help="word pieces of trailing sentences repeated at the start of the next chunk")
+    parser.add_argument("--encoder-backend", choices=["auto", "onnx", "torch"],
+                        default=os.getenv("ENCODER_BACKEND", "auto"),
+                        help="auto uses the ONNX export in --onnx-path if it passed parity, else torch")
+    parser.add_argument("--onnx-path", default=ENCODER_ONNX_PATH,
+                        help="directory written by ai-agent/sentence_encoder.py export")
+    parser.add_argument("--parallel", type=int, default=int(os.getenv("INGEST_PARALLEL", "4")),
+                        help="concurrent upsert requests in flight")
+    parser.add_argument("--index", type=Path, default=Path(INDEX_FILE) if INDEX_FILE else None,
+                        help="also write a memory-mapped knowledge index file for the agent's index backend")
+    parser.add_argument("--index-dtype", choices=sorted(DTYPES), default=os.getenv("KNOWLEDGE_INDEX_DTYPE", "float32"),
+                        help="vector storage in the index (int8 is a quarter of the size)")
+    parser.add_argument("--no-qdrant", action="store_true", help="skip Qdrant and only write --index")
+    args = parser.parse_args()
+    if args.no_qdrant and not args.index:
+        parser.error("--no-qdrant needs --index")
+    return args
+
+def main():
+    args = parse_args()
+    sources = args.data or [DATA_FILE]
+
+    print("🔮 LainCorp Knowledge Ingestion")
+    print("=" * 50)
+
+    for source in sources:
+        if not source.exists():
+            print(f"❌ Knowledge source not found: {source}")
+            sys.exit(1)
+
+    # The encoder's tokenizer drives chunking, so it is needed even for a dry run
+    print("Loading sentence encoder...")
+    encoder = load_encoder(args.encoder_backend, MODEL_NAME, args.onnx_path or None)
+    chunker = Chunker(encoder, args.chunk_tokens, args.chunk_overlap)
+    dimension = encoder.get_sentence_embedding_dimension()
+    print(f"✓ Encoder loaded ({describe(encoder)['backend']}, {dimension} dimensions)")
+
+    chunking = {"max_tokens": args.chunk_tokens, "overlap": args.chunk_overlap}
+    client = None
+    full = args.full
+    embedded = {}
+    if not args.no_qdrant:
+        # Optional dependency: not needed when only the index file is built
+        from qdrant_client import QdrantClient
+        from qdrant_client.models import Distance, VectorParams, PointStruct, PointIdsList
+
+        print(f"Connecting to Qdrant at {QDRANT_HOST}:{QDRANT_PORT}...")
+        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+        print("✓ Connected to Qdrant")
+
+        # Check/create collection
+        collections = client.get_collections().collections
+        if not any(c.name == COLLECTION_NAME for c in collections):
+            print(f"Creating collection: {COLLECTION_NAME}")
+            client.create_collection(
+                collection_name=COLLECTION_NAME,
+                vectors_config=VectorParams(size=dimension, distance=Distance.COSINE)
+            )
+            print(f"✓ Collection created")
+        else:
+            print(f"✓ Collection exists: {COLLECTION_NAME}")
+
+        # Decide between a diff against the manifest and a full reconcile
+        manifest = load_manifest(args.manifest)
+        if manifest is None:
+            print("No manifest found, reconciling the whole collection")
+            full = True
+        elif manifest.get("model") != MODEL_NAME or manifest.get("collection") != COLLECTION_NAME:
+            print(f"Manifest was built with {manifest.get('model')} -> {manifest.get('collection')}, re-embedding everything")
+            full = True
+        elif manifest.get("chunking") != chunking:
+            print(f"Chunking changed from {manifest.get('chunking')} to {chunking}, re-embedding everything")
+            full = True
+        elif client.get_collection(COLLECTION_NAME).points_count < len(manifest["entries"]):
+            print("Collection has fewer points than the manifest, reconciling the whole collection")
+            full = True
+        embedded = {} if full else manifest["entries"]
+
+    # The index is rewritten in full every run; unchanged chunks reuse its previous vectors
+    index = None
+    if args.index:
+        index = IndexWriter(args.index, MODEL_NAME, dimension, args.index_dtype, metadata={"chunking": chunking})
+        if index.previous is not None:
+            print(f"✓ Reusing vectors from {args.index} ({len(index.previous)} rows)")
+
+    # Stream entries: hash, skip unchanged, encode in batches, upsert in chunks
+    print(f"\nStreaming knowledge from {', '.join(str(s) for s in sources)}...")
+    current = {}
+    to_embed = 0
+    to_upload = 0
+    index_new = 0
+    uploader = Uploader(client, args.upsert_size, args.parallel) if client and not args.dry_run else None
+    try:
+        for batch in batched(iter_entries(sources, chunker), args.batch_size):
+            needed = []
+            for digest, payload in batch:
+                current[digest] = point_id(digest)
+                upload = client is not None and digest not in embedded
+                reindex = index is not None and not index.has_vector(index_id(digest))
+                to_upload += upload
+                index_new += reindex
+                if upload or reindex:
+                    needed.append(digest)
+            to_embed += len(needed)
+            if args.dry_run:
+                continue
+
+            vectors = {}
+            if needed:
+                texts = {digest: payload["text"] for digest, payload in batch}
+                encoded = encoder.encode([texts[d] for d in needed], batch_size=args.batch_size, convert_to_numpy=True)
+                vectors = dict(zip(needed, encoded))
+            if uploader:
+                uploader.add([
+                    PointStruct(id=point_id(digest), vector=vectors[digest].tolist(), payload=payload)
+                    for digest, payload in batch if digest not in embedded
+                ])
+            if index:
+                for digest, payload in batch:
+                    index.add(index_id(digest), payload, vectors.get(digest))
+            if needed:
+                print(f"  encoded {to_embed} chunks" + (f" ({uploader.uploaded} uploaded)" if uploader else ""))
+    except BaseException:
+        if index:
+            index.discard()
+        raise
+    finally:
+        if uploader:
+            uploader.close()
+
+    if client:
+        # Points that are no longer backed by an entry
+        if full:
+            wanted_ids = set(current.values())
+            to_delete = [pid for pid in list_point_ids(client) if pid not in wanted_ids]
+        else:
+            to_delete = [pid for digest, pid in embedded.items() if digest not in current]
+        print(f"\nDiff: {to_upload} chunks embedded, {len(to_delete)} to delete, "
+              f"{len(current) - to_upload} unchanged")
+    if index:
+        print(f"Index: {index_new} chunks embedded, {len(current) - index_new} reused")
+    if args.dry_run:
+        if index:
+            index.discard()
+        return
+
+    if index:
+        header = index.close()
+        print(f"✓ Index written to {args.index}: {header['count']} rows, {args.index_dtype}, "
+              f"{index.reused} vectors reused, {args.index.stat().st_size / 1e6:.1f} MB")
+
+    if client:
+        for chunk in batched(to_delete, args.upsert_size):
+            client.delete(
+                collection_name=COLLECTION_NAME,
+                points_selector=PointIdsList(points=chunk)
+            )
+        if to_delete:
+            print(f"✓ Deleted {len(to_delete)} stale vectors")
+
+        save_manifest(args.manifest, current, chunking)
+        print(f"✓ Manifest written to {args.manifest}")
+
+        # Verify
+        collection_info = client.get_collection(COLLECTION_NAME)
+        print(f"\n📊 Collection Stats:")
+        print(f"  Total vectors: {collection_info.points_count}")
+        print(f"  Vector size: {collection_info.config.params.vectors.size}")
+
+    if not to_embed:
+        print("\n✨ Knowledge base already up to date!")
+        return
+
     # Test search
     print(f"\n🔍 Testing search...")
     test_query = "Who is the CEO of LainCorp?"
-    query_vector = encoder.encode(test_query).tolist()
-    
-    from qdrant_client.models import SearchRequest
-    results = client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=query_vector,
-        limit=3
-    ).points
-    
+    query_vector = encoder.encode(test_query)
     print(f"Query: '{test_query}'")
     print(f"Top results:")
-    for i, result in enumerate(results, 1):
-        print(f"  {i}. [{result.score:.3f}] {result.payload['topic']}")
-        print(f"     {result.payload['content'][:100]}...")
-    
+    if client:
+        results = client.query_points(
+            collection_name=COLLECTION_NAME,
+            query=query_vector.tolist(),
+            limit=3
+        ).points
+        for i, result in enumerate(results, 1):
+            print(f"  {i}. [{result.score:.3f}] {result.payload['topic']} "
+                  f"(chunk {result.payload.get('chunk_index', 0) + 1}/{result.payload.get('chunk_count', 1)})")
+            print(f"     {result.payload['content'][:100]}...")
+    else:
+        for i, result in enumerate(KnowledgeIndex(args.index, MODEL_NAME, dimension).search(query_vector, 3), 1):
+            print(f"  {i}. [{result['relevance']:.3f}] {result['topic']}")
+            print(f"     {result['content'][:100]}...")
+
     print("\n✨ Knowledge ingestion complete!")
     print("Lain now knows about LainCorp and her role as CEO.")
 
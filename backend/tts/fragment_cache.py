@@ -0,0 +1,215 @@
+"""
+Phrase-level audio cache for the TTS server
+
+Lain's replies reuse a small set of stock sentences ("present day...
+present time.", "the Wired is everywhere."), so replies are split into
+sentence fragments and the server learns which fragments recur. A fragment
+seen TTS_FRAGMENT_MIN_COUNT times is rendered on its own and kept; later
+replies are assembled from cached fragments plus one render per run of
+uncached text in between.
+
+Pieces are trimmed of edge silence, gain-matched to a common speech
+loudness and joined with a short pause and an equal-power crossfade, so
+reused and fresh audio sound continuous. Replies with nothing cached or
+worth caching are rendered end to end exactly as before.
+
+Frequency counts decay (halved when too many phrases are tracked), and the
+cache evicts its least frequent fragment when it exceeds its byte budget.
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+FRAGMENT_BOUNDARY = re.compile(r'(?<=[.!?…])\s+')
+
+
+def split_fragments(text: str) -> List[str]:
+    """Sentence fragments, keeping their punctuation (it shapes the prosody)"""
+    return [f.strip() for f in FRAGMENT_BOUNDARY.split(text.strip()) if f.strip()]
+
+
+def fragment_key(fragment: str) -> str:
+    return re.sub(r"\s+", " ", fragment).strip().lower()
+
+
+@dataclass
+class Fragment:
+    audio: np.ndarray  # trimmed float32 samples
+    rms: float  # speech loudness, see speech_rms
+
+
+class FragmentCache:
+    def __init__(self, render: Callable[[str, str], np.ndarray], sample_rate: int = 22050,
+                 max_bytes: int = 64 * 1024 * 1024, min_count: int = 2, max_tracked: int = 20000,
+                 crossfade_ms: float = 10.0, pause_ms: float = 150.0, silence_db: float = -40.0):
+        self.render = render
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.min_count = min_count
+        self.max_tracked = max_tracked
+        self.crossfade = int(sample_rate * crossfade_ms / 1000)
+        self.pause = int(sample_rate * pause_ms / 1000)
+        self.silence = 10 ** (silence_db / 20)
+        self.frame = max(1, sample_rate // 100)  # 10 ms analysis frames
+        self.lock = threading.Lock()
+        self.counts: Dict[str, float] = {}
+        self.entries: Dict[Tuple[str, str], Fragment] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.render_calls = 0
+        self.rendered_seconds = 0.0
+        self.reused_seconds = 0.0
+
+    # Frequency learning
+
+    def observe(self, keys: List[str]):
+        for key in keys:
+            self.counts[key] = self.counts.get(key, 0.0) + 1
+        if len(self.counts) > self.max_tracked:
+            # Decay: halve every count and forget phrases that stopped recurring
+            self.counts = {k: c / 2 for k, c in self.counts.items() if c >= 1}
+
+    def _store(self, speaker: str, key: str, fragment: Fragment):
+        with self.lock:
+            if (speaker, key) in self.entries:
+                return
+            self.entries[(speaker, key)] = fragment
+            self.bytes += fragment.audio.nbytes
+            while self.bytes > self.max_bytes and self.entries:
+                victim = min(self.entries, key=lambda k: self.counts.get(k[1], 0.0))
+                self.bytes -= self.entries.pop(victim).audio.nbytes
+
+    def _tally(self, hits: int = 0, misses: int = 0, renders: int = 0,
+               rendered_seconds: float = 0.0, reused_seconds: float = 0.0):
+        """Update the /stats counters (synthesize runs on several threads at once)"""
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+            self.render_calls += renders
+            self.rendered_seconds += rendered_seconds
+            self.reused_seconds += reused_seconds
+
+    # Audio
+
+    def _frame_rms(self, audio: np.ndarray) -> np.ndarray:
+        frames = len(audio) // self.frame
+        if not frames:
+            return np.sqrt(np.mean(np.square(audio), keepdims=True)) if len(audio) else np.zeros(1)
+        shaped = audio[:frames * self.frame].reshape(frames, self.frame)
+        return np.sqrt(np.mean(np.square(shaped), axis=1))
+
+    def trim(self, audio: np.ndarray) -> np.ndarray:
+        """Cut leading/trailing silence (frames below silence_db of the peak), keeping one frame"""
+        energy = self._frame_rms(audio)
+        voiced = np.flatnonzero(energy > energy.max() * self.silence) if energy.max() > 0 else []
+        if not len(voiced):
+            return audio
+        start = max(0, (voiced[0] - 1) * self.frame)
+        end = min(len(audio), (voiced[-1] + 2) * self.frame)
+        return audio[start:end]
+
+    def speech_rms(self, audio: np.ndarray) -> float:
+        """RMS over voiced frames only, so pauses don't skew the gain"""
+        energy = self._frame_rms(audio)
+        voiced = energy[energy > energy.max() * self.silence] if energy.max() > 0 else energy
+        return float(np.sqrt(np.mean(np.square(voiced)))) if len(voiced) else 0.0
+
+    def _render(self, text: str, speaker: str) -> Fragment:
+        audio = self.trim(np.asarray(self.render(text, speaker), dtype=np.float32))
+        self._tally(renders=1, rendered_seconds=len(audio) / self.sample_rate)
+        return Fragment(audio, self.speech_rms(audio))
+
+    def join(self, pieces: List[Fragment]) -> np.ndarray:
+        """Gain-match pieces to their median loudness, then join with pause + crossfade"""
+        levels = [p.rms for p in pieces if p.rms > 0]
+        target = float(np.median(levels)) if levels else 0.0
+        out = np.zeros(0, dtype=np.float32)
+        for i, piece in enumerate(pieces):
+            gain = float(np.clip(target / piece.rms, 0.5, 2.0)) if piece.rms > 0 and target else 1.0
+            audio = piece.audio * gain
+            if i == 0:
+                out = audio
+                continue
+            out = np.concatenate([out, np.zeros(self.pause, dtype=np.float32)])
+            n = min(self.crossfade, len(out), len(audio))
+            if n:
+                t = np.linspace(0, np.pi / 2, n, dtype=np.float32)
+                overlap = out[-n:] * np.cos(t) + audio[:n] * np.sin(t)
+                out = np.concatenate([out[:-n], overlap, audio[n:]])
+            else:
+                out = np.concatenate([out, audio])
+        return out.astype(np.float32)
+
+    # Synthesis
+
+    def synthesize(self, text: str, speaker: str, info: Optional[Dict] = None) -> np.ndarray:
+        """Render text, reusing cached fragments where possible (blocking)
+
+        If given, info receives this call's "fragments" and cache "hits".
+        """
+        fragments = split_fragments(text)
+        keys = [fragment_key(f) for f in fragments]
+        with self.lock:
+            self.observe(keys)
+            cached = [self.entries.get((speaker, key)) for key in keys]
+            admit = [entry is None and self.counts[key] >= self.min_count for entry, key in zip(cached, keys)]
+        if info is not None:
+            info["fragments"] = len(fragments)
+            info["hits"] = sum(entry is not None for entry in cached)
+
+        if not any(entry is not None for entry in cached) and not any(admit):
+            # Nothing to reuse: render the reply whole
+            audio = np.asarray(self.render(text, speaker), dtype=np.float32)
+            self._tally(misses=len(fragments), renders=1, rendered_seconds=len(audio) / self.sample_rate)
+            return audio
+
+        pieces: List[Fragment] = []
+        gap: List[str] = []
+
+        def flush():
+            if gap:
+                pieces.append(self._render(" ".join(gap), speaker))
+                gap.clear()
+
+        for fragment, key, entry, should_admit in zip(fragments, keys, cached, admit):
+            if entry is not None:
+                flush()
+                self._tally(hits=1, reused_seconds=len(entry.audio) / self.sample_rate)
+                pieces.append(entry)
+            elif should_admit:
+                flush()
+                self._tally(misses=1)
+                rendered = self._render(fragment, speaker)
+                self._store(speaker, key, rendered)
+                pieces.append(rendered)
+            else:
+                self._tally(misses=1)
+                gap.append(fragment)
+        flush()
+        return self.join(pieces)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            hits, misses, render_calls = self.hits, self.misses, self.render_calls
+            rendered_seconds, reused_seconds = self.rendered_seconds, self.reused_seconds
+            fragments, cached_bytes, tracked = len(self.entries), self.bytes, len(self.counts)
+        lookups = hits + misses
+        total_seconds = rendered_seconds + reused_seconds
+        return {
+            "fragments": fragments,
+            "bytes": cached_bytes,
+            "max_bytes": self.max_bytes,
+            "tracked_phrases": tracked,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "render_calls": render_calls,
+            "rendered_seconds": round(rendered_seconds, 2),
+            "reused_seconds": round(reused_seconds, 2),
+            "reused_ratio": reused_seconds / total_seconds if total_seconds else 0.0,
+        }
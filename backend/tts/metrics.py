@@ -0,0 +1,183 @@
+"""
+Per-request synthesis metrics for the TTS server
+
+Every synthesis is observed into Prometheus histograms (served on
+/metrics) and kept in a rolling window that /stats summarises. A request's
+record is carried in a context variable, so model calls made on the worker
+thread (asyncio.to_thread copies the context) add their lock wait and
+model time to the request that caused them.
+
+    queue      waiting for a worker thread and the model lock
+    synthesis  time inside the model
+    rtf        synthesis seconds per second of audio produced
+"""
+
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import numpy as np
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+CHARACTERS = Histogram(
+    "tts_characters",
+    "Characters of text per synthesis",
+    ["source"],
+    buckets=(10, 25, 50, 100, 200, 400, 800, 1600),
+)
+AUDIO_SECONDS = Histogram(
+    "tts_audio_seconds",
+    "Seconds of audio produced per synthesis",
+    ["source"],
+    buckets=SECONDS_BUCKETS,
+)
+SYNTHESIS_SECONDS = Histogram(
+    "tts_synthesis_seconds",
+    "Model time per synthesis",
+    ["source"],
+    buckets=SECONDS_BUCKETS,
+)
+QUEUE_SECONDS = Histogram(
+    "tts_queue_seconds",
+    "Time a synthesis waited for a worker thread and the model lock",
+    ["source"],
+    buckets=SECONDS_BUCKETS,
+)
+REAL_TIME_FACTOR = Histogram(
+    "tts_real_time_factor",
+    "Model seconds per second of audio",
+    ["source"],
+    buckets=RTF_BUCKETS,
+)
+ENCODED_BYTES = Histogram(
+    "tts_encoded_bytes",
+    "Size of the encoded WAV per synthesis",
+    ["source"],
+    buckets=(16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6),
+)
+FRAGMENTS = Counter(
+    "tts_fragments_total",
+    "Sentence fragments synthesized, by fragment cache result",
+    ["result"],
+)
+REQUESTS = Counter(
+    "tts_requests_total",
+    "Handled /synthesize requests",
+    ["outcome"],
+)
+
+
+@dataclass
+class Synthesis:
+    source: str
+    characters: int
+    created: float = field(default_factory=time.perf_counter)
+    started: Optional[float] = None
+    queue_seconds: float = 0.0
+    synthesis_seconds: float = 0.0
+    audio_seconds: float = 0.0
+    encoded_bytes: int = 0
+    fragments: int = 0
+    fragment_hits: int = 0
+
+    @property
+    def rtf(self) -> float:
+        return self.synthesis_seconds / self.audio_seconds if self.audio_seconds else 0.0
+
+
+_current: ContextVar[Optional[Synthesis]] = ContextVar("synthesis", default=None)
+_window: deque = deque(maxlen=1000)
+_totals = {"syntheses": 0, "characters": 0, "audio_seconds": 0.0, "synthesis_seconds": 0.0,
+           "encoded_bytes": 0, "fragments": 0, "fragment_hits": 0}
+
+
+def begin(source: str, text: str) -> Synthesis:
+    """Start the record for one synthesis in the current context"""
+    record = Synthesis(source, len(text))
+    _current.set(record)
+    return record
+
+
+def started():
+    """Mark the synthesis as picked up by a worker (time since begin counts as queue)"""
+    record = _current.get()
+    if record is not None and record.started is None:
+        record.started = time.perf_counter()
+        record.queue_seconds += record.started - record.created
+
+
+def observe_model(waited: float, seconds: float):
+    """Add one model call (lock wait and model time) to the current synthesis"""
+    record = _current.get()
+    if record is not None:
+        record.queue_seconds += waited
+        record.synthesis_seconds += seconds
+
+
+def finish(record: Synthesis, audio_seconds: float, encoded_bytes: int, fragments: int = 0, fragment_hits: int = 0):
+    """Record a completed synthesis"""
+    record.audio_seconds = audio_seconds
+    record.encoded_bytes = encoded_bytes
+    record.fragments = fragments
+    record.fragment_hits = fragment_hits
+
+    source = record.source
+    CHARACTERS.labels(source).observe(record.characters)
+    AUDIO_SECONDS.labels(source).observe(audio_seconds)
+    SYNTHESIS_SECONDS.labels(source).observe(record.synthesis_seconds)
+    QUEUE_SECONDS.labels(source).observe(record.queue_seconds)
+    ENCODED_BYTES.labels(source).observe(encoded_bytes)
+    if audio_seconds:
+        REAL_TIME_FACTOR.labels(source).observe(record.rtf)
+    FRAGMENTS.labels("hit").inc(fragment_hits)
+    FRAGMENTS.labels("miss").inc(fragments - fragment_hits)
+
+    _window.append(record)
+    _totals["syntheses"] += 1
+    _totals["characters"] += record.characters
+    _totals["audio_seconds"] += audio_seconds
+    _totals["synthesis_seconds"] += record.synthesis_seconds
+    _totals["encoded_bytes"] += encoded_bytes
+    _totals["fragments"] += fragments
+    _totals["fragment_hits"] += fragment_hits
+
+
+def observe_request(outcome: str):
+    REQUESTS.labels(outcome).inc()
+
+
+def summary() -> Dict:
+    """Totals since start, and percentiles over the most recent syntheses, for /stats"""
+    def percentiles(values, scale=1.0, digits=3):
+        if not values:
+            return None
+        p50, p95 = np.percentile(values, [50, 95])
+        return {"p50": round(float(p50) * scale, digits), "p95": round(float(p95) * scale, digits)}
+
+    recent = list(_window)
+    audio = _totals["audio_seconds"]
+    model = _totals["synthesis_seconds"]
+    return {
+        **{k: round(v, 2) if isinstance(v, float) else v for k, v in _totals.items()},
+        "rtf": round(model / audio, 3) if audio else None,
+        # Seconds of audio one worker can produce per second: replicas needed ~ stream load / this
+        "realtime_capacity": round(audio / model, 2) if model else None,
+        "fragment_hit_ratio": _totals["fragment_hits"] / _totals["fragments"] if _totals["fragments"] else 0.0,
+        "window": len(recent),
+        "recent_rtf": percentiles([r.rtf for r in recent if r.audio_seconds]),
+        "recent_synthesis_ms": percentiles([r.synthesis_seconds for r in recent], 1000, 1),
+        "recent_queue_ms": percentiles([r.queue_seconds for r in recent], 1000, 1),
+        "recent_chars_per_second": percentiles(
+            [r.characters / r.synthesis_seconds for r in recent if r.synthesis_seconds], digits=1
+        ),
+    }
+
+
+def render():
+    """Prometheus text exposition of all metrics: (body, content type)"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,15 +1,57 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
 import redis
 import os
+import asyncio
+import threading
 import base64
-from TTS.api import TTS
+import json
+import logging
+import socket
+import sys
+import time
+from pathlib import Path
 import soundfile as sf
 import io
 import numpy as np
 
+import metrics
+from fragment_cache import FragmentCache
+from vits_onnx import describe, load_backend
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))  # checkout; the image copies it in
+from singleflight import SingleFlight
+from stream_consumer import StreamConsumer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
+SAMPLE_RATE = 22050
+# Voice backend: auto uses the ONNX export in TTS_ONNX_PATH when present, else Coqui TTS on PyTorch
+TTS_MODEL = os.getenv('TTS_MODEL', 'tts_models/en/vctk/vits')
+TTS_BACKEND = os.getenv('TTS_BACKEND', 'auto').lower()
+TTS_ONNX_PATH = os.getenv('TTS_ONNX_PATH', '/models/tts-onnx')
+TTS_THREADS = int(os.getenv('TTS_THREADS', 0))  # intra-op threads per worker (0 = runtime default)
+# Phrase-level audio cache: recurring sentences are rendered once and reused
+TTS_FRAGMENT_CACHE = os.getenv('TTS_FRAGMENT_CACHE', 'true').lower() == 'true'
+TTS_FRAGMENT_CACHE_MB = int(os.getenv('TTS_FRAGMENT_CACHE_MB', 64))
+TTS_FRAGMENT_MIN_COUNT = int(os.getenv('TTS_FRAGMENT_MIN_COUNT', 2))  # sightings before a phrase is cached
+TTS_FRAGMENT_TRACKED = int(os.getenv('TTS_FRAGMENT_TRACKED', 20000))  # phrases counted before counts decay
+TTS_CROSSFADE_MS = float(os.getenv('TTS_CROSSFADE_MS', 10))
+TTS_FRAGMENT_PAUSE_MS = float(os.getenv('TTS_FRAGMENT_PAUSE_MS', 150))  # silence between joined sentences
+
+# Pipeline mode: consume reply sentences from the agent's stream, publish audio + visemes
+PIPELINE_STREAMS = os.getenv('PIPELINE_STREAMS', 'false').lower() == 'true'
+PIPELINE_TEXT_STREAM = os.getenv('PIPELINE_TEXT_STREAM', 'lain:text')
+PIPELINE_AUDIO_STREAM = os.getenv('PIPELINE_AUDIO_STREAM', 'lain:audio')
+PIPELINE_GROUP = os.getenv('PIPELINE_GROUP', 'tts')
+PIPELINE_CONSUMER = os.getenv('PIPELINE_CONSUMER', socket.gethostname())  # stable across restarts
+PIPELINE_CLAIM_IDLE_MS = int(os.getenv('PIPELINE_CLAIM_IDLE_MS', 30000))  # reclaim entries of dead consumers
+PIPELINE_STREAM_MAXLEN = int(os.getenv('PIPELINE_STREAM_MAXLEN', 10000))
+VISEME_FPS = int(os.getenv('VISEME_FPS', 30))
+
 # Redis connection
 redis_client = redis.Redis(
     host=os.getenv('REDIS_HOST', 'redis'),
@@ -19,7 +61,13 @@ redis_client = redis.Redis(
 
 # Initialize TTS model (using lightweight VITS model)
 # You can change this to a Lain-specific voice model if available
-tts = TTS(model_name="tts_models/en/vctk/vits", progress_bar=False)
+tts = load_backend(TTS_BACKEND, TTS_MODEL, TTS_ONNX_PATH, TTS_THREADS)
+logger.info(f"🔊 Voice backend: {describe(tts)['backend']}")
+
+# One synthesis at a time on the shared model; runs off the event loop
+tts_lock = threading.Lock()
+
+inflight_syntheses = SingleFlight()
 
 class TTSRequest(BaseModel):
     text: str
@@ -28,40 +76,150 @@ class TTSRequest(BaseModel):
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "model": "vits"}
+    return {"status": "ok", "model": "vits", "backend": describe(tts)["backend"]}
+
+def render_audio(text: str, speaker: str) -> np.ndarray:
+    """Run the model on text (blocking)"""
+    waiting = time.perf_counter()
+    with tts_lock:
+        start = time.perf_counter()
+        wav = np.asarray(tts.tts(text=text, speaker=speaker), dtype=np.float32)
+    metrics.observe_model(start - waiting, time.perf_counter() - start)
+    return wav
+
+fragment_cache = FragmentCache(
+    render_audio,
+    sample_rate=SAMPLE_RATE,
+    max_bytes=TTS_FRAGMENT_CACHE_MB * 1024 * 1024,
+    min_count=TTS_FRAGMENT_MIN_COUNT,
+    max_tracked=TTS_FRAGMENT_TRACKED,
+    crossfade_ms=TTS_CROSSFADE_MS,
+    pause_ms=TTS_FRAGMENT_PAUSE_MS
+) if TTS_FRAGMENT_CACHE else None
+
+def render_samples(text: str, speaker: str, info: dict = None) -> np.ndarray:
+    """Synthesize text (blocking), reusing cached phrases"""
+    metrics.started()
+    if fragment_cache:
+        return fragment_cache.synthesize(text, speaker, info)
+    return render_audio(text, speaker)
+
+def wav_bytes(wav: np.ndarray) -> bytes:
+    audio_buffer = io.BytesIO()
+    sf.write(audio_buffer, wav, samplerate=SAMPLE_RATE, format='WAV')
+    return audio_buffer.getvalue()
+
+def render_wav(text: str, speaker: str, info: dict = None) -> bytes:
+    """Synthesize text to WAV bytes (blocking)"""
+    wav = render_samples(text, speaker, info)
+    if info is not None:
+        info["audio_seconds"] = len(wav) / SAMPLE_RATE
+    return wav_bytes(wav)
+
+def viseme_track(wav: np.ndarray, fps: int = VISEME_FPS) -> list:
+    """Mouth shapes [aa, ih, oh] per animation frame from the waveform
+    
+    Loudness opens the mouth (aa); the zero-crossing rate separates bright,
+    fricative-heavy frames (ih) from rounded, voiced ones (oh).
+    """
+    hop = SAMPLE_RATE // fps
+    count = len(wav) // hop
+    if not count:
+        return []
+    frames = wav[:count * hop].reshape(count, hop)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    level = np.clip(rms / (np.percentile(rms, 95) + 1e-6), 0.0, 1.0)
+    zcr = np.mean(np.abs(np.diff(np.sign(frames), axis=1)), axis=1) / 2
+    brightness = np.clip(zcr / 0.3, 0.0, 1.0)
+    aa = level * (1.0 - 0.5 * brightness)
+    ih = level * brightness
+    oh = level * (1.0 - brightness) * 0.6
+    return np.round(np.stack([aa, ih, oh], axis=1).astype(np.float64), 3).tolist()
+
+def handle_text_event(fields):
+    """Render one reply sentence and publish its audio and viseme track"""
+    text = fields[b"text"].decode()
+    speaker = fields.get(b"speaker", b"p225").decode()
+    record = metrics.begin("pipeline", text)
+    info = {}
+    wav = render_samples(text, speaker, info)
+    audio = wav_bytes(wav)
+    metrics.finish(record, len(wav) / SAMPLE_RATE, len(audio), info.get("fragments", 0), info.get("hits", 0))
+    redis_client.xadd(PIPELINE_AUDIO_STREAM, {
+        "reply_id": fields[b"reply_id"],
+        "seq": fields[b"seq"],
+        "final": fields[b"final"],
+        "mood": fields.get(b"mood", b"neutral"),
+        "ts": fields[b"ts"],
+        "audio": audio,
+        "sample_rate": SAMPLE_RATE,
+        "duration": round(len(wav) / SAMPLE_RATE, 3),
+        "viseme_fps": VISEME_FPS,
+        "visemes": json.dumps(viseme_track(wav))
+    }, maxlen=PIPELINE_STREAM_MAXLEN, approximate=True)
+
+pipeline_consumer = StreamConsumer(
+    redis_client, PIPELINE_TEXT_STREAM, PIPELINE_GROUP, PIPELINE_CONSUMER, handle_text_event,
+    claim_idle_ms=PIPELINE_CLAIM_IDLE_MS, dead_maxlen=PIPELINE_STREAM_MAXLEN
+) if PIPELINE_STREAMS else None
+pipeline_stop = threading.Event()
+
+@app.on_event("startup")
+async def start_pipeline():
+    if pipeline_consumer:
+        threading.Thread(target=pipeline_consumer.run, args=(pipeline_stop,), name="pipeline", daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_pipeline():
+    pipeline_stop.set()
+
+async def synthesize_once(request: TTSRequest) -> str:
+    """Synthesize, cache and base64-encode one reply; shared by identical requests"""
+    record = metrics.begin("http", request.text)
+    info = {}
+    audio_bytes = await asyncio.to_thread(render_wav, request.text, request.speaker, info)
+    metrics.finish(record, info["audio_seconds"], len(audio_bytes), info.get("fragments", 0), info.get("hits", 0))
+    
+    # Cache in Redis (expire after 1 hour)
+    cache_key = f"tts:{hash(request.text + request.speaker)}"
+    redis_client.setex(cache_key, 3600, audio_bytes)
+    
+    # Encode to base64 for transport
+    return base64.b64encode(audio_bytes).decode('utf-8')
 
 @app.post("/synthesize")
 async def synthesize(request: TTSRequest):
     try:
-        # Generate speech
-        wav = tts.tts(text=request.text, speaker=request.speaker)
-        
-        # Convert to audio bytes
-        audio_buffer = io.BytesIO()
-        sf.write(audio_buffer, wav, samplerate=22050, format='WAV')
-        audio_bytes = audio_buffer.getvalue()
-        
-        # Encode to base64 for transport
-        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-        
-        # Cache in Redis (expire after 1 hour)
-        cache_key = f"tts:{hash(request.text + request.speaker)}"
-        redis_client.setex(cache_key, 3600, audio_bytes)
+        key = (request.text, request.speaker)  # speed is not used by synthesis (nor the Redis cache key)
+        audio_base64 = await inflight_syntheses.do(key, lambda: synthesize_once(request))
+        metrics.observe_request("ok")
         
         return {
             "success": True,
             "audio": audio_base64,
             "format": "wav",
-            "sample_rate": 22050
+            "sample_rate": SAMPLE_RATE
         }
     except Exception as e:
+        metrics.observe_request("error")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-request synthesis histograms (RTF, queue wait, audio, bytes) in Prometheus format"""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/stats")
 async def stats():
     return {
         "model": "vits",
-        "speakers_available": len(tts.speakers) if hasattr(tts, 'speakers') else 0
+        "speakers_available": len(tts.speakers) if hasattr(tts, 'speakers') else 0,
+        "backend": describe(tts),
+        "synthesis": metrics.summary(),
+        "request_coalescing": inflight_syntheses.stats(),
+        "fragment_cache": fragment_cache.stats() if fragment_cache else None,
+        "pipeline": pipeline_consumer.stats() if pipeline_consumer else None
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+VITS inference backends for the TTS server
+
+TTS_BACKEND selects how tts_models/en/vctk/vits is run:
+
+    torch  Coqui TTS on PyTorch (the original path)
+    onnx   an ONNX export of the same model on ONNX Runtime
+    auto   onnx when an export is present and passed its parity check,
+           otherwise torch (default)
+
+The ONNX backend reproduces what Coqui's Synthesizer does around the
+model: pysbd sentence splitting, the model's own tokenizer (espeak
+phonemes), end-of-sentence silence trimming and the 10000-sample gap
+after each sentence. The tokenizer comes from the TTS package, which
+imports torch as a library, but the PyTorch model and its Coqui wrappers
+are never loaded. All VCTK speakers stay selectable: the speaker id is
+a graph input and the name -> id map is saved with the export.
+
+Export once (needs the Coqui model; the image does it when built with
+--build-arg TTS_ONNX_EXPORT=true):
+
+    python vits_onnx.py export /models/tts-onnx
+
+The export is rendered deterministically (noise scales 0) next to the
+PyTorch model on PARITY_TEXTS and the audio compared (length ratio and
+log-spectrogram cosine similarity); the results are recorded in
+vits_onnx.json and an export below --min-similarity is never loaded.
+"""
+
+import argparse
+import inspect
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "tts_models/en/vctk/vits"
+CONFIG_FILE = "vits_onnx.json"
+COQUI_CONFIG_FILE = "config.json"
+MODEL_FILE = "vits.onnx"
+SENTENCE_GAP = 10000  # samples of silence Coqui appends after every sentence
+
+# Things Lain says, short and long, with the punctuation that shapes prosody
+PARITY_TEXTS = [
+    "Present day, present time.",
+    "No matter where you go, everyone's connected.",
+    "The Wired is everywhere... are you listening?",
+    "LainCorp runs on the Internet Computer; the stream never really stops.",
+    "hey. you came back.",
+]
+
+
+class OnnxVits:
+    """Coqui TTS-compatible (tts(text=..., speaker=...)) VITS on ONNX Runtime"""
+
+    def __init__(self, path: Union[str, Path], threads: int = 0, config: Optional[Dict] = None):
+        import onnxruntime as ort
+        import pysbd
+        from TTS.config import load_config
+        from TTS.tts.utils.text.tokenizer import TTSTokenizer
+
+        self.path = Path(path)
+        if config is None:
+            config = json.loads((self.path / CONFIG_FILE).read_text())
+            parity = config.get("parity") or {}
+            if not parity.get("passed"):
+                raise ValueError(f"export at {self.path} did not pass its parity check ({parity})")
+        # else: export_onnx checking a candidate whose config is not written yet
+        self.config = config
+
+        self.model_name = self.config["model_name"]
+        self.sample_rate = self.config["sample_rate"]
+        self.speaker_ids = self.config["speakers"]
+        self.scales = np.array(self.config["scales"], dtype=np.float32)  # noise, length, duration noise
+        self.tokenizer, _ = TTSTokenizer.init_from_config(load_config(str(self.path / COQUI_CONFIG_FILE)))
+        self.segmenter = pysbd.Segmenter(language="en", clean=True)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.threads = threads
+        self.session = ort.InferenceSession(
+            str(self.path / MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def speakers(self) -> List[str]:
+        return list(self.speaker_ids)
+
+    def _trim(self, wav: np.ndarray) -> np.ndarray:
+        """Cut trailing silence as Coqui's AudioProcessor.find_endpoint does"""
+        if not self.config["trim_silence"]:
+            return wav
+        window = int(self.sample_rate * 0.8)
+        hop = window // 4
+        for x in range(hop, len(wav) - window, hop):
+            if np.max(wav[x:x + window]) < self.config["trim_threshold"]:
+                return wav[:x + hop]
+        return wav
+
+    def synthesize(self, text: str, speaker: Optional[str] = None, scales: Optional[np.ndarray] = None) -> np.ndarray:
+        """One sentence to float32 samples"""
+        ids = np.asarray(self.tokenizer.text_to_ids(text), dtype=np.int64)[None, :]
+        feeds = {
+            "input": ids,
+            "input_lengths": np.array([ids.shape[1]], dtype=np.int64),
+            "scales": self.scales if scales is None else np.asarray(scales, dtype=np.float32),
+        }
+        if "sid" in self.input_names:
+            if speaker not in self.speaker_ids:
+                raise ValueError(f"unknown speaker: {speaker}")
+            feeds["sid"] = np.array([self.speaker_ids[speaker]], dtype=np.int64)
+        return self.session.run(None, feeds)[0][0, 0]
+
+    def tts(self, text: str, speaker: Optional[str] = None, scales: Optional[np.ndarray] = None, **_) -> np.ndarray:
+        """Render text sentence by sentence, joined the way Coqui's Synthesizer joins them (float32)"""
+        gap = np.zeros(SENTENCE_GAP, dtype=np.float32)
+        pieces: List[np.ndarray] = []
+        for sentence in self.segmenter.segment(text):
+            pieces += [self._trim(self.synthesize(sentence, speaker, scales)).astype(np.float32, copy=False), gap]
+        return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+
+
+def load_backend(backend: str = "auto", model_name: str = DEFAULT_MODEL,
+                 onnx_path: Optional[Union[str, Path]] = None, threads: int = 0):
+    """Load the voice for TTS_BACKEND; auto falls back to torch if the ONNX export is unusable"""
+    if backend not in ("auto", "onnx", "torch"):
+        raise ValueError(f"unknown TTS backend: {backend}")
+    if backend in ("auto", "onnx") and onnx_path:
+        try:
+            return OnnxVits(onnx_path, threads)
+        except Exception as e:
+            if backend == "onnx":
+                raise
+            logger.warning(f"⚠ ONNX voice unavailable ({e}), using Coqui TTS on PyTorch")
+    elif backend == "onnx":
+        raise ValueError("TTS_BACKEND=onnx needs TTS_ONNX_PATH")
+
+    from TTS.api import TTS
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return TTS(model_name=model_name, progress_bar=False)
+
+
+def describe(tts) -> Dict[str, Any]:
+    """Backend details for /stats"""
+    if isinstance(tts, OnnxVits):
+        return {
+            "backend": "onnx",
+            "model": tts.model_name,
+            "path": str(tts.path),
+            "threads": tts.threads or "default",
+            "parity_min_similarity": tts.config["parity"]["min_similarity"],
+        }
+    return {"backend": "torch", "model": tts.model_name}
+
+
+def log_spectrogram(wav: np.ndarray, n_fft: int = 1024, hop: int = 256) -> np.ndarray:
+    frames = 1 + max(0, len(wav) - n_fft) // hop
+    padded = np.pad(wav, (0, max(0, n_fft - len(wav))))
+    windows = np.lib.stride_tricks.as_strided(
+        padded, shape=(frames, n_fft), strides=(padded.strides[0] * hop, padded.strides[0])
+    ) * np.hanning(n_fft)
+    return np.log1p(np.abs(np.fft.rfft(windows, axis=1)))
+
+
+def audio_parity(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """How closely two renderings of the same text match
+
+    length_ratio compares durations (the duration predictor must agree);
+    similarity is the cosine similarity of their log-magnitude spectrograms
+    over the common length, which ignores sub-sample phase differences.
+    """
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    n = min(len(reference), len(candidate))
+    a = log_spectrogram(reference[:n]).ravel()
+    b = log_spectrogram(candidate[:n]).ravel()
+    return {
+        "length_ratio": len(candidate) / max(1, len(reference)),
+        "similarity": float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12)),
+    }
+
+
+def export_onnx(out_dir: Path, model_name: str = DEFAULT_MODEL, min_similarity: float = 0.95,
+                opset: int = 15) -> Dict:
+    """Export the VITS graph (text ids -> waveform) to ONNX and check parity against PyTorch"""
+    import torch
+    from TTS.api import TTS
+
+    reference = TTS(model_name=model_name, progress_bar=False)
+    synthesizer = reference.synthesizer
+    model = synthesizer.tts_model.eval()
+    ap = model.ap
+    defaults = [float(model.inference_noise_scale), float(model.length_scale), float(model.inference_noise_scale_dp)]
+    speakers = dict(model.speaker_manager.name_to_id) if model.speaker_manager is not None else {}
+
+    class VitsGraph(torch.nn.Module):
+        """Model inference with the noise and length scales as inputs rather than constants"""
+
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input, input_lengths, scales, sid=None):
+            self.model.inference_noise_scale = scales[0]
+            self.model.length_scale = scales[1]
+            self.model.inference_noise_scale_dp = scales[2]
+            return self.model.inference(input, aux_input={
+                "x_lengths": input_lengths, "d_vectors": None, "speaker_ids": sid,
+                "language_ids": None, "durations": None,
+            })["model_outputs"]
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # The config marks an export as checked: drop any previous one before replacing the model
+    config_path = out_dir / CONFIG_FILE
+    config_path.unlink(missing_ok=True)
+    synthesizer.tts_config.save_json(str(out_dir / COQUI_CONFIG_FILE))
+    ids = torch.LongTensor([model.tokenizer.text_to_ids(PARITY_TEXTS[0])])
+    sample = (ids, torch.LongTensor([ids.shape[1]]), torch.FloatTensor(defaults))
+    input_names = ["input", "input_lengths", "scales"]
+    if speakers:
+        sample += (torch.LongTensor([0]),)
+        input_names.append("sid")
+    # TorchScript exporter: recent torch defaults to dynamo, which needs onnxscript
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                VitsGraph(),
+                sample,
+                str(out_dir / MODEL_FILE),
+                input_names=input_names,
+                output_names=["output"],
+                dynamic_axes={"input": {0: "batch", 1: "phonemes"}, "input_lengths": {0: "batch"},
+                              "output": {0: "batch", 2: "samples"}},
+                opset_version=opset,
+                **legacy
+            )
+    finally:
+        model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp = defaults
+
+    config = {
+        "model_name": model_name,
+        "sample_rate": ap.sample_rate,
+        "speakers": speakers,
+        "scales": defaults,
+        "trim_silence": bool("do_trim_silence" in synthesizer.tts_config.audio
+                             and synthesizer.tts_config.audio["do_trim_silence"]),
+        "trim_threshold": float(ap.base) ** (-ap.trim_db / ap.spec_gain),  # AudioProcessor's db_to_amp
+    }
+
+    # Noise off on both sides so the renderings are deterministic and comparable
+    candidate = OnnxVits(out_dir, config=config)
+    speaker = next(iter(speakers), None)
+    results = []
+    model.inference_noise_scale = model.inference_noise_scale_dp = 0.0
+    try:
+        for text in PARITY_TEXTS:
+            expected = np.asarray(reference.tts(text=text, speaker=speaker), dtype=np.float32)
+            actual = candidate.tts(text, speaker, scales=[0.0, defaults[1], 0.0])
+            results.append(audio_parity(expected, actual))
+    finally:
+        model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp = defaults
+
+    parity = {
+        "min_similarity": min(r["similarity"] for r in results),
+        "mean_similarity": float(np.mean([r["similarity"] for r in results])),
+        "max_length_error": max(abs(1 - r["length_ratio"]) for r in results),
+        "threshold": min_similarity,
+    }
+    parity["passed"] = parity["min_similarity"] >= min_similarity and parity["max_length_error"] < 0.02
+    config["parity"] = parity
+
+    # Written only once parity is measured, atomically: an interrupted export leaves no config
+    tmp_path = config_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(config, indent=2))
+    os.replace(tmp_path, config_path)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VITS voice tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export an ONNX copy of the voice")
+    export.add_argument("out_dir", type=Path)
+    export.add_argument("--model", default=os.getenv("TTS_MODEL", DEFAULT_MODEL))
+    export.add_argument("--min-similarity", type=float, default=0.95,
+                        help="lowest spectrogram cosine similarity to the PyTorch rendering to accept")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    print(f"Exporting {args.model} to {args.out_dir}...")
+    config = export_onnx(args.out_dir, args.model, min_similarity=args.min_similarity)
+    parity = config["parity"]
+    size_mb = (args.out_dir / MODEL_FILE).stat().st_size / 1e6
+    print(f"  {MODEL_FILE}: {size_mb:.1f} MB, {len(config['speakers'])} speakers, "
+          f"exported in {time.perf_counter() - start:.1f}s")
+    print(f"  Parity vs PyTorch: min similarity {parity['min_similarity']:.4f}, "
+          f"mean {parity['mean_similarity']:.4f}, max length error {parity['max_length_error']:.2%}")
+    if not parity["passed"]:
+        raise SystemExit(f"❌ Parity below {args.min_similarity}; the export will not be used")
+    print("✓ ONNX voice ready")
+
+
+if __name__ == "__main__":
+    main()
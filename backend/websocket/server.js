@@ -54,6 +54,81 @@ function broadcast(data) {
   console.log(`Broadcast to ${clients.size} clients:`, data.type);
 }
 
+// Pipeline mode: the agent streams reply sentences through TTS and animation (Redis Streams);
+// finished audio + frame tracks arrive on PIPELINE_FRAME_STREAM and are fanned out here
+const PIPELINE_STREAMS = process.env.PIPELINE_STREAMS === 'true';
+const PIPELINE_FRAME_STREAM = process.env.PIPELINE_FRAME_STREAM || 'lain:frames';
+
+// lain_av as one binary message for clients connected with /ws?av=binary:
+// u32 LE header length, JSON header (frames_bytes, audio_bytes), packed frames, WAV audio.
+// Frames use the layout and frame_format of the animation service's /schema.
+function encodeAvMessage(header, frames, audio) {
+  const json = Buffer.from(JSON.stringify({ ...header, frames_bytes: frames.length, audio_bytes: audio.length }));
+  const length = Buffer.alloc(4);
+  length.writeUInt32LE(json.length, 0);
+  return Buffer.concat([length, json, frames, audio]);
+}
+
+// Other clients get JSON with base64 frames and audio; each encoding is built at most once per chunk
+function broadcastAv(header, frames, audio) {
+  let text = null;
+  let binary = null;
+  clients.forEach((client) => {
+    if (client.readyState !== WebSocket.OPEN) {
+      return;
+    }
+    if (client.avBinary) {
+      binary = binary || encodeAvMessage(header, frames, audio);
+      client.send(binary);
+    } else {
+      text = text || JSON.stringify({ ...header, frames: frames.toString('base64'), audio: audio.toString('base64') });
+      client.send(text);
+    }
+  });
+  console.log(`Broadcast to ${clients.size} clients:`, header.type);
+}
+
+async function forwardPipelineFrames() {
+  // Blocking reads need a connection of their own
+  const streamClient = redisClient.duplicate();
+  streamClient.on('error', (err) => console.error('Redis stream error:', err));
+  await streamClient.connect();
+
+  // Every instance sees every chunk (plain XREAD, no consumer group): live only, from now on
+  let lastId = '$';
+  while (true) {
+    try {
+      const result = await streamClient.xRead(
+        redis.commandOptions({ returnBuffers: true }),
+        { key: PIPELINE_FRAME_STREAM, id: lastId },
+        { BLOCK: 5000, COUNT: 16 }
+      );
+      for (const stream of result || []) {
+        for (const { id, message } of stream.messages) {
+          lastId = id.toString();
+          broadcastAv({
+            type: 'lain_av',
+            reply_id: message.reply_id.toString(),
+            seq: parseInt(message.seq.toString(), 10),
+            final: message.final.toString() === '1',
+            mood: message.mood.toString(),
+            fps: parseInt(message.fps.toString(), 10),
+            frame_format: message.frame_format.toString(),
+            sample_rate: parseInt(message.sample_rate.toString(), 10)
+          }, message.frames, message.audio);
+        }
+      }
+    } catch (error) {
+      console.error('Error reading pipeline frames:', error);
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  }
+}
+
+// /generate deadlines: live replies go stale quickly, monologues a little later
+const CHAT_DEADLINE_MS = parseInt(process.env.CHAT_DEADLINE_MS || '8000', 10);
+const BROADCAST_DEADLINE_MS = parseInt(process.env.BROADCAST_DEADLINE_MS || '15000', 10);
+
 // Process a user message and generate interactive response
 async function processUserMessage(userMessage) {
   if (isBroadcasting) {
@@ -84,8 +159,14 @@ async function processUserMessage(userMessage) {
         message: userMessage.message,
         user_id: userMessage.user_id || 'anonymous',
         username: userMessage.username || 'Anonymous',
-        include_memory: true
-      })
+        include_memory: true,
+        // Live chat jumps the model queue; past the deadline a canned reply keeps the stream moving
+        priority: 'live',
+        deadline_ms: CHAT_DEADLINE_MS,
+        on_deadline: 'degrade'
+      }),
+      // Giving up closes the connection, which cancels the generation in the agent
+      signal: AbortSignal.timeout(CHAT_DEADLINE_MS + 2000)
     });
 
     const lainResponse = await response.json();
@@ -96,6 +177,7 @@ async function processUserMessage(userMessage) {
       message: lainResponse.response,
       mood: lainResponse.mood,
       animation: lainResponse.animation,
+      reply_id: lainResponse.reply_id,
       timestamp: new Date().toISOString(),
       broadcast_id: Date.now(),
       in_response_to: {
@@ -166,10 +248,20 @@ async function generateAndBroadcast() {
       body: JSON.stringify({
         message: randomPrompt,
         user_id: 'broadcast',
-        username: 'Broadcast'
-      })
+        username: 'Broadcast',
+        // Filler monologues yield to viewers and are dropped once stale
+        priority: 'broadcast',
+        deadline_ms: BROADCAST_DEADLINE_MS,
+        on_deadline: 'drop'
+      }),
+      signal: AbortSignal.timeout(BROADCAST_DEADLINE_MS + 2000)
     });
 
+    if (!response.ok) {
+      console.log(`Skipping broadcast, LainLLM returned ${response.status}`);
+      return;
+    }
+
     const lainResponse = await response.json();
     
     // Store current message
@@ -178,6 +270,7 @@ async function generateAndBroadcast() {
       message: lainResponse.response,
       mood: lainResponse.mood,
       animation: lainResponse.animation,
+      reply_id: lainResponse.reply_id,
       timestamp: new Date().toISOString(),
       broadcast_id: Date.now()
     };
@@ -220,8 +313,10 @@ function startBroadcastLoop() {
 }
 
 // WebSocket connection handler
-wss.on('connection', (ws) => {
+wss.on('connection', (ws, req) => {
   console.log('New client connected');
+  // Pipeline audio + frames as binary messages instead of base64 JSON
+  ws.avBinary = new URL(req.url, 'http://localhost').searchParams.get('av') === 'binary';
   clients.add(ws);
 
   // Send sync message with current state
@@ -230,6 +325,7 @@ wss.on('connection', (ws) => {
     current_message: currentMessage,
     is_broadcasting: isBroadcasting,
     last_broadcast_time: lastBroadcastTime,
+    av_format: ws.avBinary ? 'binary' : 'json',
     timestamp: new Date().toISOString()
   }));
 
@@ -318,4 +414,8 @@ server.listen(PORT, () => {
   console.log('🎬 BROADCAST MODE ENABLED - All clients see synchronized content');
   // Start the broadcast loop
   startBroadcastLoop();
+  if (PIPELINE_STREAMS) {
+    console.log(`🎞️ Forwarding pipeline frames from ${PIPELINE_FRAME_STREAM}`);
+    forwardPipelineFrames();
+  }
 });